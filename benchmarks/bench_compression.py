@@ -0,0 +1,77 @@
+"""对比压缩（.jsonl.gz / .jsonl.zst）与未压缩会话的解析吞吐量
+
+同一个合成会话分别以未压缩、gzip 和 zstd（可用时）保存，测量解析耗时（文件已在页缓存中，
+只包含解压和解析的 CPU 开销），并按 --disk-mbps 给定的磁盘带宽估算冷读取时的总耗时：
+压缩文件要从磁盘读取的字节少得多，磁盘越慢，压缩格式越快。
+
+用法：python benchmarks/bench_compression.py [--size-mb 50] [--repeat 3] [--disk-mbps 100]
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import generate_claude_session
+from scripts.universal_export import ClaudeCodeParser, open_compressed
+
+
+def compress_file(src, dst, suffix):
+    """把 src 压缩为 dst，不支持该格式时返回 False"""
+    try:
+        with open(src, 'rb') as f, open_compressed(dst, suffix, 'wb') as out:
+            shutil.copyfileobj(f, out, 1 << 20)
+    except ImportError as e:
+        print(f'跳过 {suffix}：{e}')
+        return False
+    return True
+
+
+def measure(func, repeat):
+    """返回 func 多次运行中最快的一次耗时与结果"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='压缩会话与未压缩会话的解析吞吐量对比')
+    parser.add_argument('--size-mb', type=int, default=50, help='合成会话文件大小（解压后，MB）')
+    parser.add_argument('--repeat', type=int, default=3, help='每种格式重复次数（取最快）')
+    parser.add_argument('--disk-mbps', type=float, default=100, help='估算冷读取耗时用的磁盘带宽（MB/s）')
+    args = parser.parse_args()
+
+    claude = ClaudeCodeParser()
+    mb = 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        plain = os.path.join(temp_dir, 'session.jsonl')
+        size = generate_claude_session(plain, args.size_mb * mb)
+        files = [('未压缩', plain)]
+        for suffix in ('.gz', '.zst'):
+            if compress_file(plain, plain + suffix, suffix):
+                files.append((suffix, plain + suffix))
+
+        print(f'会话文件：{size / mb:.1f} MB，磁盘带宽按 {args.disk_mbps:.0f} MB/s 估算')
+        print(f'{"格式":<8}{"文件大小":>12}{"解析耗时":>12}{"吞吐量":>14}{"估算冷读取":>14}')
+        expected = None
+        for name, path in files:
+            elapsed, messages = measure(lambda: claude.parse_session(path, include_tools=True), args.repeat)
+            if expected is None:
+                expected = messages
+            assert messages == expected, f'{name} 的解析结果与未压缩文件不一致'
+            file_size = os.path.getsize(path)
+            cold = elapsed + file_size / mb / args.disk_mbps
+            print(f'{name:<8}{file_size / mb:>10.1f}MB{elapsed:>11.3f}s{size / mb / elapsed:>10.1f}MB/s{cold:>13.3f}s')
+
+
+if __name__ == '__main__':
+    main()
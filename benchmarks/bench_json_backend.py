@@ -0,0 +1,85 @@
+"""对比 Claude Code 会话解析在不同 JSON 后端 / 字节预过滤下的吞吐量
+
+用法：python benchmarks/bench_json_backend.py [--size-mb 50] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import generate_claude_session
+from scripts import universal_export
+from scripts.universal_export import ClaudeCodeParser
+
+
+def baseline_parse(parser, filepath):
+    """旧实现：文本模式逐行 json.loads，不做预过滤"""
+    messages = []
+    with open(filepath, encoding='utf-8') as f:
+        for line in f:
+            try:
+                message = parser._record_to_message(json.loads(line.strip()), True)
+            except Exception:
+                continue
+            if message:
+                messages.append(message)
+    return messages
+
+
+def measure(func, repeat):
+    """返回 func 多次运行中最快的一次耗时与结果"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='JSON 后端与字节预过滤吞吐量对比')
+    parser.add_argument('--size-mb', type=int, default=50, help='合成会话文件大小（MB）')
+    parser.add_argument('--repeat', type=int, default=3, help='每种配置重复次数（取最快）')
+    args = parser.parse_args()
+
+    claude = ClaudeCodeParser()
+    fast_backend, fast_loads = universal_export.select_json_backend()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_file = os.path.join(temp_dir, 'session.jsonl')
+        size = generate_claude_session(session_file, args.size_mb * 1024 * 1024)
+        print(f'会话文件：{size / 1024 / 1024:.1f} MB')
+
+        configs = [('基线（文本模式 + json，无预过滤）', lambda: baseline_parse(claude, session_file))]
+
+        def with_backend(loads):
+            def run():
+                universal_export.json_loads = loads
+                try:
+                    return claude.parse_session(session_file, include_tools=True)
+                finally:
+                    universal_export.json_loads = fast_loads
+            return run
+
+        configs.append(('字节预过滤 + json', with_backend(json.loads)))
+        if fast_backend != 'json':
+            configs.append((f'字节预过滤 + {fast_backend}', with_backend(fast_loads)))
+
+        baseline_time = None
+        expected = None
+        for name, func in configs:
+            elapsed, messages = measure(func, args.repeat)
+            if expected is None:
+                baseline_time, expected = elapsed, messages
+            assert messages == expected, f'{name} 的解析结果与基线不一致'
+            print(f'{name:<36} {elapsed:7.3f}s  {size / 1024 / 1024 / elapsed:8.1f} MB/s  x{baseline_time / elapsed:.2f}')
+
+
+if __name__ == '__main__':
+    main()
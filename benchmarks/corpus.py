@@ -0,0 +1,189 @@
+"""合成聊天记录语料生成器
+
+生成与真实数据结构一致的 Claude Code 会话（.jsonl）和 GPT / Gemini 导出（.json），
+大小和内容比例可配置，结果只取决于随机种子，便于重复测量。
+
+内容比例（mix）：
+- long_tools：大量工具调用和大段工具返回结果（读文件、列目录、测试日志）
+- tiny_turns：大量很短的来回对话
+- unicode：中文、emoji 和需要转义的字符占多数的文本
+- default：以上几种再加上文件快照、进度等无关记录的混合
+"""
+import json
+import os
+import random
+
+MIXES = ('default', 'long_tools', 'tiny_turns', 'unicode')
+
+_WORDS = ['function', 'return', 'error', 'config', 'module', 'request', 'value', 'index', 'parse', 'export']
+_CHINESE = '请帮我检查这个函数的实现是否正确并说明原因导出聊天记录会话解析性能优化中文测试'
+_EMOJI = '🚀📄✅🤖🧑🔥'
+
+
+def _timestamp(i):
+    """第 i 条记录的时间戳（每条间隔 7 秒，严格递增）"""
+    seconds = i * 7
+    day = 1 + seconds // 86400
+    return f'2026-01-{day:02d}T{(seconds // 3600) % 24:02d}:{(seconds // 60) % 60:02d}:{seconds % 60:02d}.000Z'
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(_WORDS) for _ in range(words))
+
+
+def _chinese(rng, chars):
+    return ''.join(rng.choice(_CHINESE) for _ in range(chars))
+
+
+def _unicode_text(rng, chars):
+    parts = []
+    for _ in range(chars // 8 + 1):
+        parts.append(_chinese(rng, 6) + rng.choice(_EMOJI) + rng.choice(['"', '\\', '\t', '\n', 'é']))
+    return ''.join(parts)[:chars]
+
+
+def _envelope(i, record_type, cwd, session_id):
+    return {
+        'parentUuid': f'{session_id}-{i - 1}' if i else None,
+        'isSidechain': False,
+        'userType': 'external',
+        'cwd': cwd,
+        'sessionId': session_id,
+        'version': '2.0.0',
+        'type': record_type,
+        'uuid': f'{session_id}-{i}',
+        'timestamp': _timestamp(i),
+    }
+
+
+def _user(i, content, cwd, session_id):
+    record = _envelope(i, 'user', cwd, session_id)
+    record['message'] = {'role': 'user', 'content': content}
+    return record
+
+
+def _assistant(i, content, cwd, session_id, rng):
+    record = _envelope(i, 'assistant', cwd, session_id)
+    record['message'] = {
+        'model': 'claude-sonnet-4', 'id': f'msg_{i}', 'type': 'message', 'role': 'assistant', 'content': content,
+        'usage': {'input_tokens': rng.randint(10, 5000), 'output_tokens': rng.randint(10, 2000),
+                  'cache_read_input_tokens': rng.randint(0, 50000)},
+    }
+    return record
+
+
+def _tool_pair(i, rng, cwd, session_id, payload_size):
+    """一次工具调用及其返回结果"""
+    tool = rng.choice(['Read', 'Bash', 'Grep', 'Write'])
+    tool_id = f'toolu_{session_id}_{i}'
+    if tool == 'Write':
+        tool_input = {'file_path': f'/src/pkg/module_{i}.py', 'content': _sentence(rng, payload_size // 7)}
+    else:
+        tool_input = {'command': f'pytest -q tests/test_{i}.py', 'file_path': f'/src/pkg/module_{i}.py'}
+    call = _assistant(i, [{'type': 'tool_use', 'id': tool_id, 'name': tool, 'input': tool_input}], cwd, session_id, rng)
+    lines = [f'{n:5d}\t{_sentence(rng, 8)}' for n in range(max(1, payload_size // 60))]
+    result = _user(i + 1, [{'type': 'tool_result', 'tool_use_id': tool_id, 'content': '\n'.join(lines)}], cwd, session_id)
+    return [call, result]
+
+
+def _noise(i, rng, cwd, session_id):
+    """不产生消息的记录：文件快照、进度、系统记录、摘要"""
+    kind = rng.random()
+    if kind < 0.4:
+        backups = {f'/src/pkg/module_{n}.py': {'backupFileName': f'{n:08x}@v2', 'version': 2, 'backupTime': _timestamp(i)}
+                   for n in range(rng.randint(20, 200))}
+        return {'type': 'file-history-snapshot', 'messageId': f'msg_{i}', 'snapshot': {'trackedFileBackups': backups}}
+    if kind < 0.8:
+        record = _envelope(i, 'progress', cwd, session_id)
+        record['data'] = {'type': 'hook_progress', 'lines': [{'n': n, 'text': 'running...'} for n in range(rng.randint(20, 500))]}
+        return record
+    if kind < 0.95:
+        record = _envelope(i, 'system', cwd, session_id)
+        record['content'] = _sentence(rng, rng.randint(10, 300))
+        return record
+    return {'type': 'summary', 'summary': _sentence(rng, 8), 'leafUuid': f'{session_id}-{i}'}
+
+
+def _records(rng, mix, cwd, session_id):
+    """按内容比例无限产出会话记录"""
+    i = 0
+    while True:
+        kind = rng.random()
+        if mix == 'tiny_turns':
+            batch = [_user(i, _sentence(rng, rng.randint(1, 6)), cwd, session_id)] if kind < 0.5 else \
+                [_assistant(i, [{'type': 'text', 'text': _sentence(rng, rng.randint(1, 10))}], cwd, session_id, rng)]
+        elif mix == 'long_tools':
+            if kind < 0.7:
+                batch = _tool_pair(i, rng, cwd, session_id, rng.randint(2000, 60000))
+            elif kind < 0.85:
+                batch = [_user(i, _sentence(rng, rng.randint(5, 50)), cwd, session_id)]
+            else:
+                batch = [_assistant(i, [{'type': 'text', 'text': _sentence(rng, rng.randint(20, 200))}], cwd, session_id, rng)]
+        elif mix == 'unicode':
+            if kind < 0.5:
+                batch = [_user(i, _unicode_text(rng, rng.randint(10, 400)), cwd, session_id)]
+            else:
+                batch = [_assistant(i, [{'type': 'text', 'text': _unicode_text(rng, rng.randint(50, 2000))}], cwd, session_id, rng)]
+        else:
+            if kind < 0.2:
+                batch = [_user(i, _chinese(rng, rng.randint(5, 80)), cwd, session_id)]
+            elif kind < 0.4:
+                batch = [_assistant(i, [{'type': 'text', 'text': _sentence(rng, rng.randint(10, 300))}], cwd, session_id, rng)]
+            elif kind < 0.65:
+                batch = _tool_pair(i, rng, cwd, session_id, rng.randint(200, 20000))
+            else:
+                batch = [_noise(i, rng, cwd, session_id)]
+        for record in batch:
+            yield record
+        i += len(batch)
+
+
+def generate_claude_session(path, size_bytes, mix='default', seed=0, cwd='/work/project'):
+    """生成一个约 size_bytes 大小的 Claude Code 会话文件，返回实际字节数"""
+    if mix not in MIXES:
+        raise ValueError(f'未知的内容比例: {mix}')
+    rng = random.Random(f'{seed}-{mix}')
+    session_id = os.path.splitext(os.path.basename(path))[0]
+    written = 0
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        for record in _records(rng, mix, cwd, session_id):
+            if written >= size_bytes:
+                break
+            line = json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n'
+            f.write(line)
+            written += len(line.encode('utf-8'))
+    return written
+
+
+def generate_claude_corpus(root, projects=3, sessions_per_project=5, session_size=64 * 1024, mixes=MIXES, seed=0):
+    """在 root/projects 下生成多个项目和会话（与 ~/.claude 目录结构一致），返回会话文件列表"""
+    files = []
+    for p in range(projects):
+        cwd = f'/work/project-{p}'
+        project_dir = os.path.join(root, 'projects', cwd.replace('/', '-'))
+        os.makedirs(project_dir, exist_ok=True)
+        for n in range(sessions_per_project):
+            path = os.path.join(project_dir, f'{p:04d}{n:04d}-0000-4000-8000-000000000000.jsonl')
+            mix = mixes[(p + n) % len(mixes)]
+            generate_claude_session(path, session_size, mix, seed=seed * 1000003 + p * 1009 + n, cwd=cwd)
+            files.append(path)
+    return files
+
+
+def generate_json_export(path, messages, app='gpt', layout='messages', seed=0):
+    """生成 GPT / Gemini 风格的JSON导出文件
+
+    layout 为 messages / conversations（对象中的数组字段）或 list（顶层数组）。
+    """
+    rng = random.Random(f'{seed}-{app}-{layout}')
+    assistant_role = 'model' if app == 'gemini' else 'assistant'
+    items = []
+    for i in range(messages):
+        role = 'user' if i % 2 == 0 else assistant_role
+        text = _chinese(rng, rng.randint(5, 60)) if role == 'user' else _sentence(rng, rng.randint(10, 400))
+        items.append({'role': role, 'content': text, 'created': 1767225600 + i * 7})
+
+    data = items if layout == 'list' else {'title': '合成会话', layout: items}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    return os.path.getsize(path)
@@ -0,0 +1,250 @@
+"""可重复的性能基准测试
+
+在合成语料上测量 list_sessions、parse_session（含 gzip 压缩的会话）、_extract_text、export_to_markdown
+以及 GPT / Gemini 解析的耗时（多次取最快）和峰值内存（tracemalloc）。
+
+耗时同时按一段固定的校准负载归一化，保存的基线因此可以在不同机器之间比较。
+startup[...] 是命令行的启动耗时（子进程从启动到退出），按空解释器的启动耗时归一化。
+
+用法：
+    python benchmarks/run_benchmarks.py                  # 运行并打印结果
+    python benchmarks/run_benchmarks.py --save-baseline  # 保存为基线 benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --check          # 与基线比较，出现退化时返回非零退出码
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from benchmarks.corpus import MIXES, generate_claude_corpus, generate_claude_session, generate_json_export
+from scripts.universal_export import (ChatExporter, ClaudeCodeParser, GeminiParser, GPTParser, copy_stream, decode_line,
+                                     open_compressed)
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+
+# 峰值内存的绝对容差（KB），避免很小的数值因为分配器抖动而误报
+MEMORY_SLACK_KB = 256
+
+
+def calibrate(repeat=5):
+    """固定的纯 Python 负载（JSON 编解码和字符串处理），用来归一化不同机器的耗时"""
+    data = [{'id': i, 'text': '校准负载 calibration ' * 8, 'items': list(range(20))} for i in range(2000)]
+
+    def work():
+        encoded = [json.dumps(item, ensure_ascii=False) for item in data]
+        decoded = [json.loads(line) for line in encoded]
+        return sum(len(item['text'].strip().upper()) for item in decoded)
+
+    return measure_time(work, repeat)
+
+
+def measure_time(func, repeat):
+    """返回多次运行中最快的一次耗时"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def measure_memory(func):
+    """返回一次运行的峰值内存（KB）"""
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def measure_startup(args, repeat):
+    """运行子进程 repeat 次，返回最快一次从启动到退出的耗时
+
+    允许写入字节码缓存，测到的是 hook 反复调用时的真实启动开销（第一次运行只用来预热）。
+    """
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    def run():
+        subprocess.run([sys.executable] + args, env=env, check=True, stdout=subprocess.DEVNULL)
+
+    run()
+    return measure_time(run, repeat)
+
+
+def build_startup_cases(work_dir):
+    """启动耗时：导入模块，以及用 export_chat.py 导出一个小会话（单会话命令路径）"""
+    session_file = os.path.join(work_dir, 'startup.jsonl')
+    generate_claude_session(session_file, 16 * 1024, 'tiny_turns')
+    output_dir = os.path.join(work_dir, 'startup-out')
+    return [
+        ('startup[import]', ['-c', f'import sys; sys.path.insert(0, {SCRIPTS_DIR!r}); import universal_export']),
+        ('startup[export_chat]', [os.path.join(SCRIPTS_DIR, 'export_chat.py'), session_file, output_dir]),
+    ]
+
+
+def build_cases(work_dir, scale):
+    """生成语料并返回 (名称, 函数) 列表"""
+    mb = 1024 * 1024
+    cases = []
+
+    # list_sessions：大量小会话
+    corpus_root = os.path.join(work_dir, 'corpus')
+    generate_claude_corpus(corpus_root, projects=max(1, int(20 * scale)), sessions_per_project=50, session_size=2048)
+    lister = ClaudeCodeParser()
+    lister.base_dir = corpus_root
+    cases.append(('list_sessions', lister.list_sessions))
+
+    # parse_session：每种内容比例一个大会话
+    parser = ClaudeCodeParser()
+    sessions = {}
+    for mix in MIXES:
+        path = os.path.join(work_dir, f'{mix}.jsonl')
+        generate_claude_session(path, int(4 * mb * scale), mix)
+        sessions[mix] = path
+        cases.append((f'parse_session[{mix}]', lambda path=path: parser.parse_session(path, include_tools=True)))
+
+    # 压缩的会话：边读边解压
+    gz_path = sessions['default'] + '.gz'
+    with open(sessions['default'], 'rb') as src, open_compressed(gz_path, '.gz', 'wb') as dst:
+        copy_stream(src, dst)
+    cases.append(('parse_session[default.gz]', lambda: parser.parse_session(gz_path, include_tools=True)))
+
+    # _extract_text：预先解码好的消息内容
+    contents = []
+    with open(sessions['long_tools'], 'rb') as f:
+        for line in f:
+            record = decode_line(line)
+            if isinstance(record.get('message'), dict):
+                contents.append(record['message'].get('content', ''))
+
+    def extract_all():
+        for content in contents:
+            parser._extract_text(content)
+
+    cases.append(('_extract_text[long_tools]', extract_all))
+
+    # export_to_markdown：流式导出整个会话
+    exporter = ChatExporter('claude')
+    output_dir = os.path.join(work_dir, 'out')
+
+    def export(path):
+        with contextlib.redirect_stdout(io.StringIO()):
+            exporter.export_session(path, output_dir, include_tools=True)
+
+    for mix in ('default', 'unicode'):
+        cases.append((f'export_to_markdown[{mix}]', lambda path=sessions[mix]: export(path)))
+
+    # GPT / Gemini JSON 导出
+    gpt_file = os.path.join(work_dir, 'gpt.json')
+    generate_json_export(gpt_file, int(20000 * scale), 'gpt', 'messages')
+    gemini_file = os.path.join(work_dir, 'gemini.json')
+    generate_json_export(gemini_file, int(20000 * scale), 'gemini', 'list')
+    cases.append(('parse_session[gpt]', lambda: GPTParser().parse_session(gpt_file)))
+    cases.append(('parse_session[gemini]', lambda: GeminiParser().parse_session(gemini_file)))
+    return cases
+
+
+def run(scale=1.0, repeat=5):
+    """运行全部基准测试，返回结果字典"""
+    calibration = calibrate()
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, func in build_cases(work_dir, scale):
+            seconds = measure_time(func, repeat)
+            results[name] = {
+                'seconds': seconds,
+                'relative': seconds / calibration,
+                'peak_kb': measure_memory(func),
+            }
+
+        # 启动耗时包含进程创建，按空解释器的启动耗时归一化；不统计内存
+        startup_repeat = max(repeat, 10)
+        interpreter = measure_startup(['-c', 'pass'], startup_repeat)
+        for name, args in build_startup_cases(work_dir):
+            seconds = measure_startup(args, startup_repeat)
+            results[name] = {'seconds': seconds, 'relative': seconds / interpreter, 'peak_kb': 0}
+    return {'scale': scale, 'calibration': calibration, 'results': results}
+
+
+def compare(current, baseline, time_tolerance=1.5, memory_tolerance=1.3):
+    """与基线比较，返回退化说明列表（为空表示没有退化）"""
+    regressions = []
+    if current['scale'] != baseline['scale']:
+        return [f'规模不同（当前 {current["scale"]}，基线 {baseline["scale"]}），无法比较']
+    for name, base in baseline['results'].items():
+        result = current['results'].get(name)
+        if result is None:
+            regressions.append(f'{name}: 缺少结果')
+            continue
+        if result['relative'] > base['relative'] * time_tolerance:
+            regressions.append(f'{name}: 耗时 {result["relative"]:.2f} > 基线 {base["relative"]:.2f} x {time_tolerance}')
+        if result['peak_kb'] > base['peak_kb'] * memory_tolerance + MEMORY_SLACK_KB:
+            regressions.append(f'{name}: 峰值内存 {result["peak_kb"]:.0f}KB > 基线 {base["peak_kb"]:.0f}KB x {memory_tolerance}')
+    return regressions
+
+
+def print_results(current, baseline=None):
+    """打印结果表格"""
+    print(f'校准负载：{current["calibration"] * 1000:.1f} ms（规模 {current["scale"]}）')
+    print(f'{"基准":<30}{"耗时":>12}{"相对值":>10}{"峰值内存":>14}{"基线相对值":>12}')
+    for name, result in current['results'].items():
+        base = (baseline or {}).get('results', {}).get(name)
+        base_text = f'{base["relative"]:.2f}' if base else '-'
+        print(f'{name:<30}{result["seconds"] * 1000:>10.1f}ms{result["relative"]:>10.2f}'
+              f'{result["peak_kb"]:>12.0f}KB{base_text:>12}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='聊天记录导出工具的性能基准测试')
+    parser.add_argument('--scale', type=float, default=1.0, help='语料规模倍数（默认 1，约 4MB/会话）')
+    parser.add_argument('--repeat', type=int, default=5, help='耗时测量的重复次数（取最快）')
+    parser.add_argument('--json', metavar='PATH', help='把结果写入 JSON 文件')
+    parser.add_argument('--baseline', default=BASELINE_FILE, help='基线文件位置')
+    parser.add_argument('--save-baseline', action='store_true', help='把本次结果保存为基线')
+    parser.add_argument('--check', action='store_true', help='与基线比较，出现退化时返回非零退出码')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='耗时容差倍数（默认 1.5）')
+    parser.add_argument('--memory-tolerance', type=float, default=1.3, help='峰值内存容差倍数（默认 1.3）')
+    args = parser.parse_args()
+
+    current = run(args.scale, args.repeat)
+    baseline = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_results(current, baseline)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(current, f, ensure_ascii=False, indent=2)
+        print(f'已保存基线 -> {args.baseline}')
+
+    if args.check:
+        if baseline is None:
+            print('没有基线文件，请先运行 --save-baseline')
+            sys.exit(2)
+        regressions = compare(current, baseline, args.tolerance, args.memory_tolerance)
+        if regressions:
+            print('\n性能退化：')
+            for line in regressions:
+                print(f'  {line}')
+            sys.exit(1)
+        print('\n没有发现性能退化')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,568 @@
 import json
 import sys
 import os
-import argparse
+import re
+import contextlib
+import hashlib
+import io
+import itertools
+import mmap
+import tempfile
+import time
 from datetime import datetime
-from pathlib import Path
+
+
+def _select_json_backend():
+    """选择JSON解码后端：优先 orjson / simdjson，都没有时使用标准库
+
+    设置环境变量 EXPORT_CHAT_JSON=json 可以强制使用标准库。
+    """
+    preferred = os.environ.get('EXPORT_CHAT_JSON', '')
+    if preferred != 'json':
+        try:
+            import orjson
+            return 'orjson', orjson.loads
+        except ImportError:
+            pass
+        try:
+            import simdjson
+            return 'simdjson', simdjson.loads
+        except ImportError:
+            pass
+    return 'json', json.loads
+
+
+def select_json_backend():
+    """选定JSON解码后端（只在第一次调用时导入），返回 (名称, loads 函数)"""
+    global JSON_BACKEND, json_loads
+    if JSON_BACKEND is None:
+        JSON_BACKEND, json_loads = _select_json_backend()
+    return JSON_BACKEND, json_loads
+
+
+def _first_loads(line):
+    """第一次解码时才选择并导入后端，不需要解码的命令（--help、列表、搜索）不必付出导入开销"""
+    return select_json_backend()[1](line)
+
+
+JSON_BACKEND, json_loads = None, _first_loads
+
+# 能产生消息的 Claude Code 记录一定带有 "type":"user" 或 "type":"assistant" 标记；
+# 其余的行（摘要、系统记录、文件快照等）在字节层面直接跳过，不做JSON解码。
+# JSON字符串内部的引号都被转义，所以这个标记不会误匹配到文本内容里。
+_MESSAGE_MARKER = re.compile(rb'"type": ?"(?:user|assistant)"')
+
+
+def is_message_line(line):
+    """判断一行JSONL（bytes）是否可能产生用户或助手消息"""
+    return _MESSAGE_MARKER.search(line) is not None
+
+
+# 记录之间的链接：uuid、父记录（压缩边界处 parentUuid 为 null，由 logicalParentUuid 接上）和子代理标记。
+# 每个键只出现一次时就是记录本身的字段，出现多次（嵌套对象中有同名键）时退回完整解码。
+_LINK_FIELDS = re.compile(rb'"(uuid|parentUuid|logicalParentUuid)": ?(?:null|"([^"]*)")')
+_SIDECHAIN_FIELD = re.compile(rb'"isSidechain": ?true')
+
+
+def record_links(line):
+    """从一行JSONL（bytes）中取出 (uuid, 父记录 uuid, 是否子代理记录)，没有 uuid 时返回None"""
+    fields = _LINK_FIELDS.findall(line)
+    if not fields:
+        return None
+    links = dict(fields)
+    sidechain = _SIDECHAIN_FIELD.findall(line)
+    if len(links) == len(fields) and len(sidechain) <= 1:
+        if not links.get(b'uuid'):
+            return None
+        parent = links.get(b'parentUuid') or links.get(b'logicalParentUuid')
+        return links[b'uuid'].decode(), parent.decode() if parent else None, bool(sidechain)
+    try:
+        obj = decode_line(line)
+    except ValueError:
+        return None
+    if not isinstance(obj, dict) or not obj.get('uuid'):
+        return None
+    return obj['uuid'], obj.get('parentUuid') or obj.get('logicalParentUuid'), bool(obj.get('isSidechain'))
+
+
+def decode_line(line):
+    """用选定的后端解码一行JSON；失败时退回标准库，保证结果与标准库一致"""
+    try:
+        return json_loads(line)
+    except ValueError:
+        return json.loads(line)
+
+
+def placeholder_messages(app_name, requirement):
+    """暂不支持解析时输出的提示消息（带 placeholder 标记，搜索索引会忽略）"""
+    yield {
+        'role': '🧑 用户',
+        'text': f'{app_name}聊天记录解析功能正在开发中...',
+        'time': datetime.now().isoformat(),
+        'placeholder': True
+    }
+    yield {
+        'role': '🤖 系统',
+        'text': f'{app_name}聊天记录解析需要{requirement}，当前版本暂不支持。',
+        'time': datetime.now().isoformat(),
+        'placeholder': True
+    }
+
+
+class _PhaseTimer:
+    """ExportStats.phase 返回的计时上下文"""
+
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class ExportStats:
+    """导出过程的统计信息
+
+    记录各阶段耗时、读取的文件 / 字节 / 行数、按原因分类的跳过行数、
+    带文件和行号的解码错误，以及输出的消息数和字节数。
+    解析器和导出器的 stats 为 None 时不做任何统计，不影响正常导出的速度。
+    """
+
+    # 最多保留的错误明细条数（错误总数仍然全部计数）
+    MAX_ERRORS = 100
+
+    PHASE_LABELS = {
+        'list': '列出会话',
+        'read': '读取文件',
+        'decode': 'JSON解码',
+        'extract': '提取文本',
+        'render': '渲染Markdown',
+        'write': '写入文件',
+    }
+    SKIP_LABELS = {
+        'no_marker': '无消息标记（字节预过滤）',
+        'decode_error': 'JSON解码失败',
+        'not_object': '不是JSON对象',
+        'record_error': '记录格式异常',
+        'no_message': '无文本或被过滤',
+        'partial_line': '末尾未写完的行',
+        'inactive_branch': '不在当前分支上（已回退或编辑）',
+        'duplicate_message': '其他会话中已导出的消息',
+    }
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.seconds = 0.0
+        self.phases = {}
+        self.counters = {}
+        self.skipped = {}
+        self.errors = []
+        self.error_count = 0
+
+    def phase(self, name):
+        """计时上下文：with stats.phase('decode'): ..."""
+        return _PhaseTimer(self, name)
+
+    def add_time(self, name, seconds):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def timed(self, name, iterable):
+        """逐个产出 iterable 的元素，并把取元素花费的时间计入阶段 name"""
+        it = iter(iterable)
+        clock = time.perf_counter
+        while True:
+            start = clock()
+            try:
+                item = next(it)
+            except StopIteration:
+                self.add_time(name, clock() - start)
+                return
+            self.add_time(name, clock() - start)
+            yield item
+
+    def add(self, name, n=1):
+        """累加计数器（files / bytes_read / lines / messages / output_bytes 等）"""
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def skip(self, reason, n=1):
+        """记录被跳过的行"""
+        self.skipped[reason] = self.skipped.get(reason, 0) + n
+
+    def error(self, filepath, line, error, offset=None):
+        """记录一个错误及其位置（line 为行号，offset 为字节偏移，未知时为 None）"""
+        self.error_count += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            if filepath is not None:
+                filepath = os.fspath(filepath)
+            self.errors.append({'file': filepath, 'line': line, 'offset': offset,
+                                'error': f'{type(error).__name__}: {error}'})
+
+    def stop(self):
+        """结束计时，返回自身"""
+        self.seconds = time.perf_counter() - self.start
+        return self
+
+    def merge(self, data):
+        """合并另一份统计（to_dict 的结果，如工作进程返回的统计）"""
+        for name, seconds in data['phases'].items():
+            self.add_time(name, seconds)
+        for name, n in data['counters'].items():
+            self.add(name, n)
+        for reason, n in data['skipped'].items():
+            self.skip(reason, n)
+        self.error_count += data['error_count']
+        self.errors.extend(data['errors'][:self.MAX_ERRORS - len(self.errors)])
+
+    def to_dict(self):
+        return {
+            'seconds': self.seconds or time.perf_counter() - self.start,
+            'phases': self.phases,
+            'counters': self.counters,
+            'skipped': self.skipped,
+            'errors': self.errors,
+            'error_count': self.error_count,
+        }
+
+    def save(self, path):
+        """以JSON写入统计信息"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=2)
+
+    def print_summary(self):
+        """打印统计摘要"""
+        data = self.to_dict()
+        counters = data['counters']
+        print('\n📊 导出统计')
+        print(f'   总耗时：{data["seconds"]:.3f} 秒')
+        if data['phases']:
+            print('   阶段耗时（并行导出时为各进程累计）：')
+            for name, seconds in sorted(data['phases'].items(), key=lambda item: -item[1]):
+                print(f'     {self.PHASE_LABELS.get(name, name)}：{seconds:.3f} 秒')
+        print(f'   读取：{counters.get("files", 0)} 个文件，{counters.get("bytes_read", 0) / 1024 / 1024:.2f} MB，'
+              f'{counters.get("lines", 0)} 行（解码 {counters.get("decoded", 0)} 行）')
+        if data['skipped']:
+            print('   跳过的行：')
+            for reason, n in sorted(data['skipped'].items(), key=lambda item: -item[1]):
+                print(f'     {self.SKIP_LABELS.get(reason, reason)}：{n}')
+        print(f'   输出：{counters.get("messages", 0)} 条消息，{counters.get("output_bytes", 0) / 1024:.1f} KB')
+        if counters.get('unchanged_outputs'):
+            print(f'   内容未变化、跳过写入：{counters["unchanged_outputs"]} 个文件')
+        if counters.get('blobs_written') or counters.get('blobs_reused'):
+            print(f'   工具内容去重：写入 {counters.get("blobs_written", 0)} 个'
+                  f'（{counters.get("blob_bytes_written", 0) / 1024:.1f} KB），'
+                  f'复用 {counters.get("blobs_reused", 0)} 次（节省 {counters.get("blob_bytes_reused", 0) / 1024:.1f} KB）')
+        if data['error_count']:
+            print(f'   错误：{data["error_count"]} 个')
+            for error in data['errors'][:10]:
+                location = error['file']
+                if error['line'] is not None:
+                    location += f':{error["line"]}'
+                print(f'     {location}  {error["error"]}')
+
+
+class SessionData:
+    """已经读入内存的会话文件（流水线导出时由 I/O 线程预读）
+
+    实现了 __fspath__，不认识它的代码（如第三方解析器、内存映射）仍可按路径重新打开原文件。
+    """
+
+    __slots__ = ('path', 'data')
+
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+
+    def __fspath__(self):
+        return self.path
+
+    def __repr__(self):
+        return f'SessionData({self.path!r}, {len(self.data)} bytes)'
+
+
+# 支持透明解压 / 压缩的文件扩展名
+COMPRESSIONS = ('.gz', '.zst')
+
+
+def compression_of(path):
+    """返回路径的压缩扩展名（.gz / .zst），未压缩时返回空字符串"""
+    path = os.fspath(path)
+    for suffix in COMPRESSIONS:
+        if path.endswith(suffix):
+            return suffix
+    return ''
+
+
+def strip_compression(path):
+    """去掉路径末尾的压缩扩展名，如 a.jsonl.gz -> a.jsonl"""
+    suffix = compression_of(path)
+    path = os.fspath(path)
+    return path[:-len(suffix)] if suffix else path
+
+
+def open_compressed(file, suffix, mode='rb'):
+    """以二进制流的方式读写压缩数据，不会把整个文件解压到内存
+
+    file 是路径或文件对象，mode 为 rb / wb / xb。zstd 优先使用 Python 3.14 的
+    compression.zstd，其次是第三方 zstandard 包。
+    """
+    if suffix == '.gz':
+        import gzip
+
+        return gzip.open(file, mode)
+    try:
+        from compression import zstd
+    except ImportError:
+        zstd = None
+    if zstd is not None:
+        return zstd.open(file, mode)
+
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError('读写 .zst 文件需要 Python 3.14 以上或安装 zstandard：pip install zstandard') from e
+    if isinstance(file, (str, os.PathLike)):
+        file = open(file, mode)
+    if mode.startswith('r'):
+        reader = zstandard.ZstdDecompressor().stream_reader(file, read_across_frames=True, closefd=True)
+        return io.BufferedReader(reader, 1 << 16)
+    return zstandard.ZstdCompressor().stream_writer(file, closefd=True)
+
+
+def open_session(source, encoding=None):
+    """打开会话文件：source 是路径或 SessionData；encoding 为 None 时以二进制模式打开
+
+    .gz / .zst 结尾的会话边读边解压。
+    """
+    suffix = compression_of(source)
+    if isinstance(source, SessionData):
+        f = io.BytesIO(source.data)
+        if suffix:
+            f = open_compressed(f, suffix)
+        return f if encoding is None else io.TextIOWrapper(f, encoding=encoding)
+    if suffix:
+        f = open_compressed(source, suffix)
+        return f if encoding is None else io.TextIOWrapper(f, encoding=encoding)
+    if encoding is None:
+        return open(source, 'rb')
+    return open(source, encoding=encoding)
+
+
+def open_output(path, compress='', newline=None):
+    """新建输出文件（文本模式，UTF-8，文件已存在时报错）；compress 为 .gz / .zst 时边写边压缩"""
+    if not compress:
+        return open(path, 'x', encoding='utf-8', newline=newline)
+    return io.TextIOWrapper(open_compressed(path, compress, 'xb'), encoding='utf-8', newline=newline)
+
+
+_json_encode = json.JSONEncoder(ensure_ascii=False).encode
+
+
+class _PrefixComplete(Exception):
+    """bounded_json 已经得到所需长度的前缀"""
+
+
+def bounded_json(value, size):
+    """返回 json.dumps(value, ensure_ascii=False) 的前 size 个字符
+
+    逐个值序列化，凑够 size 个字符立即停止：很长的字符串只转义需要的前缀，
+    不会为了截断而把几 MB 的工具参数整个序列化。
+    """
+    # 常见的小参数（几个短字符串或数字）直接整体序列化
+    if isinstance(value, dict) and len(value) <= 8:
+        total = 0
+        for item in value.values():
+            if isinstance(item, str):
+                total += len(item)
+            elif isinstance(item, (dict, list, tuple)):
+                total = size
+                break
+        if total < size:
+            return _json_encode(value)[:size]
+
+    parts = []
+    remaining = size
+
+    def emit(text):
+        nonlocal remaining
+        parts.append(text)
+        remaining -= len(text)
+        if remaining <= 0:
+            raise _PrefixComplete
+
+    def walk(value):
+        if isinstance(value, str):
+            # 转义只会让字符变多，前 remaining 个字符的转义结果已经足够
+            emit(_json_encode(value[:remaining] if len(value) > remaining else value))
+        elif isinstance(value, dict):
+            emit('{')
+            for i, (key, item) in enumerate(value.items()):
+                if not isinstance(key, str):
+                    if not (key is None or isinstance(key, (int, float))):
+                        raise TypeError(f'keys must be str, int, float, bool or None, not {type(key).__name__}')
+                    key = _json_encode(key)
+                emit(f', {_json_encode(key)}: ' if i else f'{_json_encode(key)}: ')
+                walk(item)
+            emit('}')
+        elif isinstance(value, (list, tuple)):
+            emit('[')
+            for i, item in enumerate(value):
+                if i:
+                    emit(', ')
+                walk(item)
+            emit(']')
+        else:
+            emit(_json_encode(value))
+
+    try:
+        walk(value)
+    except _PrefixComplete:
+        pass
+    return ''.join(parts)[:size]
+
+
+def strip_prefix(text, size):
+    """返回 text.strip() 的前 size 个字符，很长的文本不复制整个字符串"""
+    if len(text) <= 4 * size:
+        return text.strip()[:size]
+    start, end = 0, len(text)
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return text[start:min(end, start + size)]
 
 
 class ChatParser:
     """聊天记录解析器基类"""
 
+    # 导出统计（ExportStats），为 None 时不统计
+    stats = None
+    # 会话是普通文件、解析时只需顺序读取（流水线导出可以预读到内存，用 open_session 打开）
+    prefetch = False
+    # 工具内容的内容寻址存储（BlobStore），为 None 时较长的工具内容截断后内联
+    blob_store = None
+    # 工具参数和返回结果内联时的最大字符数；tool_limits 按工具名覆盖：{工具名: (参数上限, 结果上限)}，
+    # 上限为 None 时沿用默认值，工具名 '*' 对所有工具生效
+    tool_input_limit = 200
+    tool_result_limit = 500
+    tool_limits = None
+
+    def iter_messages(self, filepath, include_tools=False, include_media=False):
+        """逐条产出会话中的消息（生成器），不在内存中保留整个会话"""
+        raise NotImplementedError("Subclasses must implement this method")
+
     def parse_session(self, filepath, include_tools=False, include_media=False):
         """解析会话文件，返回消息列表"""
-        raise NotImplementedError("Subclasses must implement this method")
+        return list(self.iter_messages(filepath, include_tools, include_media))
 
     def list_sessions(self):
         """列出所有会话"""
         raise NotImplementedError("Subclasses must implement this method")
 
+    def _tool_limits(self, tool=None):
+        """返回工具的 (参数上限, 结果上限)"""
+        input_limit, result_limit = self.tool_input_limit, self.tool_result_limit
+        if self.tool_limits:
+            for key in ('*', tool):
+                custom = self.tool_limits.get(key)
+                if custom:
+                    input_limit = input_limit if custom[0] is None else custom[0]
+                    result_limit = result_limit if custom[1] is None else custom[1]
+        return input_limit, result_limit
+
+    def _tool_input_text(self, text, suffix='.json', tool=None):
+        """工具调用参数：启用去重时较长的参数存入 blob 存储并链接，否则超过上限（默认 200 字）截断"""
+        blobs = self.blob_store
+        if blobs is not None and len(text) >= blobs.min_size:
+            return blobs.link(text, suffix)
+        limit = self._tool_limits(tool)[0]
+        if len(text) > limit:
+            return text[:limit] + '...'
+        return text
+
+    def _tool_result_text(self, text, tool=None):
+        """工具返回结果：启用去重时较长的结果存入 blob 存储并链接，否则超过上限（默认 500 字）截断"""
+        blobs = self.blob_store
+        if blobs is not None and len(text) >= blobs.min_size:
+            return blobs.link(text, '.txt')
+        limit = self._tool_limits(tool)[1]
+        if len(text) > limit:
+            return text[:limit] + '\n...(已截断)'
+        return text
+
+    def describe_session(self, filepath):
+        """返回会话所属的项目和会话名（机器可读导出中的 project / session 列）"""
+        filepath = strip_compression(filepath)
+        return {'project': os.path.basename(os.path.dirname(filepath)),
+                'session': os.path.splitext(os.path.basename(filepath))[0]}
+
+    def session_key(self, filepath):
+        """导出文件名中区分会话的标识：默认是源文件绝对路径（去掉压缩扩展名）的摘要"""
+        path = os.path.abspath(strip_compression(filepath))
+        return hashlib.sha1(path.encode('utf-8', 'surrogateescape')).hexdigest()[:10]
+
+
+def decode_project_dir(project_dir):
+    """按目录名粗略还原项目路径（无法区分路径中原有的 "-"）"""
+    readable_path = project_dir.replace("-", "/").replace("\\", "/")
+    if readable_path.startswith("/"):
+        readable_path = readable_path[1:]
+    return readable_path
+
 
 class ClaudeCodeParser(ChatParser):
     """Claude Code 聊天记录解析器"""
 
-    def __init__(self):
+    prefetch = True
+    # 会话索引确认过时间戳递增的会话 {路径: (大小, mtime_ns)}，按时间范围读取时只有这些会话可以二分定位
+    ordered_sessions = None
+    # 设置了 tool_limits 时：尚未看到返回结果的工具调用 {tool_use id: 工具名}
+    _pending_tools = None
+
+    def __init__(self, index_path=None):
         self.base_dir = os.path.expanduser("~/.claude")
+        self.index = None
+        if index_path:
+            self.use_index(index_path)
+
+    def describe_session(self, filepath):
+        """项目名按会话所在的项目目录还原，会话名是会话ID"""
+        info = super().describe_session(filepath)
+        info['project'] = decode_project_dir(info['project'])
+        return info
+
+    def session_key(self, filepath):
+        """会话文件名就是全局唯一的会话ID"""
+        return self.describe_session(filepath)['session']
+
+    def use_index(self, index_path=None):
+        """启用会话元数据索引，之后 list_sessions 从索引读取"""
+        self.index = SessionIndex(index_path or default_index_path(), self)
+        return self.index
+
+    def query_sessions(self, **filters):
+        """刷新索引后按条件查询会话元数据，参数见 SessionIndex.query"""
+        index = self.index or self.use_index()
+        index.refresh(os.path.join(self.base_dir, "projects"))
+        rows = index.query(**filters)
+        self._remember_ordered(rows)
+        return rows
+
+    def _remember_ordered(self, rows):
+        """记下索引确认时间戳递增的会话，供 iter_messages_between 二分定位"""
+        ordered = self.ordered_sessions = self.ordered_sessions or {}
+        for row in rows:
+            if row['ordered']:
+                ordered[row['path']] = (row['size'], row['mtime_ns'])
+            else:
+                ordered.pop(row['path'], None)
 
     def list_sessions(self):
         """列出所有项目和会话"""
@@ -30,66 +570,330 @@ class ClaudeCodeParser(ChatParser):
         if not os.path.exists(projects_dir):
             return []
 
+        if self.index is not None:
+            return self._list_sessions_from_index(projects_dir)
+
         projects = []
         for project_dir in os.listdir(projects_dir):
             project_path = os.path.join(projects_dir, project_dir)
             if os.path.isdir(project_path):
                 sessions = []
                 for filename in os.listdir(project_path):
-                    if filename.endswith(".jsonl"):
+                    if strip_compression(filename).endswith(".jsonl"):
                         sessions.append(os.path.join(project_path, filename))
 
-                # 还原项目路径
-                readable_path = project_dir.replace("-", "/").replace("\\", "/")
-                if readable_path.startswith("/"):
-                    readable_path = readable_path[1:]
-
                 projects.append({
-                    "name": readable_path,
+                    "name": decode_project_dir(project_dir),
                     "path": project_path,
                     "sessions": sessions
                 })
 
         return projects
 
-    def parse_session(self, filepath, include_tools=False, include_media=False):
-        """解析Claude Code会话文件"""
-        messages = []
+    def _list_sessions_from_index(self, projects_dir):
+        """从索引生成项目列表，项目名称使用记录中的真实工作目录"""
+        self.index.refresh(projects_dir)
+        projects = {}
+        rows = self.index.query(order_by='path')
+        self._remember_ordered(rows)
+        for row in rows:
+            project = projects.get(row['project_dir'])
+            if project is None:
+                project = projects[row['project_dir']] = {
+                    "name": row['cwd'] or decode_project_dir(os.path.basename(row['project_dir'])),
+                    "path": row['project_dir'],
+                    "sessions": []
+                }
+            project["sessions"].append(row['path'])
+        return list(projects.values())
+
+    def iter_messages(self, filepath, include_tools=False, include_media=False):
+        """逐行解析Claude Code会话文件，逐条产出消息"""
+        return self.iter_messages_from(filepath, 0, include_tools, complete_lines=False)
+
+    def iter_messages_between(self, filepath, since=None, until=None, include_tools=False):
+        """只解析时间范围内的消息，时间戳按前缀比较（until='2026-01-31' 包含当天）
+
+        会话索引确认整个文件的时间戳递增（见 ordered_sessions）时，用内存映射在行首上二分查找
+        第一条不早于 since 的记录，直接从那里开始读取，遇到晚于 until 的消息即停止。
+        其他会话即使只有一条记录乱序，定位也会漏掉消息，因此从头线性扫描并逐条过滤。
+        """
+        offset = 0
+        ordered = self._known_ordered(filepath)
+        # 压缩的会话无法内存映射，从头读取并逐条过滤
+        if ordered and since and os.path.getsize(filepath) and not compression_of(filepath):
+            with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                offset = self._seek_time(mm, since)
+
+        for message in self.iter_messages_from(filepath, offset, include_tools, complete_lines=False):
+            timestamp = message['time'] if isinstance(message['time'], str) else ''
+            if until and timestamp[:len(until)] > until:
+                if ordered:
+                    break
+                continue
+            if since and timestamp[:len(since)] < since:
+                continue
+            yield message
+
+    def _probe_timestamp(self, mm, start):
+        """从行首 start 开始找第一条带顶层时间戳的记录，返回 (时间戳, 该行末尾的偏移)；没有时返回 (None, 文件大小)"""
+        size = len(mm)
+        while start < size:
+            end = mm.find(b'\n', start)
+            end = size if end < 0 else end + 1
+            line = mm[start:end]
+            if b'"timestamp"' in line:
+                try:
+                    obj = decode_line(line)
+                except ValueError:
+                    obj = None
+                if isinstance(obj, dict) and isinstance(obj.get('timestamp'), str) and obj['timestamp']:
+                    return obj['timestamp'], end
+            start = end
+        return None, size
+
+    def _known_ordered(self, filepath):
+        """会话索引确认过整个文件的时间戳递增，且文件此后没有变化"""
+        known = (self.ordered_sessions or {}).get(filepath)
+        if known is None:
+            return False
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return False
+        return known == (st.st_size, st.st_mtime_ns)
+
+    def _seek_time(self, mm, since):
+        """在行首上二分查找第一条时间戳不早于 since 的记录，返回其所在行（或之前不带时间戳的行）的起始偏移"""
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            # mid 所在行的行首（lo 始终是行首）
+            start = mm.rfind(b'\n', lo, mid) + 1 or lo
+            timestamp, end = self._probe_timestamp(mm, start)
+            if timestamp is None or timestamp[:len(since)] >= since:
+                hi = start
+            else:
+                lo = end
+        return lo
+
+    def iter_messages_parallel(self, filepath, include_tools=False, jobs=None, chunk_size=None):
+        """把会话文件按换行边界切块，用进程池并行解析，再按文件顺序逐条产出消息
+
+        每个块与 iter_messages 走同一条解析路径，结果完全一致。
+        同时在途的块最多为进程数的两倍，内存占用与文件大小无关。
+        按工具名设置了截断上限时串行解析：工具返回结果的上限取决于前面调用它的工具，两者可能落在不同的块中。
+        """
+        workers = jobs or os.cpu_count() or 1
+        if chunk_size is None:
+            chunk_size = max(CHUNK_MIN_BYTES, os.path.getsize(filepath) // (workers * 4) + 1)
+        # 压缩的会话无法按字节偏移切块，串行解析
+        per_tool = self.tool_limits and any(tool != '*' for tool in self.tool_limits)
+        chunks = [] if compression_of(filepath) or per_tool else split_chunks(filepath, chunk_size)
+        if workers <= 1 or len(chunks) <= 1:
+            yield from self.iter_messages(filepath, include_tools)
+            return
+
+        from concurrent.futures import ProcessPoolExecutor
+
+        stats = self.stats
+        # 工作进程按同一个输出目录重建去重存储，大段工具内容照样链接到 _blobs/
+        blob_store = self.blob_store and (self.blob_store.output_dir, self.blob_store.min_size)
+        tasks = iter([{'path': filepath, 'start': start, 'end': end, 'include_tools': include_tools,
+                       'stats': stats is not None, 'tool_limits': self.tool_limits, 'blob_store': blob_store}
+                      for start, end in chunks])
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = [pool.submit(_parse_chunk, task) for task in itertools.islice(tasks, workers * 2)]
+            while pending:
+                result = pending.pop(0).result()
+                task = next(tasks, None)
+                if task is not None:
+                    pending.append(pool.submit(_parse_chunk, task))
+                if stats is not None:
+                    stats.merge(result['stats'])
+                yield from result['messages']
+        if stats is not None:
+            stats.add('files')
+
+    def iter_messages_from(self, filepath, offset=0, include_tools=False, position=None, complete_lines=True, end=None,
+                           keep=None):
+        """从字节偏移 offset 开始逐行解析会话文件（用于增量导出和分块解析）
+
+        complete_lines 为 True 时只处理以换行结尾的完整行，末尾尚未写完的行留到下次；
+        position 字典中的 'offset' 随解析推进，始终指向已处理部分的末尾。
+        end 不为 None 时读到该偏移为止（end 必须落在行边界上）。
+        keep 不为 None 时只转换 keep(记录) 为真的记录。
+        """
+        stats = self.stats
+        if stats is not None and position is None:
+            position = {}
+        # 上一个文件中没有等到返回结果的工具调用不再需要
+        self._pending_tools = None
+        for obj in self._iter_records(filepath, offset, position, complete_lines, end):
+            if keep is not None and not keep(obj):
+                continue
+            try:
+                if stats is None:
+                    message = self._record_to_message(obj, include_tools)
+                else:
+                    with stats.phase('extract'):
+                        message = self._record_to_message(obj, include_tools)
+            except Exception as e:
+                if stats is not None:
+                    stats.skip('record_error')
+                    stats.error(filepath, position['line'], e, position['start'])
+                continue
+            if message:
+                yield message
+            elif stats is not None:
+                stats.skip('no_message')
+
+    def active_branch(self, filepath):
+        """返回当前分支上记录的 uuid 集合；会话没有分叉时返回None（全部记录都在当前分支上）
 
-        with open(filepath, encoding='utf-8') as f:
+        回退或编辑之前的消息后，新消息接在较早的记录下面，parentUuid 形成一棵树。
+        与 Claude Code 恢复会话时一样，从最后一条主线消息沿 parentUuid 向上找到根，
+        这条链就是当前分支。只用正则取出链接字段，不解码整行。
+        """
+        parents = {}
+        has_child = set()
+        branched = False
+        leaf = None
+        with open_session(filepath) as f:
             for line in f:
+                links = record_links(line)
+                if links is None:
+                    continue
+                uuid, parent, sidechain = links
+                parents[uuid] = parent
+                if sidechain:
+                    continue
+                if parent is not None:
+                    if parent in has_child:
+                        branched = True
+                    has_child.add(parent)
+                if is_message_line(line):
+                    leaf = uuid
+        if not branched or leaf is None:
+            return None
+        active = set()
+        while leaf is not None and leaf not in active:
+            active.add(leaf)
+            leaf = parents.get(leaf)
+        return active
+
+    def iter_branch_messages(self, filepath, include_tools=False, seen=None):
+        """只产出当前分支上的消息；seen（MessageSet / BloomFilter）不为 None 时跳过其中已有的消息并记入 seen
+
+        子代理（isSidechain）的记录不属于主线分支，总是保留。
+        """
+        active = self.active_branch(filepath)
+        stats = self.stats
+
+        def keep(obj):
+            uuid = obj.get('uuid')
+            if not uuid:
+                return True
+            if active is not None and uuid not in active and not obj.get('isSidechain'):
+                if stats is not None:
+                    stats.skip('inactive_branch')
+                return False
+            if seen is not None and not seen.add(uuid):
+                if stats is not None:
+                    stats.skip('duplicate_message')
+                return False
+            return True
+
+        return self.iter_messages_from(filepath, 0, include_tools, complete_lines=False, keep=keep)
+
+    def _iter_records(self, filepath, offset=0, position=None, complete_lines=True, end=None):
+        """从字节偏移 offset 开始逐行解码可能产生消息的记录，end 不为 None 时读到该偏移为止
+
+        统计时 position 中还会记录当前行的行号 'line'（从 offset 处的行开始计为 1）
+        和行首偏移 'start'。
+        """
+        stats = self.stats
+        if position is not None:
+            position['offset'] = offset
+        with open_session(filepath) as f:
+            f.seek(offset)
+            if stats is None:
+                for line in f:
+                    if end is not None and offset >= end:
+                        break
+                    if complete_lines and not line.endswith(b'\n'):
+                        break
+                    offset += len(line)
+                    if position is not None:
+                        position['offset'] = offset
+                    if not is_message_line(line):
+                        continue
+                    try:
+                        obj = decode_line(line)
+                    except ValueError:
+                        continue
+                    if isinstance(obj, dict):
+                        yield obj
+                return
+
+            stats.add('files')
+            for lineno, line in enumerate(stats.timed('read', f), 1):
+                if end is not None and offset >= end:
+                    break
+                if complete_lines and not line.endswith(b'\n'):
+                    stats.skip('partial_line')
+                    break
+                start = offset
+                offset += len(line)
+                stats.add('lines')
+                stats.add('bytes_read', len(line))
+                if position is not None:
+                    position.update(offset=offset, line=lineno, start=start)
+                if not is_message_line(line):
+                    stats.skip('no_marker')
+                    continue
                 try:
-                    obj = json.loads(line.strip())
-                    msg_type = obj.get('type', '')
-                    timestamp = obj.get('timestamp', '')
-                    msg = obj.get('message', {})
-                    role = msg.get('role', '')
-                    content = msg.get('content', '')
-
-                    # 只保留用户和助手的消息
-                    if msg_type == 'user' and role == 'user':
-                        text = self._extract_text(content)
-                        if text:
-                            messages.append({
-                                'role': '🧑 用户',
-                                'text': text,
-                                'time': timestamp
-                            })
-                    elif msg_type == 'assistant' and role == 'assistant':
-                        text = self._extract_text(content)
-                        if text:
-                            # 过滤掉纯工具调用（除非用户要求包含）
-                            if not include_tools and text.startswith('[调用工具'):
-                                continue
-                            messages.append({
-                                'role': '🤖 Claude',
-                                'text': text,
-                                'time': timestamp
-                            })
-                except:
-                    pass
+                    with stats.phase('decode'):
+                        obj = decode_line(line)
+                except ValueError as e:
+                    stats.skip('decode_error')
+                    stats.error(filepath, lineno, e, start)
+                    continue
+                stats.add('decoded')
+                if isinstance(obj, dict):
+                    yield obj
+                else:
+                    stats.skip('not_object')
 
-        return messages
+    def _record_to_message(self, obj, include_tools=False):
+        """把一条JSONL记录转换为消息，不需要输出时返回None"""
+        msg_type = obj.get('type', '')
+        timestamp = obj.get('timestamp', '')
+        msg = obj.get('message', {})
+        role = msg.get('role', '')
+        content = msg.get('content', '')
+
+        # 只保留用户和助手的消息
+        if msg_type == 'user' and role == 'user':
+            text = self._extract_text(content)
+            if text:
+                return {
+                    'role': '🧑 用户',
+                    'text': text,
+                    'time': timestamp
+                }
+        elif msg_type == 'assistant' and role == 'assistant':
+            text = self._extract_text(content)
+            if text:
+                # 过滤掉纯工具调用（除非用户要求包含）
+                if not include_tools and text.startswith('[调用工具'):
+                    return None
+                return {
+                    'role': '🤖 Claude',
+                    'text': text,
+                    'time': timestamp
+                }
+        return None
 
     def _extract_text(self, content):
         """从消息内容中提取文本"""
@@ -103,242 +907,452 @@ class ClaudeCodeParser(ChatParser):
                         texts.append(item['text'].strip())
                     elif item.get('type') == 'tool_use':
                         tool = item.get('name', '未知工具')
-                        inp = json.dumps(item.get('input', {}), ensure_ascii=False)
-                        if len(inp) > 200:
-                            inp = inp[:200] + '...'
-                        texts.append(f'[调用工具：{tool}]\n参数：{inp}')
+                        texts.append(f'[调用工具：{tool}]\n参数：{self._tool_input(tool, item)}')
                     elif item.get('type') == 'tool_result':
-                        result_content = item.get('content', '')
-                        result_text = self._extract_text(result_content)
-                        if len(result_text) > 500:
-                            result_text = result_text[:500] + '\n...(已截断)'
-                        texts.append(f'[工具返回结果]\n{result_text}')
+                        texts.append(f'[工具返回结果]\n{self._tool_result(item)}')
             return '\n\n'.join(texts)
         return str(content)
 
+    def _tool_input(self, tool, item):
+        """渲染 tool_use 的参数；截断时只序列化到上限为止"""
+        value = item.get('input', {})
+        if self.tool_limits and 'id' in item:
+            # 记下调用的工具名，返回结果按该工具的上限截断
+            if self._pending_tools is None:
+                self._pending_tools = {}
+            self._pending_tools[item['id']] = tool
+        if self.blob_store is not None:
+            return self._tool_input_text(_json_encode(value), tool=tool)
+        return self._tool_input_text(bounded_json(value, self._tool_limits(tool)[0] + 1), tool=tool)
 
-class GPTParser(ChatParser):
-    """GPT 聊天记录解析器"""
+    def _tool_result(self, item):
+        """渲染 tool_result 的内容；截断时只提取到上限为止"""
+        tool = self._pending_tools.pop(item.get('tool_use_id'), None) if self._pending_tools else None
+        content = item.get('content', '')
+        if self.blob_store is not None:
+            return self._tool_result_text(self._extract_text(content), tool)
+        return self._tool_result_text(self._extract_text_prefix(content, self._tool_limits(tool)[1] + 1), tool)
 
-    def __init__(self):
-        # 查找 GPT 聊天记录存储位置
-        self.base_dir = self._find_gpt_dir()
-
-    def _find_gpt_dir(self):
-        """查找 GPT 聊天记录存储目录"""
-        # 尝试常见的位置
-        possible_dirs = [
-            os.path.expanduser("~/Library/Application Support/OpenAI"),
-            os.path.expanduser("~/.openai"),
-            os.path.expanduser("~/Documents/OpenAI"),
-            os.path.expanduser("~/AppData/Roaming/OpenAI")
-        ]
-
-        for d in possible_dirs:
-            if os.path.exists(d):
-                return d
+    def _extract_text_prefix(self, content, size):
+        """返回 _extract_text(content) 的前 size 个字符，后面用不到的内容不再提取"""
+        if isinstance(content, str):
+            return strip_prefix(content, size)
+        if not isinstance(content, list):
+            return str(content)[:size]
+        texts = []
+        total = 0
+        for item in content:
+            if total >= size:
+                break
+            if not isinstance(item, dict):
+                continue
+            kind = item.get('type')
+            if kind == 'text':
+                text = strip_prefix(item['text'], size - total)
+            elif kind in ('tool_use', 'tool_result'):
+                text = self._extract_text([item])
+            else:
+                continue
+            total += len(text) + (2 if texts else 0)
+            texts.append(text)
+        return '\n\n'.join(texts)[:size]
 
-        return None
 
-    def list_sessions(self):
-        """列出 GPT 聊天会话"""
-        if not self.base_dir or not os.path.exists(self.base_dir):
-            return []
+# 分块并行解析时每块的最小字节数
+CHUNK_MIN_BYTES = 8 * 1024 * 1024
 
-        sessions = []
-        for root, dirs, files in os.walk(self.base_dir):
-            for filename in files:
-                if filename.endswith(".json") or filename.endswith(".jsonl"):
-                    sessions.append({
-                        "name": filename,
-                        "path": os.path.join(root, filename),
-                        "sessions": []
-                    })
+# 启用分块并行解析时，只有不小于该大小的会话文件才会被拆分
+PARALLEL_PARSE_MIN_BYTES = 64 * 1024 * 1024
 
-        return sessions
 
-    def parse_session(self, filepath, include_tools=False, include_media=False):
-        """解析 GPT 聊天记录"""
-        messages = []
-        try:
-            with open(filepath, encoding='utf-8') as f:
-                data = json.load(f)
-                # 尝试多种可能的数据结构
-                if 'messages' in data:
-                    messages_data = data['messages']
-                elif 'conversations' in data:
-                    messages_data = data['conversations']
-                else:
-                    # 假设直接是消息数组
-                    messages_data = data
+def split_chunks(filepath, chunk_size):
+    """用内存映射把文件按换行边界切成约 chunk_size 字节的块，返回 [(start, end), ...]"""
+    size = os.path.getsize(filepath)
+    if size == 0:
+        return []
+    chunks = []
+    with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start = 0
+        while start < size:
+            end = start + chunk_size
+            if end < size:
+                # 块的末尾延伸到下一个换行符之后（end - 1 处恰好是换行时块不变）
+                newline = mm.find(b'\n', end - 1)
+                end = size if newline < 0 else newline + 1
+            else:
+                end = size
+            chunks.append((start, end))
+            start = end
+    return chunks
 
-                for msg in messages_data:
-                    try:
-                        role = msg.get('role', '')
-                        content = msg.get('content', '')
-                        timestamp = msg.get('created', '') or msg.get('timestamp', '')
-
-                        if role == 'user':
-                            messages.append({
-                                'role': '🧑 用户',
-                                'text': content.strip(),
-                                'time': self._format_time(timestamp)
-                            })
-                        elif role == 'assistant' or role == 'system':
-                            messages.append({
-                                'role': '🤖 GPT',
-                                'text': content.strip(),
-                                'time': self._format_time(timestamp)
-                            })
-                    except:
-                        pass
-        except:
-            # 如果解析失败，返回简单的错误信息
-            messages.append({
-                'role': '🧑 用户',
-                'text': 'GPT聊天记录解析功能正在开发中...',
-                'time': datetime.now().isoformat()
-            })
-            messages.append({
-                'role': '🤖 系统',
-                'text': 'GPT聊天记录解析需要访问特定的存储格式，当前版本暂不支持。',
-                'time': datetime.now().isoformat()
-            })
 
-        return messages
+def _count_lines(filepath, end):
+    """统计文件前 end 个字节中的换行数"""
+    count = 0
+    with open(filepath, 'rb') as f:
+        while end > 0:
+            block = f.read(min(end, 1 << 20))
+            if not block:
+                break
+            count += block.count(b'\n')
+            end -= len(block)
+    return count
 
-    def _format_time(self, timestamp):
-        """格式化时间戳"""
-        if isinstance(timestamp, int) or isinstance(timestamp, float):
-            return datetime.fromtimestamp(timestamp).isoformat()
-        return timestamp
 
+def _parse_chunk(task):
+    """进程池任务：解析会话文件中的一个块，返回消息列表（和统计信息）"""
+    parser = ClaudeCodeParser()
+    parser.tool_limits = task.get('tool_limits')
+    stats = parser.stats = ExportStats() if task['stats'] else None
+    if task.get('blob_store'):
+        parser.blob_store = BlobStore(*task['blob_store'], stats=stats)
+    messages = list(parser.iter_messages_from(task['path'], task['start'], task['include_tools'],
+                                              complete_lines=False, end=task['end']))
+    result = {'messages': messages, 'stats': None}
+    if stats is not None:
+        # 文件数由主进程统计一次；行号从块内行号换算为文件中的行号
+        stats.counters.pop('files', None)
+        if stats.errors:
+            base = _count_lines(task['path'], task['start'])
+            for error in stats.errors:
+                if error['line'] is not None:
+                    error['line'] += base
+        result['stats'] = stats.stop().to_dict()
+    return result
 
-class GeminiParser(ChatParser):
-    """Gemini 聊天记录解析器"""
 
-    def __init__(self):
-        # 查找 Gemini 聊天记录存储位置
-        self.base_dir = self._find_gemini_dir()
-
-    def _find_gemini_dir(self):
-        """查找 Gemini 聊天记录存储目录"""
-        possible_dirs = [
-            os.path.expanduser("~/Library/Application Support/Google/Gemini"),
-            os.path.expanduser("~/.gemini"),
-            os.path.expanduser("~/Documents/Google/Gemini"),
-            os.path.expanduser("~/AppData/Roaming/Google/Gemini")
-        ]
-
-        for d in possible_dirs:
-            if os.path.exists(d):
-                return d
+def default_index_path():
+    """会话索引的默认位置（遵循 XDG_CACHE_HOME）"""
+    cache_dir = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(cache_dir, 'export-chat-history', 'sessions.sqlite')
 
-        return None
 
-    def list_sessions(self):
-        """列出 Gemini 聊天会话"""
-        if not self.base_dir or not os.path.exists(self.base_dir):
-            return []
+class SessionIndex:
+    """Claude Code 会话元数据索引（SQLite）
 
-        sessions = []
-        for root, dirs, files in os.walk(self.base_dir):
-            for filename in files:
-                if filename.endswith(".json") or filename.endswith(".jsonl"):
-                    sessions.append({
-                        "name": filename,
-                        "path": os.path.join(root, filename),
-                        "sessions": []
-                    })
+    每个会话一行：大小、mtime、消息数量、首条用户消息、首末时间戳，以及从记录中
+    读出的项目真实路径（cwd）。refresh() 按 mtime 增量刷新：未变化的会话只做 stat，
+    只追加过的会话从上次的字节偏移继续统计。ordered 记录所有记录的顶层时间戳是否递增
+    （last_stamp 是最后一个时间戳，追加时据此继续判断）。
+    """
 
-        return sessions
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS sessions (
+            path TEXT PRIMARY KEY,
+            project_dir TEXT NOT NULL,
+            cwd TEXT NOT NULL DEFAULT '',
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            user_count INTEGER NOT NULL,
+            assistant_count INTEGER NOT NULL,
+            first_user_message TEXT NOT NULL DEFAULT '',
+            first_time TEXT NOT NULL DEFAULT '',
+            last_time TEXT NOT NULL DEFAULT '',
+            last_stamp TEXT NOT NULL DEFAULT '',
+            ordered INTEGER NOT NULL DEFAULT 1
+        );
+        CREATE INDEX IF NOT EXISTS sessions_mtime ON sessions (mtime_ns);
+        CREATE INDEX IF NOT EXISTS sessions_size ON sessions (size);
+        CREATE INDEX IF NOT EXISTS sessions_last_time ON sessions (last_time);
+    """
 
-    def parse_session(self, filepath, include_tools=False, include_media=False):
-        """解析 Gemini 聊天记录"""
-        messages = []
-        try:
-            with open(filepath, encoding='utf-8') as f:
-                data = json.load(f)
-                # 尝试多种可能的数据结构
-                if 'messages' in data:
-                    messages_data = data['messages']
-                elif 'conversations' in data:
-                    messages_data = data['conversations']
-                else:
-                    messages_data = data
+    COLUMNS = ('path', 'project_dir', 'cwd', 'size', 'mtime_ns', 'inode', 'offset', 'user_count',
+               'assistant_count', 'first_user_message', 'first_time', 'last_time', 'last_stamp', 'ordered')
 
-                for msg in messages_data:
+    ORDERS = {
+        'mtime': 'mtime_ns DESC',
+        'size': 'size DESC',
+        'time': 'last_time DESC',
+        'path': 'project_dir, path',
+    }
+
+    def __init__(self, path, parser):
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.parser = parser
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        # 索引只是缓存：旧版本的表缺少字段时直接重建
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(sessions)')}
+        if columns and not set(self.COLUMNS) <= columns:
+            with self.conn:
+                self.conn.execute('DROP TABLE sessions')
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        """关闭数据库连接"""
+        self.conn.close()
+
+    def refresh(self, projects_dir):
+        """扫描项目目录，只重新统计新增或变化过的会话，返回更新的会话数"""
+        existing = {row['path']: row for row in self.conn.execute('SELECT * FROM sessions')}
+        seen = set()
+        updates = []
+
+        if os.path.isdir(projects_dir):
+            for project in os.scandir(projects_dir):
+                if not project.is_dir():
+                    continue
+                for entry in os.scandir(project.path):
+                    if not strip_compression(entry.name).endswith('.jsonl') or not entry.is_file():
+                        continue
+                    seen.add(entry.path)
+                    st = entry.stat()
+                    row = existing.get(entry.path)
+                    if row is not None and row['size'] == st.st_size and row['mtime_ns'] == st.st_mtime_ns:
+                        continue
+                    # 压缩的会话的偏移是解压后的位置，变化后从头统计
+                    if row is not None and (row['inode'] != st.st_ino or st.st_size < row['offset']
+                                            or compression_of(entry.name)):
+                        row = None
                     try:
-                        role = msg.get('role', '')
-                        content = msg.get('content', '')
-                        timestamp = msg.get('created', '') or msg.get('timestamp', '')
-
-                        if role == 'user':
-                            messages.append({
-                                'role': '🧑 用户',
-                                'text': content.strip(),
-                                'time': self._format_time(timestamp)
-                            })
-                        elif role == 'model' or role == 'assistant':
-                            messages.append({
-                                'role': '🤖 Gemini',
-                                'text': content.strip(),
-                                'time': self._format_time(timestamp)
-                            })
-                    except:
-                        pass
-        except:
-            messages.append({
-                'role': '🧑 用户',
-                'text': 'Gemini聊天记录解析功能正在开发中...',
-                'time': datetime.now().isoformat()
-            })
-            messages.append({
-                'role': '🤖 系统',
-                'text': 'Gemini聊天记录解析需要访问特定的存储格式，当前版本暂不支持。',
-                'time': datetime.now().isoformat()
-            })
+                        updates.append(self._scan(entry.path, project.path, st, row))
+                    except OSError:
+                        continue
 
-        return messages
+        removed = [(path,) for path in existing if path not in seen]
+        with self.conn:
+            self.conn.executemany(
+                f'INSERT OR REPLACE INTO sessions ({", ".join(self.COLUMNS)}) '
+                f'VALUES ({", ".join("?" * len(self.COLUMNS))})',
+                [tuple(meta[c] for c in self.COLUMNS) for meta in updates]
+            )
+            self.conn.executemany('DELETE FROM sessions WHERE path = ?', removed)
+        return len(updates)
 
-    def _format_time(self, timestamp):
-        """格式化时间戳"""
-        if isinstance(timestamp, int) or isinstance(timestamp, float):
-            return datetime.fromtimestamp(timestamp).isoformat()
-        return timestamp
+    def _scan(self, path, project_dir, st, row=None):
+        """统计一个会话的元数据；row 不为空时从上次的偏移继续累计"""
+        if row is None:
+            meta = {'cwd': '', 'offset': 0, 'user_count': 0, 'assistant_count': 0,
+                    'first_user_message': '', 'first_time': '', 'last_time': '', 'last_stamp': '', 'ordered': 1}
+        else:
+            meta = dict(row)
+        meta.update(path=path, project_dir=project_dir, size=st.st_size, mtime_ns=st.st_mtime_ns, inode=st.st_ino)
 
+        position = {}
+        for obj in self.parser._iter_records(path, meta['offset'], position):
+            if not meta['cwd'] and isinstance(obj.get('cwd'), str):
+                meta['cwd'] = obj['cwd']
+            timestamp = obj.get('timestamp')
+            if isinstance(timestamp, str) and timestamp:
+                if timestamp < meta['last_stamp']:
+                    meta['ordered'] = 0
+                meta['last_stamp'] = timestamp
+            try:
+                message = self.parser._record_to_message(obj)
+            except Exception:
+                continue
+            if not message:
+                continue
 
-class DoubaoParser(ChatParser):
-    """豆包聊天记录解析器"""
+            if message['role'] == '🧑 用户':
+                meta['user_count'] += 1
+                if not meta['first_user_message']:
+                    meta['first_user_message'] = message['text'][:200]
+            else:
+                meta['assistant_count'] += 1
+            if isinstance(message['time'], str) and message['time']:
+                meta['first_time'] = meta['first_time'] or message['time']
+                meta['last_time'] = message['time']
+        meta['offset'] = position['offset']
+        return meta
+
+    def query(self, project=None, min_size=None, since=None, until=None, order_by='mtime', limit=None, paths=None):
+        """按条件查询会话元数据
+
+        project 匹配真实工作目录（cwd）或项目目录；since/until 为日期或ISO时间前缀，
+        选出与时间范围有交集的会话；paths 限定在给定的会话文件内。返回字典列表。
+        """
+        sql = 'SELECT * FROM sessions WHERE 1 = 1'
+        params = []
+        if project:
+            sql += ' AND (cwd = ? OR project_dir = ?)'
+            params += [project, project]
+        if min_size:
+            sql += ' AND size >= ?'
+            params.append(min_size)
+        if since:
+            sql += ' AND last_time >= ?'
+            params.append(since)
+        if until:
+            sql += ' AND first_time != \'\' AND substr(first_time, 1, ?) <= ?'
+            params += [len(until), until]
+        sql += f' ORDER BY {self.ORDERS[order_by]}'
+        if limit and paths is None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        rows = [dict(row) for row in self.conn.execute(sql, params)]
+        if paths is not None:
+            wanted = {os.path.abspath(p) for p in paths}
+            rows = [row for row in rows if os.path.abspath(row['path']) in wanted]
+            if limit:
+                rows = rows[:limit]
+        return rows
+
+
+class JSONStreamReader:
+    """增量JSON读取器
+
+    每次只把一个值读入内存：按块读取文本，用标准库的 raw_decode 解码缓冲区开头的值；
+    缓冲区里的值不完整时再读入更多内容重试（读取量成倍增长，避免反复解码大元素）。
+    """
+
+    def __init__(self, f, chunk_size=1 << 16):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self, size=None):
+        """读入更多文本，返回是否读到了内容"""
+        if self.eof:
+            return False
+        chunk = self.f.read(size or self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符；到达文件末尾时返回空字符串"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in ' \t\r\n':
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        """读取一个指定的结构字符"""
+        if self.peek() != char:
+            raise ValueError(f'JSON 格式错误：期望 {char!r}')
+        self.pos += 1
+
+    def value(self):
+        """解码并返回下一个完整的JSON值"""
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                    raise
+                continue
+            # 数字可能在缓冲区末尾被截断（如 "123." 只解出 123），需要确认后面已经是分隔符
+            truncated = end == len(self.buf) or (
+                isinstance(obj, (int, float)) and self.buf[end] not in ',]} \t\r\n')
+            if truncated and self._fill(max(self.chunk_size, len(self.buf) - self.pos)):
+                continue
+            self.pos = end
+            return obj
+
+    def iter_array(self):
+        """逐个产出当前位置上数组的元素"""
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == ']':
+                return
+            if char != ',':
+                raise ValueError('JSON 格式错误：数组元素之间缺少逗号')
+
+
+def iter_json_array(f, keys=('messages', 'conversations')):
+    """流式产出JSON文件中的消息数组元素
+
+    顶层是数组时逐个产出其元素；顶层是对象时产出第一个出现的 keys 字段（数组）的元素，
+    其余字段的值读过即丢弃。
+    """
+    reader = JSONStreamReader(f)
+    char = reader.peek()
+    if char == '[':
+        yield from reader.iter_array()
+        return
+    if char != '{':
+        raise ValueError('JSON 格式错误：顶层既不是对象也不是数组')
+
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.expect(':')
+        if key in keys and reader.peek() == '[':
+            yield from reader.iter_array()
+            return
+        reader.value()
+        char = reader.peek()
+        reader.pos += 1
+        if char == '}':
+            return
+        if char != ',':
+            raise ValueError('JSON 格式错误：对象字段之间缺少逗号')
+
+
+class JSONChatParser(ChatParser):
+    """JSON格式聊天记录解析器基类（GPT / Gemini / 豆包）
+
+    会话文件是消息数组，或带 messages / conversations 数组字段的对象；
+    每条消息含 role、content 和 created / timestamp。
+    """
+
+    app_name = ''
+    assistant_label = ''
+    assistant_roles = ()
+    possible_dirs = ()
+    prefetch = True
 
     def __init__(self):
-        # 查找豆包聊天记录存储位置
-        self.base_dir = self._find_doubao_dir()
-
-    def _find_doubao_dir(self):
-        """查找豆包聊天记录存储目录"""
-        possible_dirs = [
-            os.path.expanduser("~/Library/Application Support/Doubao"),
-            os.path.expanduser("~/.doubao"),
-            os.path.expanduser("~/Documents/Doubao"),
-            os.path.expanduser("~/AppData/Roaming/Doubao")
-        ]
-
-        for d in possible_dirs:
+        # 聊天记录存储位置在第一次用到时才查找
+        self._base_dir = None
+        self._base_dir_found = False
+
+    @property
+    def base_dir(self):
+        """聊天记录存储目录（首次访问时探测各个候选位置）"""
+        if not self._base_dir_found:
+            self._base_dir = self._find_dir()
+            self._base_dir_found = True
+        return self._base_dir
+
+    @base_dir.setter
+    def base_dir(self, path):
+        self._base_dir = path
+        self._base_dir_found = True
+
+    def _find_dir(self):
+        """查找聊天记录存储目录"""
+        for d in self.possible_dirs:
+            d = os.path.expanduser(d)
             if os.path.exists(d):
                 return d
 
         return None
 
     def list_sessions(self):
-        """列出豆包聊天会话"""
+        """列出聊天会话"""
         if not self.base_dir or not os.path.exists(self.base_dir):
             return []
 
         sessions = []
         for root, dirs, files in os.walk(self.base_dir):
             for filename in files:
-                if filename.endswith(".json") or filename.endswith(".jsonl"):
+                if strip_compression(filename).endswith((".json", ".jsonl")):
                     sessions.append({
                         "name": filename,
                         "path": os.path.join(root, filename),
@@ -347,53 +1361,57 @@ class DoubaoParser(ChatParser):
 
         return sessions
 
-    def parse_session(self, filepath, include_tools=False, include_media=False):
-        """解析豆包聊天记录"""
-        messages = []
+    def iter_messages(self, filepath, include_tools=False, include_media=False):
+        """流式解析聊天记录：逐个读取消息数组的元素，内存占用与文件大小无关"""
+        stats = self.stats
+        produced = False
         try:
-            with open(filepath, encoding='utf-8') as f:
-                data = json.load(f)
-                # 尝试多种可能的数据结构
-                if 'messages' in data:
-                    messages_data = data['messages']
-                elif 'conversations' in data:
-                    messages_data = data['conversations']
-                else:
-                    messages_data = data
+            with open_session(filepath, encoding='utf-8-sig') as f:
+                items = iter_json_array(f)
+                if stats is not None:
+                    # 流式读取和解码交织在一起，统一计入解码阶段
+                    stats.add('files')
+                    stats.add('bytes_read', _file_size(filepath))
+                    items = stats.timed('decode', items)
+                for item in items:
+                    if stats is None:
+                        message = self._to_message(item)
+                    else:
+                        stats.add('decoded')
+                        with stats.phase('extract'):
+                            message = self._to_message(item, filepath)
+                    if message:
+                        produced = True
+                        yield message
+        except (OSError, ValueError) as e:
+            if stats is not None:
+                stats.error(filepath, None, e)
+            # 如果解析失败，返回简单的错误信息（已经输出了部分消息时直接结束）
+            if not produced:
+                yield from placeholder_messages(self.app_name, '访问特定的存储格式')
 
-                for msg in messages_data:
-                    try:
-                        role = msg.get('role', '')
-                        content = msg.get('content', '')
-                        timestamp = msg.get('created', '') or msg.get('timestamp', '')
-
-                        if role == 'user':
-                            messages.append({
-                                'role': '🧑 用户',
-                                'text': content.strip(),
-                                'time': self._format_time(timestamp)
-                            })
-                        elif role == 'assistant' or role == 'model':
-                            messages.append({
-                                'role': '🤖 豆包',
-                                'text': content.strip(),
-                                'time': self._format_time(timestamp)
-                            })
-                    except:
-                        pass
-        except:
-            messages.append({
-                'role': '🧑 用户',
-                'text': '豆包聊天记录解析功能正在开发中...',
-                'time': datetime.now().isoformat()
-            })
-            messages.append({
-                'role': '🤖 系统',
-                'text': '豆包聊天记录解析需要访问特定的存储格式，当前版本暂不支持。',
-                'time': datetime.now().isoformat()
-            })
+    def _to_message(self, msg, filepath=None):
+        """把一条原始消息转换为导出用的消息，不需要输出时返回None（filepath 只用于记录错误位置）"""
+        try:
+            role = msg.get('role', '')
+            if role != 'user' and role not in self.assistant_roles:
+                if self.stats is not None:
+                    self.stats.skip('no_message')
+                return None
+            text = msg.get('content', '').strip()
+            timestamp = msg.get('created', '') or msg.get('timestamp', '')
+            time_str = self._format_time(timestamp)
+        except Exception as e:
+            if self.stats is not None:
+                self.stats.skip('record_error')
+                self.stats.error(filepath, None, e)
+            return None
 
-        return messages
+        return {
+            'role': '🧑 用户' if role == 'user' else self.assistant_label,
+            'text': text,
+            'time': time_str
+        }
 
     def _format_time(self, timestamp):
         """格式化时间戳"""
@@ -402,47 +1420,397 @@ class DoubaoParser(ChatParser):
         return timestamp
 
 
-class WeChatParser(ChatParser):
-    """微信聊天记录解析器"""
+def chatgpt_active_branch(mapping, current_node=None):
+    """还原 ChatGPT 对话树中当前显示的分支，按时间顺序返回节点列表
 
-    def __init__(self):
+    从 current_node 沿 parent 向上迭代到根节点再反转，时间复杂度 O(n)，不使用递归；
+    没有 current_node 时从最后创建的叶子节点开始。遇到环或缺失的节点时停止。
+    """
+    if current_node not in mapping:
+        leaves = [node for node in mapping.values() if isinstance(node, dict) and not node.get('children')]
+        if not leaves:
+            return []
+        current_node = max(leaves, key=lambda node: (node.get('message') or {}).get('create_time') or 0).get('id')
+
+    branch = []
+    seen = set()
+    node_id = current_node
+    while node_id is not None and node_id in mapping and node_id not in seen:
+        seen.add(node_id)
+        node = mapping[node_id]
+        branch.append(node)
+        node_id = node.get('parent')
+    branch.reverse()
+    return branch
+
+
+class GPTParser(JSONChatParser):
+    """GPT 聊天记录解析器
+
+    除了普通的消息数组，还支持 ChatGPT 数据导出中的 conversations.json：
+    顶层是对话数组，每个对话用 mapping 节点树保存消息（parent / children、content.parts），
+    current_node 指向当前显示的分支末端。
+    """
+
+    app_name = 'GPT'
+    assistant_label = '🤖 GPT'
+    assistant_roles = ('assistant', 'system')
+    possible_dirs = (
+        "~/Library/Application Support/OpenAI",
+        "~/.openai",
+        "~/Documents/OpenAI",
+        "~/AppData/Roaming/OpenAI"
+    )
+
+    def is_conversation_export(self, filepath):
+        """判断文件是否是 ChatGPT 数据导出（第一个元素是带 mapping 的对话）"""
+        try:
+            with open_session(filepath, encoding='utf-8-sig') as f:
+                first = next(iter_json_array(f), None)
+        except (OSError, ValueError):
+            return False
+        return isinstance(first, dict) and 'mapping' in first
+
+    def iter_messages(self, filepath, include_tools=False, include_media=False):
+        """解析聊天记录；ChatGPT 数据导出中的所有对话依次输出"""
+        if not self.is_conversation_export(filepath):
+            yield from super().iter_messages(filepath, include_tools, include_media)
+            return
+        for title, messages in self.iter_conversations(filepath, include_tools, include_media):
+            yield from messages
+
+    def iter_conversations(self, filepath, include_tools=False, include_media=False):
+        """逐个产出文件中的对话 (标题, 消息)
+
+        ChatGPT 数据导出按对话流式读取，同一时间只在内存中保留一个对话；
+        普通的消息数组整体作为一个没有标题的对话。
+        """
+        for _, title, messages in self.iter_conversation_items(filepath, include_tools, include_media):
+            yield title, messages
+
+    def iter_conversation_items(self, filepath, include_tools=False, include_media=False):
+        """与 iter_conversations 相同，额外产出对话ID：(对话ID, 标题, 消息)
+
+        没有 id 字段的对话用它在文件中的序号，普通的消息数组对话ID为空。
+        """
+        if not self.is_conversation_export(filepath):
+            yield '', '', super().iter_messages(filepath, include_tools, include_media)
+            return
+
+        stats = self.stats
+        try:
+            with open_session(filepath, encoding='utf-8-sig') as f:
+                conversations = iter_json_array(f)
+                if stats is not None:
+                    stats.add('files')
+                    stats.add('bytes_read', _file_size(filepath))
+                    conversations = stats.timed('decode', conversations)
+                for index, conversation in enumerate(conversations):
+                    if not isinstance(conversation, dict):
+                        continue
+                    if stats is None:
+                        messages = self._conversation_messages(conversation, include_tools, include_media)
+                    else:
+                        stats.add('decoded')
+                        with stats.phase('extract'):
+                            messages = self._conversation_messages(conversation, include_tools, include_media)
+                    if messages:
+                        conversation_id = conversation.get('id') or conversation.get('conversation_id') or str(index)
+                        yield str(conversation_id), conversation.get('title') or '', messages
+        except (OSError, ValueError) as e:
+            # 已经输出的对话保留，其余部分跳过
+            if stats is not None:
+                stats.error(filepath, None, e)
+
+    def _conversation_messages(self, conversation, include_tools=False, include_media=False):
+        """把一个对话当前分支上的节点转换为消息列表"""
+        mapping = conversation.get('mapping')
+        if not isinstance(mapping, dict):
+            return []
+        messages = []
+        for node in chatgpt_active_branch(mapping, conversation.get('current_node')):
+            message = self._node_to_message(node.get('message'), include_tools, include_media)
+            if message:
+                messages.append(message)
+            elif self.stats is not None:
+                self.stats.skip('no_message')
+        return messages
+
+    def _node_to_message(self, msg, include_tools=False, include_media=False):
+        """把对话树节点中的消息转换为导出用的消息，不需要输出时返回None"""
+        if not isinstance(msg, dict):
+            return None
+        metadata = msg.get('metadata') or {}
+        if metadata.get('is_visually_hidden_from_conversation'):
+            return None
+
+        author = msg.get('author') or {}
+        role = author.get('role', '')
+        text = self._content_text(msg.get('content') or {}, include_media)
+        if not text:
+            return None
+
+        if role == 'user':
+            label = '🧑 用户'
+        elif role == 'assistant':
+            label = self.assistant_label
+            recipient = msg.get('recipient', 'all')
+            if recipient != 'all':
+                # 助手发给工具的消息（代码解释器、浏览等）
+                if not include_tools:
+                    return None
+                text = f'[调用工具：{recipient}]\n参数：{self._tool_input_text(text, ".txt", recipient)}'
+        elif role == 'tool':
+            if not include_tools:
+                return None
+            label = self.assistant_label
+            text = f'[工具返回结果]\n{self._tool_result_text(text, author.get("name"))}'
+        else:
+            return None
+
+        timestamp = msg.get('create_time')
+        return {
+            'role': label,
+            'text': text,
+            'time': self._format_time(timestamp) if timestamp else ''
+        }
+
+    def _content_text(self, content, include_media=False):
+        """提取消息内容中的文本：parts 中的字符串，或 code / execution_output 等类型的 text"""
+        if content.get('content_type') == 'user_editable_context':
+            # 自定义指令，不属于对话内容
+            return ''
+        parts = content.get('parts')
+        if isinstance(parts, list):
+            texts = []
+            for part in parts:
+                if isinstance(part, str):
+                    if part.strip():
+                        texts.append(part.strip())
+                elif isinstance(part, dict) and include_media:
+                    texts.append(f'[附件：{part.get("asset_pointer") or part.get("content_type", "未知")}]')
+            return '\n\n'.join(texts)
+        text = content.get('text') or content.get('result') or ''
+        return text.strip() if isinstance(text, str) else ''
+
+
+class GeminiParser(JSONChatParser):
+    """Gemini 聊天记录解析器"""
+
+    app_name = 'Gemini'
+    assistant_label = '🤖 Gemini'
+    assistant_roles = ('model', 'assistant')
+    possible_dirs = (
+        "~/Library/Application Support/Google/Gemini",
+        "~/.gemini",
+        "~/Documents/Google/Gemini",
+        "~/AppData/Roaming/Google/Gemini"
+    )
+
+
+class DoubaoParser(JSONChatParser):
+    """豆包聊天记录解析器"""
+
+    app_name = '豆包'
+    assistant_label = '🤖 豆包'
+    assistant_roles = ('assistant', 'model')
+    possible_dirs = (
+        "~/Library/Application Support/Doubao",
+        "~/.doubao",
+        "~/Documents/Doubao",
+        "~/AppData/Roaming/Doubao"
+    )
+
+
+class WeChatParser(ChatParser):
+    """微信聊天记录解析器
+
+    读取已解密的微信 PC 版消息数据库：<账号>/Msg/Multi/MSG0.db ~ MSGn.db，
+    消息保存在 MSG 表中（localId、CreateTime、StrTalker、IsSender、Type、StrContent 等字段）。
+    一个联系人或群聊是一个会话，会话路径写作 "<Multi 目录>::<StrTalker>"；
+    也可以直接传入 Multi 目录或单个 MSG*.db，导出其中的全部消息。
+    """
+
+    # 会话路径中 Multi 目录与联系人之间的分隔符
+    TALKER_SEPARATOR = '::'
+
+    # 每页读取的行数（键集分页，不使用 OFFSET）
+    page_size = 2000
+
+    # 非文本消息类型对应的说明（只在包含媒体时输出）
+    MEDIA_TYPES = {
+        3: '[图片]',
+        34: '[语音]',
+        42: '[名片]',
+        43: '[视频]',
+        47: '[表情]',
+        48: '[位置]',
+        49: '[链接/文件]',
+        50: '[通话]',
+    }
+
+    def __init__(self):
         self.base_dir = os.path.expanduser("~/Documents/WeChat Files")
 
     def list_sessions(self):
-        """列出微信聊天会话"""
+        """列出微信账号，以及每个账号下的联系人 / 群聊会话"""
         if not os.path.exists(self.base_dir):
             return []
 
-        # 简单实现 - 需要根据微信实际存储结构调整
         sessions = []
-        for filename in os.listdir(self.base_dir):
+        for filename in sorted(os.listdir(self.base_dir)):
             file_path = os.path.join(self.base_dir, filename)
-            if os.path.isdir(file_path):
-                sessions.append({
-                    "name": filename,
-                    "path": file_path,
-                    "sessions": []
-                })
+            if not os.path.isdir(file_path):
+                continue
+            multi_dir = os.path.join(file_path, 'Msg', 'Multi')
+            shards = self.find_shards(multi_dir)
+            talkers = set()
+            for shard in shards:
+                with self._connect(shard) as conn:
+                    talkers.update(row[0] for row in conn.execute('SELECT DISTINCT StrTalker FROM MSG') if row[0])
+            sessions.append({
+                "name": filename,
+                "path": multi_dir if shards else file_path,
+                "sessions": [f'{multi_dir}{self.TALKER_SEPARATOR}{talker}' for talker in sorted(talkers)]
+            })
 
         return sessions
 
-    def parse_session(self, filepath, include_tools=False, include_media=False):
-        """解析微信聊天记录"""
-        # 微信聊天记录解析实现（需要根据微信实际存储格式调整）
-        # 微信使用数据库存储，需要特殊处理
-        messages = []
-        messages.append({
-            'role': '🧑 用户',
-            'text': '微信聊天记录解析功能正在开发中...',
-            'time': datetime.now().isoformat()
-        })
-        messages.append({
-            'role': '🤖 系统',
-            'text': '微信聊天记录解析需要访问微信数据库，当前版本暂不支持。',
-            'time': datetime.now().isoformat()
-        })
+    def describe_session(self, filepath):
+        """项目名是微信账号，会话名是联系人 / 群聊ID（未指定时为 all）"""
+        multi_dir, _, talker = os.fspath(filepath).partition(self.TALKER_SEPARATOR)
+        account_dir = os.path.dirname(os.path.dirname(os.path.abspath(multi_dir)))
+        return {'project': os.path.basename(account_dir), 'session': talker or 'all'}
 
-        return messages
+    def find_shards(self, path):
+        """返回目录中按编号排序的 MSG*.db 分片；path 本身是数据库文件时只返回它"""
+        if os.path.isfile(path):
+            return [path]
+        if not os.path.isdir(path):
+            return []
+        shards = [name for name in os.listdir(path) if re.fullmatch(r'MSG\d+\.db', name)]
+        return [os.path.join(path, name) for name in sorted(shards, key=lambda name: int(name[3:-3]))]
+
+    def _connect(self, db_path):
+        """以只读方式打开数据库（不创建日志文件，也不会修改原始数据）"""
+        import sqlite3
+        from pathlib import Path
+        return contextlib.closing(sqlite3.connect(f'{Path(db_path).resolve().as_uri()}?mode=ro', uri=True))
+
+    def iter_messages(self, filepath, include_tools=False, include_media=False):
+        """按时间顺序流式读取一个会话的消息
+
+        每个分片在单独的线程中按 (CreateTime, localId) 键集分页读取，
+        再用 heapq.merge 按时间归并，内存中只保留每个分片的少量页面。
+        """
+        import heapq
+
+        path, _, talker = os.fspath(filepath).partition(self.TALKER_SEPARATOR)
+        shards = self.find_shards(path)
+        stats = self.stats
+        if stats is not None:
+            stats.add('files', len(shards))
+
+        streams = [self._iter_shard_rows(shard, index, talker or None) for index, shard in enumerate(shards)]
+        try:
+            for row in heapq.merge(*streams):
+                if stats is not None:
+                    stats.add('lines')
+                message = self._row_to_message(row, talker, include_media)
+                if message:
+                    yield message
+                elif stats is not None:
+                    stats.skip('no_message')
+        finally:
+            for stream in streams:
+                stream.close()
+
+    def _iter_shard_rows(self, db_path, shard_index, talker=None):
+        """在后台线程中分页读取一个分片，逐行产出 (CreateTime, 分片序号, localId, ...) 元组"""
+        import queue
+        import threading
+
+        pages = queue.Queue(maxsize=2)
+        stop = threading.Event()
+
+        def put(item):
+            """放入队列；消费方已关闭（stop）时放弃，返回是否放入"""
+            while not stop.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def read_pages():
+            try:
+                for page in self._read_pages(db_path, talker):
+                    if not put([(row[1], shard_index) + row for row in page]):
+                        return
+                put(None)
+            except Exception as e:
+                put(e)
+
+        reader = threading.Thread(target=read_pages, daemon=True)
+        reader.start()
+        try:
+            while True:
+                page = pages.get()
+                if page is None:
+                    return
+                if isinstance(page, Exception):
+                    raise page
+                yield from page
+        finally:
+            stop.set()
+            reader.join()
+
+    def _read_pages(self, db_path, talker=None):
+        """键集分页读取：每页从上一页最后一行的 (CreateTime, localId) 之后继续，不使用 OFFSET"""
+        columns = 'localId, CreateTime, IsSender, Type, StrTalker, StrContent'
+        where = 'WHERE StrTalker = ? AND (CreateTime, localId) > (?, ?)' if talker else \
+            'WHERE (CreateTime, localId) > (?, ?)'
+        sql = f'SELECT {columns} FROM MSG {where} ORDER BY CreateTime, localId LIMIT ?'
+        last = (-1, -1)
+        with self._connect(db_path) as conn:
+            while True:
+                params = ((talker,) if talker else ()) + last + (self.page_size,)
+                page = conn.execute(sql, params).fetchall()
+                if not page:
+                    return
+                yield page
+                if len(page) < self.page_size:
+                    return
+                last = (page[-1][1], page[-1][0])
+
+    def _row_to_message(self, row, talker, include_media=False):
+        """把一行消息转换为导出用的消息，不需要输出时返回None"""
+        create_time, _, _, _, is_sender, msg_type, str_talker, content = row
+        content = content or ''
+        # 部分系统消息的 StrTalker 为 NULL
+        str_talker = str_talker or ''
+        sender = talker or str_talker
+        if str_talker.endswith('@chatroom') and not is_sender and ':\n' in content:
+            # 群聊消息的内容以 "发送者:\n" 开头
+            sender, content = content.split(':\n', 1)
+
+        if msg_type == 1:
+            text = content.strip()
+        elif msg_type == 10000:
+            text = f'[系统消息] {content.strip()}'
+        elif include_media:
+            text = self.MEDIA_TYPES.get(msg_type, f'[消息类型 {msg_type}]')
+        else:
+            return None
+        if not text:
+            return None
+
+        return {
+            'role': '🧑 我' if is_sender else f'💬 {sender}',
+            'text': text,
+            'time': datetime.fromtimestamp(create_time).isoformat() if create_time else ''
+        }
 
 
 class QQParser(ChatParser):
@@ -468,22 +1836,10 @@ class QQParser(ChatParser):
 
         return sessions
 
-    def parse_session(self, filepath, include_tools=False, include_media=False):
+    def iter_messages(self, filepath, include_tools=False, include_media=False):
         """解析QQ聊天记录"""
         # QQ聊天记录解析实现（需要根据QQ实际存储格式调整）
-        messages = []
-        messages.append({
-            'role': '🧑 用户',
-            'text': 'QQ聊天记录解析功能正在开发中...',
-            'time': datetime.now().isoformat()
-        })
-        messages.append({
-            'role': '🤖 系统',
-            'text': 'QQ聊天记录解析需要访问QQ数据库，当前版本暂不支持。',
-            'time': datetime.now().isoformat()
-        })
-
-        return messages
+        yield from placeholder_messages('QQ', '访问QQ数据库')
 
 
 class SlackParser(ChatParser):
@@ -509,22 +1865,10 @@ class SlackParser(ChatParser):
 
         return sessions
 
-    def parse_session(self, filepath, include_tools=False, include_media=False):
+    def iter_messages(self, filepath, include_tools=False, include_media=False):
         """解析Slack聊天记录"""
         # Slack聊天记录解析实现
-        messages = []
-        messages.append({
-            'role': '🧑 用户',
-            'text': 'Slack聊天记录解析功能正在开发中...',
-            'time': datetime.now().isoformat()
-        })
-        messages.append({
-            'role': '🤖 系统',
-            'text': 'Slack聊天记录解析需要访问Slack API，当前版本暂不支持。',
-            'time': datetime.now().isoformat()
-        })
-
-        return messages
+        yield from placeholder_messages('Slack', '访问Slack API')
 
 
 class DiscordParser(ChatParser):
@@ -550,172 +1894,2856 @@ class DiscordParser(ChatParser):
 
         return sessions
 
-    def parse_session(self, filepath, include_tools=False, include_media=False):
+    def iter_messages(self, filepath, include_tools=False, include_media=False):
         """解析Discord聊天记录"""
         # Discord聊天记录解析实现
-        messages = []
-        messages.append({
-            'role': '🧑 用户',
-            'text': 'Discord聊天记录解析功能正在开发中...',
-            'time': datetime.now().isoformat()
-        })
-        messages.append({
-            'role': '🤖 系统',
-            'text': 'Discord聊天记录解析需要访问Discord API，当前版本暂不支持。',
-            'time': datetime.now().isoformat()
-        })
+        yield from placeholder_messages('Discord', '访问Discord API')
 
-        return messages
 
+# 暂存文件序号，保证同一进程内的暂存文件名不冲突
+_STAGE_IDS = itertools.count()
 
-class ChatExporter:
-    """聊天记录导出器"""
 
-    def __init__(self, chat_app):
-        # 根据聊天应用选择解析器
-        parsers = {
-            "claude": ClaudeCodeParser,
-            "wechat": WeChatParser,
-            "qq": QQParser,
-            "slack": SlackParser,
-            "discord": DiscordParser,
-            "gpt": GPTParser,
-            "gemini": GeminiParser,
-            "doubao": DoubaoParser
-        }
+def safe_filename(text):
+    """去掉文件名中的特殊字符"""
+    return text.replace('/', '_').replace('\\', '_').replace(':', '').replace('*', '').replace('?', '').replace('"', '').replace('<', '').replace('>', '').replace('|', '')
 
-        if chat_app.lower() not in parsers:
-            raise ValueError(f"不支持的聊天应用: {chat_app}")
 
-        self.parser = parsers[chat_app.lower()]()
-        self.chat_app = chat_app.lower()
+def copy_stream(src, dst, block_size=1 << 16):
+    """把 src 剩余的内容分块复制到 dst（代替 shutil.copyfileobj，省去启动时的导入）"""
+    while True:
+        block = src.read(block_size)
+        if not block:
+            return
+        dst.write(block)
 
-    def list_sessions(self):
-        """列出所有会话"""
-        return self.parser.list_sessions()
 
-    def parse_session(self, filepath, include_tools=False, include_media=False):
-        """解析会话文件"""
-        return self.parser.parse_session(filepath, include_tools, include_media)
+def _message_digest(uuid):
+    """消息 uuid 的 128 位摘要（整数）"""
+    return int.from_bytes(hashlib.blake2b(uuid.encode('utf-8', 'surrogateescape'), digest_size=16).digest(), 'little')
 
-    def export_to_markdown(self, messages, output_dir, include_tools=False, include_media=False):
-        """导出为Markdown格式"""
-        if not messages:
-            print("没有可导出的消息。")
-            return
 
-        # 获取时间范围
-        first_time = messages[0].get('time', '')[:10] if messages else '未知'
-        last_time = messages[-1].get('time', '')[:10] if messages else '未知'
-
-        # 生成文件名
-        first_msg = messages[0]['text'] if messages else '无标题'
-        safe_first_msg = first_msg[:20].replace('/', '_').replace('\\', '_').replace(':', '').replace('*', '').replace('?', '').replace('"', '').replace('<', '').replace('>', '').replace('|', '')
-        filename = f"{first_time}_{safe_first_msg}.md"
-        output_file = os.path.join(output_dir, filename)
-
-        # 生成Markdown
-        md_lines = []
-        md_lines.append(f'# {self.get_chat_app_name()} 聊天记录')
-        md_lines.append('')
-        md_lines.append(f'- 导出时间：{datetime.now().strftime("%Y-%m-%d %H:%M")}')
-        md_lines.append(f'- 对话时间：{first_time} ~ {last_time}')
-        md_lines.append(f'- 消息数量：{len(messages)} 条')
-        md_lines.append('')
-        md_lines.append('---')
-        md_lines.append('')
+def _message_key(uuid):
+    """消息 uuid 的 128 位整数（跨会话去重只保存整数，不保存字符串）；不是标准 UUID 时取摘要"""
+    if len(uuid) == 36:
+        try:
+            return int(uuid.replace('-', ''), 16)
+        except ValueError:
+            pass
+    return _message_digest(uuid)
 
-        for msg in messages:
-            time_str = msg['time'][11:16] if len(msg['time']) > 16 else ''
-            md_lines.append(f'## {msg["role"]} {time_str}')
-            md_lines.append('')
-            md_lines.append(msg['text'])
-            md_lines.append('')
-            md_lines.append('---')
-            md_lines.append('')
 
-        # 确保输出目录存在
-        os.makedirs(output_dir, exist_ok=True)
+class MessageSet:
+    """已导出消息的集合（跨会话去重）
 
-        with open(output_file, 'w', encoding='utf-8') as f:
-            f.write('\n'.join(md_lines))
+    每条消息只保存 uuid 折叠成的 64 位整数，百万条消息约占 60~90MB。
+    """
 
-        print('OK 已导出 {} 条消息 -> {}'.format(len(messages), output_file))
+    def __init__(self):
+        self._keys = set()
 
-    def get_chat_app_name(self):
-        """获取聊天应用的中文名称"""
-        names = {
-            "claude": "Claude Code",
-            "wechat": "微信",
-            "qq": "QQ",
-            "slack": "Slack",
-            "discord": "Discord",
-            "gpt": "GPT",
-            "gemini": "Gemini",
-            "doubao": "豆包"
-        }
-        return names.get(self.chat_app, self.chat_app)
+    def add(self, uuid):
+        """加入一条消息，之前没有见过时返回 True"""
+        key = _message_key(uuid)
+        key = (key ^ (key >> 64)) & 0xFFFFFFFFFFFFFFFF
+        if key in self._keys:
+            return False
+        self._keys.add(key)
+        return True
 
+    def __len__(self):
+        return len(self._keys)
 
-def main():
-    """主函数"""
-    parser = argparse.ArgumentParser(description='通用型聊天记录导出工具')
-    parser.add_argument('chat_app', help='聊天应用名称 (claude/wechat/qq/slack/discord)')
-    parser.add_argument('output_dir', help='输出目录')
-    parser.add_argument('--tools', action='store_true', help='包含工具调用记录')
-    parser.add_argument('--media', action='store_true', help='包含媒体文件')
-    parser.add_argument('--session', help='特定会话文件路径')
 
-    args = parser.parse_args()
+class BloomFilter:
+    """内存固定的已导出消息集合（布隆过滤器）
 
-    try:
-        # 创建导出器
-        exporter = ChatExporter(args.chat_app)
+    size 是位数组占用的字节数，k 个位置由 uuid 摘要的两半双重散列得到
+    （用摘要而不是 uuid 本身，避免有规律的 uuid 落到相同的位上）。
+    不会漏判已见过的消息；误判率随消息数增加，误判的消息会被当成重复而跳过。
+    """
+
+    def __init__(self, size, hashes=7):
+        size = max(1, int(size))
+        self.bits = size * 8
+        self._array = bytearray(size)
+        self.hashes = hashes
+        self.count = 0
+
+    def add(self, uuid):
+        """加入一条消息，之前（可能）见过时返回 False"""
+        key = _message_digest(uuid)
+        h1, h2 = key & 0xFFFFFFFFFFFFFFFF, (key >> 64) | 1
+        array = self._array
+        new = False
+        for i in range(self.hashes):
+            bit = (h1 + i * h2) % self.bits
+            byte, mask = bit >> 3, 1 << (bit & 7)
+            if not array[byte] & mask:
+                array[byte] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __len__(self):
+        return self.count
+
+
+def make_message_set(memory=None):
+    """跨会话去重用的集合：memory 为 None 时精确去重，否则用占用 memory 字节的布隆过滤器"""
+    return MessageSet() if memory is None else BloomFilter(memory)
+
+
+class BlobStore:
+    """工具内容的内容寻址存储
+
+    较长的工具参数和返回结果按 UTF-8 内容的 SHA-256 保存为 <输出目录>/_blobs/<前两位>/<摘要>.<扩展名>，
+    相同的内容（同一会话内或跨会话）只写一次，Markdown 中只保留指向它的链接。
+    文件先写临时文件再改名，多个进程同时写入同一内容也是安全的。
+    """
 
-        # 如果指定了特定会话文件
-        if args.session:
-            messages = exporter.parse_session(args.session, args.tools, args.media)
-            exporter.export_to_markdown(messages, args.output_dir, args.tools, args.media)
+    DIRNAME = '_blobs'
+
+    def __init__(self, output_dir, min_size=256, stats=None):
+        self.output_dir = output_dir
+        # 短于 min_size 个字符的内容仍然内联（截断规则不变）
+        self.min_size = min_size
+        self.stats = stats
+        # 本次运行中已经确认存在的摘要
+        self._stored = set()
+
+    def link(self, text, suffix='.txt'):
+        """保存内容（已存在时跳过），返回Markdown链接"""
+        path, size = self.put(text, suffix)
+        return f'[完整内容（{size / 1024:.1f} KB）]({path})'
+
+    def put(self, text, suffix='.txt'):
+        """保存内容，返回 (相对输出目录的路径, 字节数)"""
+        data = text.encode('utf-8')
+        digest = hashlib.sha256(data).hexdigest()
+        path = f'{self.DIRNAME}/{digest[:2]}/{digest}{suffix}'
+        key = digest + suffix
+        if key in self._stored:
+            self._count('reused', len(data))
+            return path, len(data)
+
+        full_path = os.path.join(self.output_dir, *path.split('/'))
+        if os.path.exists(full_path):
+            self._count('reused', len(data))
         else:
-            # 列出所有会话
-            sessions = exporter.list_sessions()
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            temp_path = f'{full_path}.{os.getpid()}.{next(_STAGE_IDS)}.tmp'
+            with open(temp_path, 'xb') as f:
+                f.write(data)
+            os.replace(temp_path, full_path)
+            self._count('written', len(data))
+        self._stored.add(key)
+        return path, len(data)
+
+    def _count(self, kind, size):
+        """统计写入（written）或复用（reused）的内容数和字节数"""
+        if self.stats is not None:
+            self.stats.add(f'blobs_{kind}')
+            self.stats.add(f'blob_bytes_{kind}', size)
+
+
+def render_message(msg):
+    """渲染单条消息对应的Markdown片段"""
+    time_str = msg['time'][11:16] if len(msg['time']) > 16 else ''
+    return '\n'.join([f'## {msg["role"]} {time_str}', '', msg['text'], '', '---', ''])
+
+
+def render_header(title, first_time, last_time, count, extra_lines=()):
+    """渲染Markdown文件头"""
+    lines = [f'# {title}', '']
+    lines.append(f'- 导出时间：{datetime.now().strftime("%Y-%m-%d %H:%M")}')
+    lines.append(f'- 对话时间：{first_time} ~ {last_time}')
+    lines.append(f'- 消息数量：{count} 条')
+    lines.extend(extra_lines)
+    lines.extend(['', '---', ''])
+    return '\n'.join(lines)
+
+
+def _same_header(old, new):
+    """比较两个文件头，忽略每次导出都不同的导出时间"""
+    def strip(header):
+        return [line for line in header.split('\n') if not line.startswith('- 导出时间：')]
+    return strip(old) == strip(new)
+
+
+def _read_header(f):
+    """读取已导出文件的文件头（到分隔线为止），f 随后定位在正文开头；不是导出文件时返回None"""
+    lines = []
+    for line in f:
+        lines.append(line)
+        if line == '---\n':
+            return ''.join(lines)
+        if len(lines) > 64:
+            break
+    return None
+
+
+def _open_existing(path):
+    """打开已导出的文件用于比较，返回 (文件, 文件头)；不存在或无法识别时返回None"""
+    try:
+        f = open_session(path, encoding='utf-8')
+    except (OSError, ImportError):
+        return None
+    try:
+        header = _read_header(f)
+    except (OSError, ValueError, EOFError):
+        header = None
+    if header is None:
+        f.close()
+        return None
+    return f, header
+
+
+class MarkdownWriter:
+    """流式Markdown写入器
+
+    消息到达时立即写入输出目录中的正文临时文件，写完后再生成文件头
+    （消息数量、时间范围），并把正文拼接到最终文件中。
+    in_memory 为 True 时正文保存在内存中（流水线导出：渲染期间不访问输出目录）。
+    compress 为 .gz / .zst 时最终文件边写边压缩，文件名带上该扩展名。
+
+    session_key 区分会话（会话ID、对话ID或源文件摘要），写进文件名，同一天以同样内容开头的
+    会话不会互相覆盖。目标文件已存在时，正文先与它逐段比较而不落盘；内容（忽略导出时间）
+    完全相同时 stage 不生成暂存文件，重新导出未变化的会话不产生任何写入。
+    """
+
+    def __init__(self, output_dir, title, extra_header=(), stats=None, in_memory=False, compress='',
+                 session_key=''):
+        self.output_dir = output_dir
+        self.title = title
+        self.extra_header = list(extra_header)
+        self.stats = stats
+        self.in_memory = in_memory
+        self.compress = compress
+        self.session_key = session_key
+        self.count = 0
+        self.first_time = ''
+        self.last_time = ''
+        self.first_text = ''
+        self.header_size = 0
+        self._body = None
+        # 与已有导出文件比较时：(文件, 文件头)，以及已确认相同的正文字符数
+        self._existing = None
+        self._matched = 0
 
-            if not sessions:
-                print("未找到任何会话。")
+    def write(self, msg):
+        """写入一条消息"""
+        if self.count == 0:
+            self.first_time = msg.get('time', '')[:10]
+            self.first_text = msg['text'][:20]
+            if self.in_memory:
+                self._body = io.StringIO()
+            else:
+                self._existing = _open_existing(os.path.join(self.output_dir, self.filename()))
+                if self._existing is None:
+                    self._open_body()
+        self.last_time = msg.get('time', '')[:10]
+        self.count += 1
+        stats = self.stats
+        if stats is None:
+            self._write_body('\n' + render_message(msg))
+            return
+        with stats.phase('render'):
+            text = render_message(msg)
+        with stats.phase('write'):
+            self._write_body('\n' + text)
+        stats.add('messages')
+
+    def _write_body(self, text):
+        """写入正文；仍与已有文件相同时只比较，不写入"""
+        if self._existing is not None:
+            if self._existing[0].read(len(text)) == text:
+                self._matched += len(text)
                 return
+            self._diverge()
+        self._body.write(text)
 
-            # 显示会话列表
-            print(f'您的 {exporter.get_chat_app_name()} 会话列表：')
-            for i, project in enumerate(sessions):
-                print(f'{i+1}. {project["name"]}')
-                print(f'   会话数：{len(project["sessions"])}')
-                print()
+    def _open_body(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        body_file = os.path.join(self.output_dir, f'.{os.getpid()}.{next(_STAGE_IDS)}.part')
+        self._body = open(body_file, 'x+', encoding='utf-8')
 
-            # 让用户选择会话
-            try:
-                choice = int(input("请输入要导出的项目编号（如 1）：")) - 1
-                if choice < 0 or choice >= len(sessions):
-                    print("无效的选择。")
-                    return
+    def _diverge(self):
+        """内容与已有文件不同：停止比较，把已确认相同的正文从已有文件复制到正文临时文件"""
+        self._existing[0].close()
+        self._existing = None
+        self._open_body()
+        remaining = self._matched
+        if not remaining:
+            return
+        existing = _open_existing(os.path.join(self.output_dir, self.filename()))
+        if existing is None:
+            raise OSError(f'导出文件在比较期间被删除：{self.filename()}')
+        with existing[0] as f:
+            while remaining:
+                block = f.read(min(remaining, 1 << 20))
+                if not block:
+                    raise OSError(f'导出文件在比较期间被修改：{self.filename()}')
+                self._body.write(block)
+                remaining -= len(block)
 
-                selected_project = sessions[choice]
+    def _unchanged(self, header):
+        """正文和文件头（忽略导出时间）是否与已有文件完全相同"""
+        if self._existing is not None:
+            f, old_header = self._existing
+            return f.read(1) == '' and _same_header(old_header, header)
+        if not self.in_memory:
+            return False
+        existing = _open_existing(os.path.join(self.output_dir, self.filename()))
+        if existing is None:
+            return False
+        with existing[0] as f:
+            old_header = existing[1]
+            return _same_header(old_header, header) and f.read() == self._body.getvalue()
 
-                # 导出该项目的所有会话
-                for session_file in selected_project["sessions"]:
-                    messages = exporter.parse_session(session_file, args.tools, args.media)
-                    exporter.export_to_markdown(messages, args.output_dir, args.tools, args.media)
+    def filename(self):
+        """根据首条消息和会话标识生成文件名"""
+        if not self.session_key:
+            return f"{self.first_time}_{safe_filename(self.first_text)}.md{self.compress}"
+        return f"{self.first_time}_{safe_filename(self.first_text)}_{safe_filename(self.session_key)}.md{self.compress}"
 
-                print(f'\n✅ 导出完成！共导出 {len(selected_project["sessions"])} 个会话')
+    def stage(self):
+        """补写文件头并拼接正文到输出目录中的暂存文件
 
-            except ValueError:
-                print("请输入有效的数字。")
-            except KeyboardInterrupt:
-                print("\n导出已取消。")
+        返回 (暂存文件, 目标文件)，由调用方决定何时改名落盘；没有消息时返回None。
+        内容与已有的目标文件相同时暂存文件为None，调用方不需要写入。
+        """
+        if self.count == 0:
+            return None
+
+        output_file = os.path.join(self.output_dir, self.filename())
+        header = render_header(self.title, self.first_time, self.last_time, self.count, self.extra_header)
+        try:
+            if self._unchanged(header):
+                self.header_size = _text_size(header)
+                if self.stats is not None:
+                    self.stats.add('unchanged_outputs')
+                return None, output_file
+            if self._existing is not None:
+                self._diverge()
+            staged_file = os.path.join(self.output_dir, f'.{self.filename()}.{os.getpid()}.{next(_STAGE_IDS)}.tmp')
+            start = time.perf_counter()
+            self._body.seek(0)
+            with open_output(staged_file, self.compress) as f:
+                f.write(header)
+                copy_stream(self._body, f)
+            self.header_size = _text_size(header)
+            if self.stats is not None:
+                self.stats.add('output_bytes', _file_size(staged_file))
+                self.stats.add_time('write', time.perf_counter() - start)
+        finally:
+            self.abort()
+        return staged_file, output_file
+
+    def close(self):
+        """写出最终文件，返回输出文件路径；没有消息时返回None"""
+        staged = self.stage()
+        if staged is None:
+            return None
+        commit_staged(*staged)
+        return staged[1]
+
+    def abort(self):
+        """丢弃正文临时文件"""
+        if self._existing is not None:
+            self._existing[0].close()
+            self._existing = None
+        if self._body is not None:
+            self._body.close()
+            if not self.in_memory:
+                os.remove(self._body.name)
+            self._body = None
+
+
+def commit_staged(staged_file, output_file):
+    """把暂存文件改名为目标文件；暂存文件为None（内容未变化）时什么也不做"""
+    if staged_file is not None:
+        os.replace(staged_file, output_file)
+
+
+def discard_staged(parts):
+    """删除 [(暂存文件, 目标文件)] 中已经生成的暂存文件"""
+    for staged_file, _ in parts:
+        if staged_file is not None:
+            os.remove(staged_file)
+
+
+def staged_status(parts):
+    """多个暂存结果的整体状态：没有输出为 empty，全部未变化为 unchanged，否则为 exported"""
+    if not parts:
+        return 'empty'
+    if all(staged_file is None for staged_file, _ in parts):
+        return 'unchanged'
+    return 'exported'
+
+
+def part_filename(base, number, compress=''):
+    """分卷导出中第 number 个部分（从 2 开始）的文件名：第一部分的文件名（不含扩展名）加上序号"""
+    return f'{base}_part{number:03d}.md{compress}'
+
+
+def index_filename(base, compress=''):
+    """分卷导出的目录文件名：第一部分的文件名（不含扩展名）加上 _目录"""
+    return f'{base}_目录.md{compress}'
+
+
+# 分卷导出中第 2 个及以后的部分和目录文件（不含扩展名）的结尾
+_PART_SUFFIX = re.compile(r'_(?:part\d{3}|目录)$')
+
+
+def remove_stale_parts(outputs):
+    """删除上次分卷导出留下、这次已经不需要的文件，在本次的文件落盘之后调用
+
+    outputs 是本次导出的Markdown文件（一个会话的各部分和目录，或者不分卷的单个文件）。对其中每个
+    第一部分（或单个文件），删除序号超过本次部分数的 _partNNN 文件；本次只有一个部分时连同目录一起删除。
+    从未分卷导出过的会话没有目录文件，只多一次 stat。
+    """
+    names = set(outputs)
+    for output in names:
+        compress = compression_of(output)
+        stem = output[:len(output) - len(compress)]
+        if not stem.endswith('.md') or _PART_SUFFIX.search(stem[:-3]):
+            continue
+        base = stem[:-3]
+        index = index_filename(base, compress)
+        if index not in names:
+            if not os.path.exists(index):
+                continue
+            os.remove(index)
+        number = 2
+        while part_filename(base, number, compress) in names:
+            number += 1
+        while os.path.exists(part_filename(base, number, compress)):
+            os.remove(part_filename(base, number, compress))
+            number += 1
+
+
+class PartWriter(MarkdownWriter):
+    """分卷导出中第 2 个及以后的部分"""
+
+    def __init__(self, output_dir, title, base, number, stats=None, compress=''):
+        super().__init__(output_dir, title, stats=stats, compress=compress)
+        self.base = base
+        self.number = number
+
+    def filename(self):
+        return part_filename(self.base, self.number, self.compress)
+
+
+def _part_link(label, filename):
+    """分卷之间的相对链接（尖括号包住文件名，文件名中的空格不会截断链接）"""
+    return f'[{label}](<{filename}>)'
+
+
+class ShardedWriter:
+    """分卷Markdown写入器：把一个会话按正文大小或消息数拆成多个部分流式写出
+
+    正文达到 max_bytes 字节（按消息文本估算）或 max_messages 条消息后，下一条消息开始新的部分，
+    同一时刻只有一个部分在写。第一部分使用不分卷时的文件名，之后的部分在其后加上 _part002 等序号；
+    只写满一个部分的会话与不分卷的导出完全相同。拆分后另外生成目录文件（_目录.md），列出每个部分的
+    时间范围、消息数和首条用户消息，各部分的文件头和末尾带有目录、上一部分、下一部分的链接。
+    每个部分仍是 MarkdownWriter，内容未变化的部分和目录不会被重写；部分数比上次少时，
+    多出来的旧部分由调用方落盘后用 remove_stale_parts 删除。
+    """
+
+    def __init__(self, output_dir, title, extra_header=(), stats=None, compress='', session_key='',
+                 max_bytes=None, max_messages=None):
+        self.output_dir = output_dir
+        self.title = title
+        self.extra_header = list(extra_header)
+        self.stats = stats
+        self.compress = compress
+        self.session_key = session_key
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+        self.count = 0
+        self.base = None
+        self.parts = []
+        # 每个部分的 [文件名, 首条消息时间, 末条消息时间, 消息数, 首条用户消息]
+        self.summaries = []
+        self._writer = None
+        self._size = 0
+
+    def write(self, msg):
+        """写入一条消息；当前部分已写满时先结束它，再开始新的部分"""
+        if self._writer is not None and self._full():
+            self._finish(has_next=True)
+        if self._writer is None:
+            self._start()
+        self._writer.write(msg)
+        self._size += len(msg['text'].encode('utf-8')) + 32
+        self.count += 1
+        summary = self.summaries[-1]
+        time_str = msg.get('time', '')
+        time_str = time_str[:16].replace('T', ' ') if isinstance(time_str, str) else ''
+        summary[1] = summary[1] or time_str
+        summary[2] = time_str or summary[2]
+        summary[3] += 1
+        if not summary[4] and msg['role'] == '🧑 用户':
+            summary[4] = msg['text'][:50]
+
+    def _full(self):
+        return ((self.max_messages and self._writer.count >= self.max_messages)
+                or (self.max_bytes and self._size >= self.max_bytes))
+
+    def _start(self):
+        number = len(self.summaries) + 1
+        if number == 1:
+            self._writer = MarkdownWriter(self.output_dir, self.title, self.extra_header, self.stats,
+                                          compress=self.compress, session_key=self.session_key)
+        else:
+            self._writer = PartWriter(self.output_dir, f'{self.title}（第 {number} 部分）', self.base, number,
+                                      self.stats, self.compress)
+        self.summaries.append([None, '', '', 0, ''])
+        self._size = 0
+
+    def _finish(self, has_next):
+        """补上导航链接，暂存当前部分"""
+        writer = self._writer
+        number = len(self.summaries)
+        if number == 1:
+            self.base = writer.filename()[:-len(f'.md{self.compress}')]
+        self.summaries[-1][0] = writer.filename()
+        if number > 1 or has_next:
+            links = [_part_link('目录', index_filename(self.base, self.compress))]
+            if number > 1:
+                links.append(_part_link('上一部分', self.summaries[-2][0]))
+            if has_next:
+                links.append(_part_link('下一部分', part_filename(self.base, number + 1, self.compress)))
+            if number == 1:
+                writer.title = f'{self.title}（第 1 部分）'
+            writer.extra_header.append(f'- 分卷：{" · ".join(links)}')
+            writer._write_body(f'\n{" · ".join(links)}\n')
+        self._writer = None
+        staged = writer.stage()
+        if staged is not None:
+            self.parts.append(staged)
+
+    def render_index(self):
+        """渲染目录文件，返回 (文件头, 各部分的列表)"""
+        header = render_header(self.title, self.summaries[0][1][:10], self.summaries[-1][2][:10], self.count,
+                               self.extra_header + [f'- 分卷：共 {len(self.summaries)} 个部分'])
+        lines = ['', '| 部分 | 时间范围 | 消息数 | 首条用户消息 |', '|---|---|---|---|']
+        for number, (filename, first_time, last_time, count, first_user) in enumerate(self.summaries, 1):
+            first_user = ' '.join(first_user.split()).replace('|', '\\|')
+            lines.append(f'| {_part_link(f"第 {number} 部分", filename)} | {first_time} ~ {last_time} | '
+                         f'{count} | {first_user} |')
+        return header, '\n'.join(lines) + '\n'
+
+    def _stage_index(self):
+        """暂存目录文件，内容（忽略导出时间）与已有文件相同时暂存文件为None"""
+        output_file = os.path.join(self.output_dir, index_filename(self.base, self.compress))
+        header, table = self.render_index()
+        existing = _open_existing(output_file)
+        if existing is not None:
+            with existing[0] as f:
+                if _same_header(existing[1], header) and f.read() == table:
+                    return None, output_file
+        staged_file = os.path.join(self.output_dir,
+                                   f'.{os.path.basename(output_file)}.{os.getpid()}.{next(_STAGE_IDS)}.tmp')
+        with open_output(staged_file, self.compress) as f:
+            f.write(header)
+            f.write(table)
+        return staged_file, output_file
+
+    def stage(self):
+        """结束最后一个部分，返回各部分和目录的 [(暂存文件, 目标文件)]，目录排在最后；没有消息时返回空列表"""
+        try:
+            if self._writer is not None:
+                self._finish(has_next=False)
+            if len(self.summaries) > 1:
+                self.parts.append(self._stage_index())
+        except BaseException:
+            self.abort()
+            raise
+        return self.parts
+
+    def abort(self):
+        """丢弃当前部分的正文临时文件和已经暂存的部分"""
+        if self._writer is not None:
+            self._writer.abort()
+            self._writer = None
+        discard_staged(self.parts)
+        self.parts = []
+
+
+# 机器可读导出的列：来源会话、对话ID和标题（多对话文件中才有）、消息内容、工具名（多个时逗号分隔）
+# 以及消息文本和来源会话文件的字节数
+RECORD_COLUMNS = ('session', 'conversation', 'title', 'project', 'role', 'timestamp', 'text', 'tool', 'text_bytes',
+                  'source_bytes')
+
+_TOOL_CALL = re.compile(r'\[调用工具：([^\]\n]+)\]')
+
+
+def message_record(msg, session, conversation='', title=''):
+    """把一条消息转换为按 RECORD_COLUMNS 排列的一行；session 是 describe_session 的结果加上 source_bytes"""
+    text = msg['text']
+    timestamp = msg.get('time') or ''
+    tools = _TOOL_CALL.findall(text) if '[调用工具' in text else ()
+    return (session['session'], conversation, title, session['project'], msg['role'],
+            timestamp if isinstance(timestamp, str) else str(timestamp), text,
+            ','.join(dict.fromkeys(tools)), len(text.encode('utf-8')), session['source_bytes'])
+
+
+class RecordWriter:
+    """机器可读导出的写入器基类
+
+    所有会话的消息按固定的列（RECORD_COLUMNS）写入同一个文件：消息先攒成批，满 batch_size 条
+    时由子类的 _write_batch 一次写出。数据写入同目录的临时文件，close 时改名落盘。
+    子类实现 _open / _write_batch / _close，并设置扩展名 extension；
+    可以整体流式压缩的格式设置 stream_compress = True，输出文件名再加上压缩扩展名。
+    """
+
+    extension = ''
+    batch_size = 1000
+    stream_compress = False
+
+    def __init__(self, path, batch_size=None, stats=None, compress=''):
+        self.path = path
+        if batch_size:
+            self.batch_size = batch_size
+        self.stats = stats
+        self.compress = compress
+        self.count = 0
+        self._rows = []
+        self._temp_path = os.path.join(os.path.dirname(path) or '.',
+                                       f'.{os.path.basename(path)}.{os.getpid()}.{next(_STAGE_IDS)}.tmp')
+        self._open(self._temp_path)
+
+    def write_messages(self, session, messages, conversation='', title=''):
+        """写入一个会话（或对话）的消息流，返回写入的消息数；conversation 和 title 是对话ID和标题"""
+        rows = self._rows
+        count = 0
+        for msg in messages:
+            rows.append(message_record(msg, session, conversation, title))
+            count += 1
+            if len(rows) >= self.batch_size:
+                self.flush()
+        return count
+
+    def flush(self):
+        """写出缓冲中的消息"""
+        if not self._rows:
+            return
+        if self.stats is None:
+            self._write_batch(self._rows)
+        else:
+            with self.stats.phase('write'):
+                self._write_batch(self._rows)
+            self.stats.add('messages', len(self._rows))
+        self.count += len(self._rows)
+        self._rows = []
+
+    def close(self):
+        """写出剩余的消息并落盘，返回输出文件路径"""
+        try:
+            self.flush()
+            self._close(True)
+        except BaseException:
+            self.abort()
+            raise
+        os.replace(self._temp_path, self.path)
+        return self.path
+
+    def abort(self):
+        """放弃导出，删除临时文件"""
+        self._rows = []
+        try:
+            self._close(False)
+        finally:
+            if os.path.exists(self._temp_path):
+                os.remove(self._temp_path)
+
+    def _open(self, path):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def _write_batch(self, rows):
+        raise NotImplementedError("Subclasses must implement this method")
+
+    def _close(self, complete):
+        """关闭输出文件；complete 为 False 表示放弃导出"""
+        raise NotImplementedError("Subclasses must implement this method")
+
+
+class JSONLWriter(RecordWriter):
+    """JSONL写入器：每行一条消息（JSON对象，键为 RECORD_COLUMNS）"""
+
+    extension = '.jsonl'
+    stream_compress = True
+
+    def _open(self, path):
+        self._file = open_output(path, self.compress, newline='\n')
+        self._encode = json.JSONEncoder(ensure_ascii=False).encode
+
+    def _write_batch(self, rows):
+        encode = self._encode
+        self._file.write(''.join(encode(dict(zip(RECORD_COLUMNS, row))) + '\n' for row in rows))
+
+    def _close(self, complete):
+        self._file.close()
+
+
+class SQLiteWriter(RecordWriter):
+    """SQLite写入器：消息写入 messages 表，每批一次 executemany，全部写完后再建索引"""
+
+    extension = '.sqlite'
+    batch_size = 5000
+
+    def _open(self, path):
+        import sqlite3
+
+        if self.compress:
+            raise ValueError('SQLite 输出不支持压缩（压缩后无法直接查询）')
+        self._conn = sqlite3.connect(path)
+        # 临时文件在完成前不会被使用，关闭日志和同步写以加快批量插入
+        self._conn.execute('PRAGMA journal_mode = OFF')
+        self._conn.execute('PRAGMA synchronous = OFF')
+        columns = ', '.join(f'{name} INTEGER' if name.endswith('_bytes') else f'{name} TEXT' for name in RECORD_COLUMNS)
+        self._conn.execute(f'CREATE TABLE messages ({columns})')
+        self._insert = f'INSERT INTO messages VALUES ({", ".join("?" * len(RECORD_COLUMNS))})'
+
+    def _write_batch(self, rows):
+        self._conn.executemany(self._insert, rows)
+
+    def _close(self, complete):
+        try:
+            if complete:
+                self._conn.execute('CREATE INDEX messages_session ON messages (session, timestamp)')
+                self._conn.execute('CREATE INDEX messages_timestamp ON messages (timestamp)')
+                self._conn.commit()
+        finally:
+            self._conn.close()
+
+
+class ParquetWriter(RecordWriter):
+    """Parquet写入器（需要 pyarrow）：每批写成一个行组，指定压缩时用对应的列压缩算法"""
+
+    extension = '.parquet'
+    batch_size = 50000
+
+    def _open(self, path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError('导出 Parquet 需要安装 pyarrow：pip install pyarrow') from e
+
+        self._pa = pyarrow
+        self._schema = pyarrow.schema([(name, pyarrow.int64() if name.endswith('_bytes') else pyarrow.string())
+                                       for name in RECORD_COLUMNS])
+        codec = {'.gz': 'gzip', '.zst': 'zstd'}.get(self.compress, 'snappy')
+        self._writer = pyarrow.parquet.ParquetWriter(path, self._schema, compression=codec)
+
+    def _write_batch(self, rows):
+        columns = [self._pa.array(values, type=field.type) for values, field in zip(zip(*rows), self._schema)]
+        self._writer.write_table(self._pa.Table.from_arrays(columns, schema=self._schema))
 
+    def _close(self, complete):
+        self._writer.close()
+
+
+# 机器可读导出格式 -> 写入器（写法与 PARSERS 相同：本模块中的类只写类名，第三方写 "模块:类名"）
+WRITERS = {
+    'jsonl': 'JSONLWriter',
+    'sqlite': 'SQLiteWriter',
+    'parquet': 'ParquetWriter',
+}
+
+
+def register_writer(name, writer):
+    """注册机器可读导出格式，writer 可以是 RecordWriter 子类或 "模块:类名" 字符串"""
+    WRITERS[name.lower()] = writer
+
+
+def load_writer_class(name):
+    """返回导出格式对应的写入器类"""
+    name = name.lower()
+    if name not in WRITERS:
+        raise ValueError(f"不支持的导出格式: {name}")
+    writer = WRITERS[name] = _resolve_class(WRITERS[name])
+    return writer
+
+
+def _text_size(text):
+    """文本以UTF-8文本模式写入文件后占用的字节数"""
+    return len(text.encode('utf-8')) + text.count('\n') * (len(os.linesep) - 1)
+
+
+class ExportManifest:
+    """增量导出清单
+
+    以JSON保存在输出目录中，为每个会话记录文件大小、mtime、inode、
+    已解析到的字节偏移以及对应导出文件的状态。
+    """
+
+    FILENAME = '.export_manifest.json'
+
+    def __init__(self, path):
+        self.path = path
+        self.sessions = {}
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                self.sessions = json.load(f).get('sessions', {})
+
+    @classmethod
+    def for_output_dir(cls, output_dir):
+        """加载输出目录中的清单"""
+        return cls(os.path.join(output_dir, cls.FILENAME))
+
+    def get(self, filepath):
+        """返回会话上次导出的记录，没有时返回None"""
+        return self.sessions.get(os.path.abspath(filepath))
+
+    def update(self, filepath, entry):
+        """更新会话的记录"""
+        self.sessions[os.path.abspath(filepath)] = entry
+
+    def save(self):
+        """原子地写回清单文件"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        staged = f'{self.path}.{os.getpid()}.tmp'
+        with open(staged, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'sessions': self.sessions}, f, ensure_ascii=False, indent=1)
+        os.replace(staged, self.path)
+
+
+def _read_tail(filepath, offset, size=64):
+    """读取 offset 之前最多 size 个字节（十六进制），用于确认文件只是被追加"""
+    start = max(0, offset - size)
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        return f.read(offset - start).hex()
+
+
+# 解析器注册表：聊天应用 -> (解析器, 中文名称)
+# 解析器写作 "模块:类名"（本模块中的类只写类名），在选中该应用时才导入和实例化
+PARSERS = {
+    "claude": ("ClaudeCodeParser", "Claude Code"),
+    "wechat": ("WeChatParser", "微信"),
+    "qq": ("QQParser", "QQ"),
+    "slack": ("SlackParser", "Slack"),
+    "discord": ("DiscordParser", "Discord"),
+    "gpt": ("GPTParser", "GPT"),
+    "gemini": ("GeminiParser", "Gemini"),
+    "doubao": ("DoubaoParser", "豆包"),
+}
+
+# 第三方解析器通过该入口点组注册，如 pyproject.toml 中：
+# [project.entry-points."export_chat_history.parsers"]
+# telegram = "my_package.telegram:TelegramParser"
+PARSER_ENTRY_POINT_GROUP = 'export_chat_history.parsers'
+
+
+def register_parser(chat_app, parser, display_name=None):
+    """注册解析器，parser 可以是类或 "模块:类名"（第三方模块在选中时才导入）"""
+    PARSERS[chat_app.lower()] = (parser, display_name or chat_app)
+
+
+def _find_parser_plugin(chat_app):
+    """在已安装的入口点插件中查找解析器（只在内置注册表中找不到时调用，避免启动时扫描）"""
+    from importlib.metadata import entry_points
+
+    for entry_point in entry_points(group=PARSER_ENTRY_POINT_GROUP):
+        if entry_point.name.lower() == chat_app:
+            return entry_point.value
+    return None
+
+
+def load_parser_class(chat_app):
+    """返回聊天应用对应的解析器类，按需导入所在模块"""
+    chat_app = chat_app.lower()
+    if chat_app not in PARSERS:
+        plugin = _find_parser_plugin(chat_app)
+        if plugin is None:
+            raise ValueError(f"不支持的聊天应用: {chat_app}")
+        register_parser(chat_app, plugin)
+
+    parser, display_name = PARSERS[chat_app]
+    if isinstance(parser, str):
+        parser = _resolve_class(parser)
+        PARSERS[chat_app] = (parser, getattr(parser, 'display_name', None) or display_name)
+    return parser
+
+
+def _resolve_class(spec):
+    """把 "模块:类名" 或本模块中的类名解析为类（按需导入模块），已经是类时原样返回"""
+    if not isinstance(spec, str):
+        return spec
+    if ':' in spec:
+        import importlib
+
+        module_name, _, class_name = spec.partition(':')
+        return getattr(importlib.import_module(module_name), class_name)
+    return globals()[spec]
+
+
+class ChatExporter:
+    """聊天记录导出器"""
+
+    def __init__(self, chat_app, stats=None, chunk_jobs=1):
+        # 根据聊天应用选择解析器（只导入和实例化这一个）
+        self.parser = load_parser_class(chat_app)()
+        self.chat_app = chat_app.lower()
+        # 单个大会话文件分块并行解析的进程数：1 表示不拆分，None 表示按CPU核数
+        self.chunk_jobs = chunk_jobs
+        # 导出文件的压缩格式：'' 表示不压缩，'.gz' / '.zst' 表示边写边压缩
+        self.compress = ''
+        # 只导出该时间范围内的消息（时间戳前缀比较），None 表示不限
+        self.since = None
+        self.until = None
+        # 工具内容去重存储（BlobStore），None 表示截断后内联
+        self.blob_store = None
+        # 跨会话消息去重的已导出集合（MessageSet / BloomFilter），None 表示不去重；
+        # 启用时 Claude Code 会话只导出当前分支
+        self.seen_messages = None
+        # 分卷导出的上限 (正文字节数, 消息数)，None 表示每个会话导出为一个文件
+        self.part_limits = None
+        self.set_stats(stats)
+
+    def set_time_range(self, since=None, until=None):
+        """设置导出消息的时间范围，如 ('2026-01-01', '2026-01-31')"""
+        self.since = since or None
+        self.until = until or None
+
+    def set_stats(self, stats):
+        """启用（传入 ExportStats）或关闭（传入 None）导出统计"""
+        self.stats = stats
+        self.parser.stats = stats
+        if self.blob_store is not None:
+            self.blob_store.stats = stats
+
+    def set_blob_store(self, blob_store):
+        """启用（传入 BlobStore）或关闭（传入 None）工具内容去重"""
+        self.blob_store = blob_store
+        self.parser.blob_store = blob_store
+        if blob_store is not None:
+            blob_store.stats = self.stats
+
+    def set_message_dedup(self, seen):
+        """启用（传入 MessageSet / BloomFilter）或关闭（传入 None）跨会话消息去重与当前分支选择"""
+        self.seen_messages = seen
+
+    def set_tool_limits(self, tool_limits):
+        """按工具名设置工具参数和返回结果的截断上限（{工具名: (参数上限, 结果上限)}），None 表示使用默认值"""
+        self.parser.tool_limits = tool_limits or None
+
+    def set_part_limits(self, max_bytes=None, max_messages=None):
+        """按正文字节数和 / 或消息数把大会话拆成多个部分导出（见 ShardedWriter），都为 None 时不拆分"""
+        self.part_limits = (max_bytes, max_messages) if max_bytes or max_messages else None
+
+    def list_sessions(self):
+        """列出所有会话"""
+        if self.stats is None:
+            return self.parser.list_sessions()
+        with self.stats.phase('list'):
+            return self.parser.list_sessions()
+
+    def parse_session(self, filepath, include_tools=False, include_media=False):
+        """解析会话文件"""
+        return self.parser.parse_session(filepath, include_tools, include_media)
+
+    def iter_messages(self, filepath, include_tools=False, include_media=False):
+        """逐条产出会话中的消息；启用分块并行解析时大文件交给进程池解析
+
+        设置了时间范围时，支持的解析器直接定位到范围内的记录，其余解析器逐条过滤。
+        启用跨会话去重时只导出当前分支上、之前的会话中没有导出过的消息。
+        """
+        if self.seen_messages is not None and hasattr(self.parser, 'iter_branch_messages'):
+            messages = self.parser.iter_branch_messages(filepath, include_tools, self.seen_messages)
+            return self._filter_time(messages) if self.since or self.until else messages
+        if self.since or self.until:
+            if hasattr(self.parser, 'iter_messages_between'):
+                return self.parser.iter_messages_between(filepath, self.since, self.until, include_tools)
+            return self._filter_time(self.parser.iter_messages(filepath, include_tools, include_media))
+        if (self.chunk_jobs != 1 and hasattr(self.parser, 'iter_messages_parallel')
+                and _file_size(filepath) >= PARALLEL_PARSE_MIN_BYTES):
+            return self.parser.iter_messages_parallel(filepath, include_tools, self.chunk_jobs)
+        return self.parser.iter_messages(filepath, include_tools, include_media)
+
+    def _filter_time(self, messages):
+        """只保留时间戳在范围内的消息（没有时间戳的消息无法判断，一并去掉）"""
+        since, until = self.since, self.until
+        for msg in messages:
+            timestamp = msg['time'] if isinstance(msg['time'], str) else ''
+            if not timestamp:
+                continue
+            if since and timestamp[:len(since)] < since:
+                continue
+            if until and timestamp[:len(until)] > until:
+                continue
+            yield msg
+
+    def export_session(self, filepath, output_dir, include_tools=False, include_media=False):
+        """流式导出单个会话：边解析边写入，内存占用与会话大小无关"""
+        messages = self.iter_messages(filepath, include_tools, include_media)
+        return self.export_to_markdown(messages, output_dir, include_tools, include_media,
+                                       session_key=self.parser.session_key(filepath))
+
+    def export_to_markdown(self, messages, output_dir, include_tools=False, include_media=False, session_key=''):
+        """导出为Markdown格式，messages 可以是列表或生成器，返回输出文件路径
+
+        session_key 写进文件名（见 MarkdownWriter）；内容与已有文件相同时不写入。
+        """
+        result = self.stage_markdown(messages, output_dir, session_key)
+        if result is None:
+            print("没有可导出的消息。")
+            return None
+
+        if 'parts' in result:
+            for staged, output in result['parts']:
+                commit_staged(staged, output)
+            remove_stale_parts([output for _, output in result['parts']])
+            if result['status'] == 'unchanged':
+                print('OK 内容未变化，跳过写入 -> {}'.format(result['output']))
+            else:
+                print('OK 已导出 {} 条消息，分为 {} 个部分 -> {}'.format(
+                    result['count'], len(result['parts']) - 1, result['output']))
+            return result['output']
+        if result['staged'] is None:
+            print('OK 内容未变化，跳过写入 -> {}'.format(result['output']))
+            return result['output']
+        commit_staged(result['staged'], result['output'])
+        remove_stale_parts([result['output']])
+        print('OK 已导出 {} 条消息 -> {}'.format(result['count'], result['output']))
+        return result['output']
+
+    def stage_markdown(self, messages, output_dir, session_key=''):
+        """把消息流写成暂存的Markdown文件，返回暂存信息；没有消息时返回None
+
+        内容与已有的目标文件相同时 staged 为None，status 为 unchanged。
+        拆分成多个部分时返回 parts（各部分和目录的 [(暂存文件, 目标文件)]），output 是第一部分。
+        """
+        writer = self._write_messages(messages, output_dir, session_key=session_key)
+        if isinstance(writer, ShardedWriter):
+            parts = writer.stage()
+            if len(parts) > 1:
+                return {'status': staged_status(parts), 'parts': parts, 'output': parts[0][1], 'count': writer.count}
+            staged = parts[0] if parts else None
+        else:
+            staged = writer.stage()
+        if staged is None:
+            return None
+        return {'status': 'exported' if staged[0] is not None else 'unchanged',
+                'staged': staged[0], 'output': staged[1], 'count': writer.count}
+
+    def export_conversations(self, filepath, output_dir, include_tools=False, include_media=False):
+        """把包含多个对话的文件（如 ChatGPT 数据导出）按对话分别导出，返回输出文件列表"""
+        result = self.stage_conversations(filepath, output_dir, include_tools, include_media)
+        if not result['parts']:
+            print("没有可导出的消息。")
+        for staged, output in result['parts']:
+            commit_staged(staged, output)
+        remove_stale_parts([output for _, output in result['parts']])
+        if result['parts']:
+            written = sum(staged is not None for staged, _ in result['parts'])
+            print('OK 已导出 {} 个对话（{} 个内容未变化），{} 条消息 -> {}'.format(
+                len(result['parts']), len(result['parts']) - written, result['count'], output_dir))
+        return [output for _, output in result['parts']]
+
+    def stage_conversations(self, filepath, output_dir, include_tools=False, include_media=False):
+        """把每个对话写成一个暂存的Markdown文件，返回 status / count / output / parts（[(暂存文件, 目标文件)]）
+
+        内容未变化的对话暂存文件为None；所有对话都未变化时 status 为 unchanged。
+        """
+        parts = []
+        count = 0
+        try:
+            for key, title, messages in self.iter_conversations(filepath, include_tools, include_media):
+                extra_header = [f'- 对话标题：{title}'] if title else []
+                writer = self._write_messages(messages, output_dir, extra_header, session_key=key)
+                if isinstance(writer, ShardedWriter):
+                    parts.extend(writer.stage())
+                    count += writer.count
+                    continue
+                staged = writer.stage()
+                if staged is not None:
+                    parts.append(staged)
+                    count += writer.count
+        except BaseException:
+            discard_staged(parts)
+            raise
+        return {'status': staged_status(parts), 'count': count,
+                'output': parts[-1][1] if parts else None, 'parts': parts}
+
+    def iter_conversations(self, filepath, include_tools=False, include_media=False):
+        """逐个产出文件中的对话 (标识, 标题, 消息流)；解析器不区分对话时整个会话是一个没有标题的对话
+
+        标识用于导出文件名：会话本身的 session_key，或对话ID（没有时是会话标识加序号）。
+        """
+        if not hasattr(self.parser, 'iter_conversations'):
+            yield self.parser.session_key(filepath), '', self.iter_messages(filepath, include_tools, include_media)
+            return
+        if hasattr(self.parser, 'iter_conversation_items'):
+            items = self.parser.iter_conversation_items(filepath, include_tools, include_media)
+        else:
+            items = (('', title, messages)
+                     for title, messages in self.parser.iter_conversations(filepath, include_tools, include_media))
+        session_key = None
+        for index, (conversation_id, title, messages) in enumerate(items):
+            if not conversation_id:
+                if session_key is None:
+                    session_key = self.parser.session_key(filepath)
+                conversation_id = session_key if index == 0 else f'{session_key}-{index}'
+            if self.since or self.until:
+                messages = self._filter_time(messages)
+            yield conversation_id, title, messages
+
+    def export_records(self, writer, filepath, include_tools=False, include_media=False):
+        """把一个会话的消息写入机器可读写入器（RecordWriter），返回写入的消息数"""
+        session = self.parser.describe_session(filepath)
+        session['source_bytes'] = _file_size(filepath)
+        # 不区分对话的会话没有对话ID，conversation 列留空（会话标识已在 session 列中）
+        multiple = hasattr(self.parser, 'iter_conversations')
+        count = 0
+        for conversation_id, title, messages in self.iter_conversations(filepath, include_tools, include_media):
+            count += writer.write_messages(session, messages, conversation_id if multiple else '', title)
+        return count
+
+    def render_session(self, filepath, output_dir, include_tools=False, include_media=False):
+        """在内存中渲染一个会话，返回有消息的Markdown写入器列表（每个对话一个），由调用方 stage 落盘
+
+        filepath 可以是 SessionData，解析期间不再读取磁盘。
+        """
+        writers = []
+        for key, title, messages in self.iter_conversations(filepath, include_tools, include_media):
+            extra_header = [f'- 对话标题：{title}'] if title else []
+            writer = self._write_messages(messages, output_dir, extra_header, in_memory=True, session_key=key)
+            if writer.count:
+                writers.append(writer)
+        return writers
+
+    def _write_messages(self, messages, output_dir, extra_header=(), in_memory=False, session_key=''):
+        """把消息流写入Markdown写入器的正文，返回写入器
+
+        设置了分卷上限时（流水线导出的内存渲染除外）返回 ShardedWriter，stage 返回各部分的列表。
+        """
+        title = f'{self.get_chat_app_name()} 聊天记录'
+        if self.part_limits is not None and not in_memory:
+            writer = ShardedWriter(output_dir, title, extra_header, self.stats, self.compress, session_key,
+                                   *self.part_limits)
+        else:
+            writer = MarkdownWriter(output_dir, title, extra_header, stats=self.stats, in_memory=in_memory,
+                                    compress=self.compress, session_key=session_key)
+        try:
+            for msg in messages:
+                writer.write(msg)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer
+
+    def export_incremental(self, filepath, output_dir, entry=None, include_tools=False, include_media=False):
+        """增量导出一个会话
+
+        entry 是清单中该会话上次的记录。文件状态未变化时只做一次 stat，不打开文件；
+        文件只是被追加时从上次的字节偏移继续解析，把新消息追加到已有的导出文件；
+        其余情况完整重新导出（写入暂存文件，由调用方改名落盘）。
+        返回包含 status（unchanged/appended/exported/empty）与新记录 entry 的字典。
+        """
+        st = os.stat(filepath)
+        options = [include_tools, include_media]
+        time_range = self.since or self.until
+        if time_range:
+            options += [self.since, self.until]
+        if self.compress:
+            options.append(self.compress)
+        if self.blob_store is not None:
+            options.append('dedup')
+        if self.parser.tool_limits:
+            options.append([[tool, *limits] for tool, limits in sorted(self.parser.tool_limits.items())])
+        if self.part_limits is not None:
+            options.append(list(self.part_limits))
+        state = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino, 'options': options}
+        output_ok = entry is not None and (entry['output'] is None or os.path.exists(entry['output']))
+        reusable = output_ok and entry['options'] == options and entry['inode'] == st.st_ino
+
+        if reusable and entry['size'] == st.st_size and entry['mtime_ns'] == st.st_mtime_ns:
+            return {'status': 'unchanged', 'count': 0, 'output': entry['output'], 'entry': entry}
+
+        # 压缩的会话按字节偏移续读没有意义；压缩的导出文件和分卷导出无法追加
+        incremental = hasattr(self.parser, 'iter_messages_from') and not compression_of(filepath)
+        if (reusable and incremental and not self.compress and self.part_limits is None
+                and st.st_size >= entry['offset']
+                and _read_tail(filepath, entry['offset']) == entry['tail']):
+            position = {}
+            messages = self.parser.iter_messages_from(filepath, entry['offset'], include_tools, position)
+            if time_range:
+                messages = self._filter_time(messages)
+            if entry['output'] is None:
+                # 之前没有可导出的消息：新消息就是完整的导出内容
+                result = self._stage_entry(messages, output_dir, state, self.parser.session_key(filepath))
+            else:
+                result = self._append_markdown(messages, output_dir, entry, state)
+            result['entry']['offset'] = position['offset']
+            result['entry']['tail'] = _read_tail(filepath, position['offset'])
+            return result
+
+        # 完整重新导出
+        if hasattr(self.parser, 'iter_conversations') or self.part_limits is not None:
+            # 按对话分别导出或分卷导出的文件没有字节偏移，变化后整体重新导出（未变化的部分不会重写）
+            result = self.stage_conversations(filepath, output_dir, include_tools, include_media)
+            result['entry'] = dict(state, output=result['output'], count=result['count'], first_time='',
+                                   last_time='', header_size=0, offset=st.st_size, tail='')
+            return result
+        if incremental:
+            position = {}
+            messages = self.parser.iter_messages_from(filepath, 0, include_tools, position)
+            if time_range:
+                messages = self._filter_time(messages)
+        else:
+            position = {'offset': st.st_size}
+            messages = self.iter_messages(filepath, include_tools, include_media)
+        result = self._stage_entry(messages, output_dir, state, self.parser.session_key(filepath))
+        result['entry']['offset'] = position['offset']
+        result['entry']['tail'] = _read_tail(filepath, position['offset']) if incremental else ''
+        return result
+
+    def _stage_entry(self, messages, output_dir, state, session_key=''):
+        """完整导出到暂存文件，并生成新的清单记录（内容与已有文件相同时不生成暂存文件）"""
+        writer = self._write_messages(messages, output_dir, session_key=session_key)
+        staged = writer.stage()
+        entry = dict(state, output=None, count=0, first_time='', last_time='', header_size=0)
+        if staged is None:
+            return {'status': 'empty', 'count': 0, 'output': None, 'entry': entry}
+
+        entry.update(output=staged[1], count=writer.count, first_time=writer.first_time,
+                     last_time=writer.last_time, header_size=writer.header_size)
+        return {'status': 'exported' if staged[0] is not None else 'unchanged', 'staged': staged[0],
+                'output': staged[1], 'count': writer.count, 'entry': entry}
+
+    def _append_markdown(self, messages, output_dir, entry, state):
+        """把新消息追加到已有的导出文件，并更新文件头中的消息数量与时间范围"""
+        entry = dict(entry, **state)
+        output_file = entry['output']
+        count = 0
+        with tempfile.TemporaryFile('w+', encoding='utf-8', dir=output_dir) as body:
+            for msg in messages:
+                body.write('\n')
+                body.write(render_message(msg))
+                entry['last_time'] = msg.get('time', '')[:10]
+                count += 1
+            if self.stats is not None:
+                self.stats.add('messages', count)
+                self.stats.add('output_bytes', body.tell())
+
+            if count:
+                entry['count'] += count
+                header = render_header(f'{self.get_chat_app_name()} 聊天记录', entry['first_time'],
+                                       entry['last_time'], entry['count'])
+                body.seek(0)
+                # 写入暂存文件后改名替换：读者和中途退出都不会看到文件头与正文不一致的文件
+                staged_file = os.path.join(output_dir,
+                                           f'.{os.path.basename(output_file)}.{os.getpid()}.{next(_STAGE_IDS)}.tmp')
+                with open(output_file, encoding='utf-8') as old, open(staged_file, 'x', encoding='utf-8') as new:
+                    old.seek(entry['header_size'])
+                    new.write(header)
+                    entry['header_size'] = new.tell()
+                    copy_stream(old, new)
+                    copy_stream(body, new)
+                os.replace(staged_file, output_file)
+
+        status = 'appended' if count else 'unchanged'
+        return {'status': status, 'count': count, 'output': output_file, 'entry': entry}
+
+    def get_chat_app_name(self):
+        """获取聊天应用的中文名称"""
+        return PARSERS.get(self.chat_app, (None, self.chat_app))[1]
+
+
+# 搜索索引覆盖的聊天应用（其余应用暂时只有占位解析器）
+SEARCH_APPS = ('claude', 'gpt', 'gemini', 'doubao')
+
+
+class SearchIndex:
+    """消息全文搜索索引（SQLite FTS5）
+
+    search_sessions 记录每个会话的文件状态和已索引到的位置，search_messages 保存
+    每条消息的会话、角色、时间和序号，正文放在 FTS5 表中（rowid 与 search_messages.id 一致）。
+    消息按包含工具调用的完整消息流编号，Claude Code 会话增量追加，其余格式变化后整体重建。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS search_sessions (
+            path TEXT PRIMARY KEY,
+            app TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            seq INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS search_messages (
+            id INTEGER PRIMARY KEY,
+            path TEXT NOT NULL,
+            app TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            time TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS search_messages_path ON search_messages (path, seq);
+    """
+
+    def __init__(self, path):
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(self.SCHEMA)
+        # trigram 分词支持中文和任意子串（报错信息、文件路径）搜索；旧版本 SQLite 退回 unicode61
+        try:
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(text, tokenize='trigram')")
+            self.trigram = True
+        except sqlite3.OperationalError:
+            self.conn.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(text)")
+            self.trigram = False
+
+    def close(self):
+        """关闭数据库连接"""
+        self.conn.close()
+
+    def refresh(self, exporter):
+        """增量更新一个聊天应用的全部会话，返回新索引的消息条数"""
+        session_files = [f for project in exporter.list_sessions() for f in project_session_files(project)]
+        existing = {row['path']: row for row in
+                    self.conn.execute('SELECT * FROM search_sessions WHERE app = ?', (exporter.chat_app,))}
+        incremental = hasattr(exporter.parser, 'iter_messages_from')
+        added = 0
+
+        with self.conn:
+            for path in session_files:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                row = existing.pop(path, None)
+                if row is not None and row['size'] == st.st_size and row['mtime_ns'] == st.st_mtime_ns:
+                    continue
+
+                # 压缩的会话只能整体重新索引
+                resumable = incremental and not compression_of(path)
+                if (row is not None and resumable and row['inode'] == st.st_ino
+                        and st.st_size >= row['offset']):
+                    offset, seq = row['offset'], row['seq']
+                else:
+                    self._delete(path)
+                    offset, seq = 0, 0
+
+                position = {'offset': st.st_size}
+                if resumable:
+                    messages = exporter.parser.iter_messages_from(path, offset, True, position)
+                else:
+                    messages = exporter.parser.iter_messages(path, True)
+                for msg in messages:
+                    if msg.get('placeholder'):
+                        continue
+                    time_str = msg['time'] if isinstance(msg['time'], str) else str(msg['time'])
+                    cursor = self.conn.execute(
+                        'INSERT INTO search_messages (path, app, seq, role, time) VALUES (?, ?, ?, ?, ?)',
+                        (path, exporter.chat_app, seq, msg['role'], time_str))
+                    self.conn.execute('INSERT INTO search_fts (rowid, text) VALUES (?, ?)', (cursor.lastrowid, msg['text']))
+                    seq += 1
+                    added += 1
+
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO search_sessions (path, app, size, mtime_ns, inode, offset, seq) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (path, exporter.chat_app, st.st_size, st.st_mtime_ns, st.st_ino, position['offset'], seq))
+
+            # 已删除的会话
+            for path in existing:
+                self._delete(path)
+                self.conn.execute('DELETE FROM search_sessions WHERE path = ?', (path,))
+        return added
+
+    def _delete(self, path):
+        """删除一个会话已索引的消息"""
+        self.conn.execute('DELETE FROM search_fts WHERE rowid IN (SELECT id FROM search_messages WHERE path = ?)', (path,))
+        self.conn.execute('DELETE FROM search_messages WHERE path = ?', (path,))
+
+    def search(self, query, apps=None, limit=20):
+        """搜索消息，返回按相关度排序的命中（会话、角色、时间、序号、摘要）"""
+        apps = list(apps or SEARCH_APPS)
+        app_filter = f'm.app IN ({", ".join("?" * len(apps))})'
+        if self.trigram and len(query) < 3:
+            # trigram 无法匹配少于3个字符的词，退回 LIKE 扫描
+            sql = (f'SELECT m.*, f.text AS text FROM search_fts f JOIN search_messages m ON m.id = f.rowid '
+                   f'WHERE f.text LIKE ? ESCAPE \'\\\' AND {app_filter} ORDER BY m.path, m.seq LIMIT ?')
+            pattern = '%' + query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            rows = self.conn.execute(sql, [pattern, *apps, limit])
+        else:
+            phrase = '"' + query.replace('"', '""') + '"'
+            sql = (f'SELECT m.*, f.text AS text FROM search_fts f JOIN search_messages m ON m.id = f.rowid '
+                   f'WHERE search_fts MATCH ? AND {app_filter} ORDER BY f.rank LIMIT ?')
+            rows = self.conn.execute(sql, [phrase, *apps, limit])
+
+        hits = []
+        for row in rows:
+            hit = dict(row)
+            hit['snippet'] = make_snippet(hit.pop('text'), query)
+            hits.append(hit)
+        return hits
+
+
+def make_snippet(text, query, width=60):
+    """截取命中位置前后的文本作为摘要"""
+    pos = text.lower().find(query.lower())
+    if pos < 0:
+        pos = 0
+    start = max(0, pos - width)
+    end = min(len(text), pos + len(query) + width)
+    snippet = text[start:end].replace('\n', ' ')
+    return ('…' if start > 0 else '') + snippet + ('…' if end < len(text) else '')
+
+
+def search_command(argv):
+    """search 子命令：在全部会话中搜索消息，可选导出命中的会话或命中前后的消息"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='universal_export.py search', description='全文搜索聊天记录')
+    parser.add_argument('query', help='要搜索的文本（按子串匹配，支持中文）')
+    parser.add_argument('--app', action='append', choices=SEARCH_APPS, help='只搜索指定的聊天应用，可重复')
+    parser.add_argument('--limit', type=int, default=20, help='最多显示的命中数（默认 20）')
+    parser.add_argument('--index', metavar='PATH', help='搜索索引位置（默认位于 ~/.cache/export-chat-history/）')
+    parser.add_argument('--export', metavar='DIR', help='把命中的会话导出到该目录')
+    parser.add_argument('--context', type=int, metavar='N', help='与 --export 一起使用：只导出每个命中前后 N 条消息')
+    parser.add_argument('--tools', action='store_true', help='导出完整会话时包含工具调用记录')
+    args = parser.parse_args(argv)
+
+    apps = args.app or list(SEARCH_APPS)
+    index = SearchIndex(args.index or os.path.join(os.path.dirname(default_index_path()), 'search.sqlite'))
+    exporters = {app: ChatExporter(app) for app in apps}
+    try:
+        for exporter in exporters.values():
+            index.refresh(exporter)
+        hits = index.search(args.query, apps, args.limit)
+    finally:
+        index.close()
+
+    if not hits:
+        print("没有找到匹配的消息。")
+        return hits
+
+    for i, hit in enumerate(hits, 1):
+        print(f'{i}. [{hit["app"]}] {hit["path"]}')
+        print(f'   {hit["role"]} {hit["time"][:16]}  第 {hit["seq"] + 1} 条')
+        print(f'   {hit["snippet"]}')
+
+    if args.export:
+        export_search_hits(exporters, hits, args.export, args.context, args.tools)
+    return hits
+
+
+def export_search_hits(exporters, hits, output_dir, context=None, include_tools=False):
+    """导出命中的会话；context 不为空时只导出每个命中前后 context 条消息"""
+    by_session = {}
+    for hit in hits:
+        by_session.setdefault((hit['app'], hit['path']), []).append(hit['seq'])
+
+    for (app, path), seqs in by_session.items():
+        exporter = exporters[app]
+        if context is None:
+            exporter.export_session(path, output_dir, include_tools)
+            continue
+        # 命中序号基于包含工具调用的完整消息流
+        wanted = {seq + d for seq in seqs for d in range(-context, context + 1)}
+        messages = (msg for seq, msg in enumerate(exporter.iter_messages(path, True)) if seq in wanted)
+        exporter.export_to_markdown(messages, output_dir, session_key=exporter.parser.session_key(path))
+
+
+# 每个工作进程各自缓存的导出器，避免每个任务重复探测存储目录
+_WORKER_EXPORTERS = {}
+
+
+def _export_task(task):
+    """进程池任务：把一个会话导出为暂存文件，由主进程按原顺序落盘"""
+    chat_app = task['chat_app']
+    filepath = task['path']
+    exporter = _WORKER_EXPORTERS.get(chat_app)
+    if exporter is None:
+        exporter = _WORKER_EXPORTERS[chat_app] = ChatExporter(chat_app)
+    stats = ExportStats() if task.get('stats') else None
+    # 同一个工作进程复用去重存储，本进程写过的内容不再检查磁盘
+    if not task.get('dedup_tools'):
+        exporter.set_blob_store(None)
+    elif exporter.blob_store is None or exporter.blob_store.output_dir != task['output_dir']:
+        exporter.set_blob_store(BlobStore(task['output_dir']))
+    exporter.set_stats(stats)
+    exporter.set_tool_limits(task.get('tool_limits'))
+    exporter.set_message_dedup(task.get('seen_messages'))
+    exporter.set_part_limits(*task.get('part_limits') or ())
+    exporter.chunk_jobs = task.get('chunk_jobs', 1)
+    exporter.compress = task.get('compress', '')
+    exporter.set_time_range(*task.get('time_range', (None, None)))
+    if hasattr(exporter.parser, 'ordered_sessions'):
+        exporter.parser.ordered_sessions = task.get('ordered_sessions')
+
+    try:
+        if task['incremental']:
+            result = exporter.export_incremental(filepath, task['output_dir'], task['entry'],
+                                                 task['include_tools'], task['include_media'])
+        elif hasattr(exporter.parser, 'iter_conversations'):
+            result = exporter.stage_conversations(filepath, task['output_dir'], task['include_tools'], task['include_media'])
+        else:
+            messages = exporter.iter_messages(filepath, task['include_tools'], task['include_media'])
+            result = exporter.stage_markdown(messages, task['output_dir'], exporter.parser.session_key(filepath))
+            if result is None:
+                result = {'status': 'empty', 'count': 0, 'output': None}
+    except Exception as e:
+        result = {'status': 'error', 'error': f'{type(e).__name__}: {e}'}
+        if stats is not None:
+            stats.error(filepath, None, e)
+    result['path'] = filepath
+    if stats is not None:
+        result['stats'] = stats.stop().to_dict()
+    return result
+
+
+def _file_size(path):
+    """返回文件大小，文件不存在时返回0（SessionData 返回已读入的字节数）"""
+    if isinstance(path, SessionData):
+        return len(path.data)
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def chronological_order(session_files):
+    """按修改时间从旧到新返回会话的下标（续接的会话总是比原会话新）"""
+    def mtime(i):
+        try:
+            return os.stat(session_files[i]).st_mtime_ns
+        except OSError:
+            return 0
+    return sorted(range(len(session_files)), key=mtime)
+
+
+def project_session_files(project):
+    """返回一个项目下的会话文件；没有子会话的条目本身就是会话文件"""
+    if project["sessions"]:
+        return list(project["sessions"])
+    if os.path.isfile(project["path"]):
+        return [project["path"]]
+    return []
+
+
+class BulkCommitter:
+    """收集批量导出各会话的结果，打印进度，并按 session_files 的原始顺序改名落盘
+
+    结果可以按任意顺序到达，因此文件名冲突时的覆盖结果与串行导出完全一致。
+    """
+
+    LABELS = {'exported': 'OK', 'appended': '追加', 'unchanged': '未变化', 'empty': '跳过'}
+
+    def __init__(self, session_files, manifest=None, stats=None):
+        self.total = len(session_files)
+        self.manifest = manifest
+        self.stats = stats
+        self.summary = {'total': self.total, 'exported': 0, 'appended': 0, 'unchanged': 0, 'empty': 0, 'failed': 0,
+                        'messages': 0, 'bytes': 0, 'errors': []}
+        self.results = [None] * self.total
+        self.done = 0
+        self.next_commit = 0
+
+    def finish(self, index, result):
+        """记录第 index 个会话的结果，并落盘所有已经可以按顺序提交的结果"""
+        self.results[index] = result
+        self.done += 1
+        if self.stats is not None and 'stats' in result:
+            self.stats.merge(result.pop('stats'))
+        name = os.path.basename(result['path'])
+        if result['status'] == 'error':
+            print(f'[{self.done}/{self.total}] ERROR {name}: {result["error"]}')
+        elif result['status'] == 'empty':
+            print(f'[{self.done}/{self.total}] 跳过 {name}（没有可导出的消息）')
+        else:
+            print(f'[{self.done}/{self.total}] {self.LABELS[result["status"]]} {name}：{result["count"]} 条消息')
+
+        summary = self.summary
+        while self.next_commit < self.total and self.results[self.next_commit] is not None:
+            committed = self.results[self.next_commit]
+            self.results[self.next_commit] = True  # 已提交，释放结果
+            status = committed['status']
+            if status == 'error':
+                summary['failed'] += 1
+                summary['errors'].append((committed['path'], committed['error']))
+            else:
+                if committed.get('staged') is not None:
+                    summary['bytes'] += _file_size(committed['staged'])
+                    commit_staged(committed['staged'], committed['output'])
+                for staged, output in committed.get('parts', ()):
+                    if staged is not None:
+                        summary['bytes'] += _file_size(staged)
+                        commit_staged(staged, output)
+                if status == 'exported':
+                    outputs = [output for _, output in committed.get('parts', ())]
+                    if committed.get('staged') is not None:
+                        outputs.append(committed['output'])
+                    remove_stale_parts(outputs)
+                summary[status] += 1
+                summary['messages'] += committed['count']
+                if self.manifest is not None:
+                    self.manifest.update(committed['path'], committed['entry'])
+            self.next_commit += 1
+
+
+def bulk_export(exporter, session_files, output_dir, include_tools=False, include_media=False, jobs=1, manifest=None,
+                stats=None):
+    """批量导出多个会话
+
+    jobs > 1 时使用进程池并行解析和渲染，大会话优先调度以均衡各进程的负载。
+    工作进程只写暂存文件，主进程按 session_files 的原始顺序改名落盘，
+    因此文件名冲突时的覆盖结果与串行导出完全一致。
+    传入 manifest（ExportManifest）时按增量模式导出并更新清单。
+    传入 stats（ExportStats）时各任务分别统计，结果合并到 stats 中。返回汇总信息。
+    启用跨会话消息去重（exporter.seen_messages）时在本进程中按修改时间从旧到新依次导出，
+    续接的会话中沿用的历史消息留在最早的会话里。
+    """
+    start = time.perf_counter()
+    total = len(session_files)
+    os.makedirs(output_dir, exist_ok=True)
+
+    if exporter.seen_messages is not None:
+        jobs = 1
+        order = chronological_order(session_files)
+    else:
+        # 大会话优先
+        order = sorted(range(total), key=lambda i: _file_size(session_files[i]), reverse=True)
+    # 工作进程中没有会话索引，把索引确认有序的会话随任务传过去
+    ordered = getattr(exporter.parser, 'ordered_sessions', None) or {}
+    tasks = [{
+        'chat_app': exporter.chat_app,
+        'path': session_files[i],
+        'output_dir': output_dir,
+        'include_tools': include_tools,
+        'include_media': include_media,
+        'incremental': manifest is not None,
+        'entry': manifest.get(session_files[i]) if manifest is not None else None,
+        'stats': stats is not None,
+        'chunk_jobs': exporter.chunk_jobs,
+        'compress': exporter.compress,
+        'dedup_tools': exporter.blob_store is not None,
+        'tool_limits': exporter.parser.tool_limits,
+        'seen_messages': exporter.seen_messages,
+        'part_limits': exporter.part_limits,
+        'time_range': (exporter.since, exporter.until),
+        'ordered_sessions': {session_files[i]: ordered[session_files[i]]} if session_files[i] in ordered else None,
+    } for i in order]
+    committer = BulkCommitter(session_files, manifest, stats)
+
+    try:
+        if jobs is not None and jobs <= 1:
+            for index, task in zip(order, tasks):
+                committer.finish(index, _export_task(task))
+        else:
+            from concurrent.futures import ProcessPoolExecutor, as_completed
+
+            with ProcessPoolExecutor(max_workers=jobs) as pool:
+                futures = {pool.submit(_export_task, task): index for index, task in zip(order, tasks)}
+                for future in as_completed(futures):
+                    committer.finish(futures[future], future.result())
+    finally:
+        if manifest is not None:
+            manifest.save()
+
+    summary = committer.summary
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def bulk_export_records(exporter, session_files, output_dir, fmt, include_tools=False, include_media=False,
+                        stats=None):
+    """把多个会话的全部消息导出到一个机器可读文件（fmt 为 WRITERS 中的格式），返回汇总信息
+
+    输出文件为 <output_dir>/<聊天应用>_messages.<扩展名>，全部会话写完后才落盘；
+    单个会话出错时记入汇总并继续导出其余会话。
+    """
+    start = time.perf_counter()
+    writer_class = load_writer_class(fmt)
+    os.makedirs(output_dir, exist_ok=True)
+    suffix = exporter.compress if writer_class.stream_compress else ''
+    output = os.path.join(output_dir, f'{exporter.chat_app}_messages{writer_class.extension}{suffix}')
+    summary = {'total': len(session_files), 'exported': 0, 'appended': 0, 'unchanged': 0, 'empty': 0, 'failed': 0,
+               'messages': 0, 'bytes': 0, 'errors': [], 'output': output}
+
+    if exporter.seen_messages is not None:
+        session_files = [session_files[i] for i in chronological_order(session_files)]
+    writer = writer_class(output, stats=stats, compress=exporter.compress)
+    try:
+        for done, filepath in enumerate(session_files, 1):
+            name = os.path.basename(filepath)
+            try:
+                count = exporter.export_records(writer, filepath, include_tools, include_media)
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+                if stats is not None:
+                    stats.error(filepath, None, e)
+                summary['failed'] += 1
+                summary['errors'].append((filepath, error))
+                print(f'[{done}/{len(session_files)}] ERROR {name}: {error}')
+                continue
+            if count:
+                summary['exported'] += 1
+                summary['messages'] += count
+                print(f'[{done}/{len(session_files)}] OK {name}：{count} 条消息')
+            else:
+                summary['empty'] += 1
+                print(f'[{done}/{len(session_files)}] 跳过 {name}（没有可导出的消息）')
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+    summary['bytes'] = _file_size(output)
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+class ByteBudget:
+    """流水线中在途字节数的上限（异步）
+
+    acquire(n) 等到已占用字节数加上 n 不超过上限时返回；单个超过上限的会话在没有
+    其他在途数据时也允许通过，避免死锁。
+    """
+
+    def __init__(self, limit):
+        import asyncio
+
+        self.limit = limit
+        self.used = 0
+        self._changed = asyncio.Condition()
+
+    async def acquire(self, n):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.used == 0 or self.used + n <= self.limit)
+            self.used += n
+
+    async def release(self, n):
+        async with self._changed:
+            self.used -= n
+            self._changed.notify_all()
+
+
+def _read_session(path):
+    """I/O 线程：把会话文件整个读入内存，返回 (SessionData, 耗时)"""
+    start = time.perf_counter()
+    with open(path, 'rb') as f:
+        data = f.read()
+    return SessionData(path, data), time.perf_counter() - start
+
+
+def _render_task(exporter, source, output_dir, include_tools, include_media, with_stats, read_seconds):
+    """解析线程：在内存中渲染一个会话，返回 (写入器列表, 统计) 或失败时的结果字典"""
+    stats = ExportStats() if with_stats else None
+    exporter.set_stats(stats)
+    if stats is not None:
+        stats.add_time('read', read_seconds)
+    try:
+        return exporter.render_session(source, output_dir, include_tools, include_media), stats
+    except Exception as e:
+        if stats is not None:
+            stats.error(source, None, e)
+        result = {'status': 'error', 'error': f'{type(e).__name__}: {e}', 'path': os.fspath(source)}
+        if stats is not None:
+            result['stats'] = stats.stop().to_dict()
+        return result
+    finally:
+        exporter.set_stats(None)
+
+
+def _stage_task(path, writers, stats):
+    """I/O 线程：把渲染好的写入器写成暂存文件，返回与 _export_task 相同格式的结果"""
+    parts = []
+    try:
+        for writer in writers:
+            parts.append(writer.stage())
+    except BaseException:
+        discard_staged(parts)
+        raise
+    count = sum(writer.count for writer in writers)
+    result = {'status': staged_status(parts), 'count': count,
+              'output': parts[-1][1] if parts else None, 'parts': parts, 'path': path}
+    if stats is not None:
+        result['stats'] = stats.stop().to_dict()
+    return result
+
+
+async def _pipeline(exporter, session_files, output_dir, include_tools, include_media, io_threads, max_inflight,
+                    committer):
+    """流水线导出的协程：读取 -> 解析渲染 -> 写入三个阶段用有界队列连接"""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    loop = asyncio.get_running_loop()
+    budget = ByteBudget(max_inflight)
+    pending = asyncio.Queue()
+    parse_queue = asyncio.Queue(maxsize=io_threads)
+    write_queue = asyncio.Queue(maxsize=io_threads)
+    with_stats = committer.stats is not None
+    # 设置了时间范围时解析器按路径内存映射定位，预读整个文件反而更慢
+    prefetch = exporter.parser.prefetch and not (exporter.since or exporter.until)
+
+    with ThreadPoolExecutor(io_threads, thread_name_prefix='export-io') as io_pool, \
+            ThreadPoolExecutor(1, thread_name_prefix='export-parse') as parse_pool:
+        # 并行 stat 所有会话，得到每个会话要占用的在途字节数
+        sizes = await asyncio.gather(*(loop.run_in_executor(io_pool, _file_size, path) for path in session_files))
+        for index in range(len(session_files)):
+            pending.put_nowait(index)
+
+        async def reader():
+            while not pending.empty():
+                index = pending.get_nowait()
+                path = session_files[index]
+                await budget.acquire(sizes[index])
+                source, seconds = path, 0.0
+                if prefetch:
+                    try:
+                        source, seconds = await loop.run_in_executor(io_pool, _read_session, path)
+                    except OSError:
+                        pass  # 交给解析器按路径打开，由它报告错误
+                await parse_queue.put((index, source, seconds))
+
+        async def parser():
+            while True:
+                item = await parse_queue.get()
+                if item is None:
+                    break
+                index, source, seconds = item
+                rendered = await loop.run_in_executor(parse_pool, _render_task, exporter, source, output_dir,
+                                                      include_tools, include_media, with_stats, seconds)
+                await write_queue.put((index, rendered))
+            for _ in range(io_threads):
+                await write_queue.put(None)
+
+        async def writer():
+            while True:
+                item = await write_queue.get()
+                if item is None:
+                    break
+                index, rendered = item
+                path = session_files[index]
+                if isinstance(rendered, dict):
+                    result = rendered
+                else:
+                    try:
+                        result = await loop.run_in_executor(io_pool, _stage_task, path, *rendered)
+                    except Exception as e:
+                        result = {'status': 'error', 'error': f'{type(e).__name__}: {e}', 'path': path}
+                committer.finish(index, result)
+                await budget.release(sizes[index])
+
+        async def read_all():
+            await asyncio.gather(*(reader() for _ in range(io_threads)))
+            await parse_queue.put(None)
+
+        await asyncio.gather(read_all(), parser(), *(writer() for _ in range(io_threads)))
+
+
+def pipeline_export(exporter, session_files, output_dir, include_tools=False, include_media=False, io_threads=8,
+                    max_inflight=64 * 1024 * 1024, stats=None):
+    """流水线批量导出，适合 I/O 延迟高的存储（如 NFS 上的 ~/.claude）
+
+    读取和写入交给 io_threads 个线程的线程池，解析和渲染在单独的线程中进行，三个阶段之间
+    用有界队列连接，多个会话的读写与解析互相重叠。已读入但尚未写出的会话总字节数不超过
+    max_inflight（背压）。落盘顺序、输出内容和汇总信息与 bulk_export 相同；不支持增量模式。
+    """
+    import asyncio
+
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    committer = BulkCommitter(session_files, stats=stats)
+    asyncio.run(_pipeline(exporter, session_files, output_dir, include_tools, include_media,
+                          max(1, io_threads), max_inflight, committer))
+    summary = committer.summary
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+# 时间线合并时同时打开的会话数上限，超过时先分组合并到临时文件（避免超出文件描述符限制）
+TIMELINE_MAX_OPEN = 128
+
+
+class TimelineWriter(MarkdownWriter):
+    """项目时间线的Markdown写入器：文件名固定为 name，不按首条消息命名"""
+
+    def __init__(self, output_dir, title, name, extra_header=(), stats=None, compress=''):
+        super().__init__(output_dir, title, extra_header, stats=stats, compress=compress)
+        self.name = name
+
+    def filename(self):
+        return f'{safe_filename(self.name)}.md{self.compress}'
+
+
+def timeline_label(filepath):
+    """时间线中标注消息来源的会话名：会话ID取前 8 位，子代理等其他会话用文件名"""
+    session = os.path.splitext(os.path.basename(strip_compression(filepath)))[0]
+    return session[:8] if len(session) == 36 and session.count('-') == 4 else session
+
+
+def timeline_session_files(project):
+    """项目时间线包含的会话文件：项目中的会话，以及 <会话ID>/subagents/ 下的子代理会话"""
+    files = project_session_files(project)
+    for path in list(files):
+        subagents = os.path.join(os.path.splitext(strip_compression(path))[0], 'subagents')
+        if os.path.isdir(subagents):
+            files.extend(os.path.join(subagents, name) for name in sorted(os.listdir(subagents))
+                         if strip_compression(name).endswith('.jsonl'))
+    return files
+
+
+def _timeline_stream(label, messages):
+    """给消息流加上排序用的时间：没有时间戳的消息沿用同一会话中上一条消息的时间"""
+    last = ''
+    for msg in messages:
+        timestamp = msg.get('time')
+        if timestamp and isinstance(timestamp, str):
+            last = timestamp
+        yield last, label, msg
+
+
+def _merge_keyed(streams):
+    """heapq k 路归并 (时间, 标签, 消息) 流；时间相同时按 streams 中的顺序，同一流内保持原顺序"""
+    import heapq
+
+    decorated = [((key, index, seq, label, msg) for seq, (key, label, msg) in enumerate(stream))
+                 for index, stream in enumerate(streams)]
+    for key, _, _, label, msg in heapq.merge(*decorated):
+        yield key, label, msg
+
+
+def _spill(stream, directory):
+    """把归并结果写入临时 JSONL 文件，返回文件路径"""
+    fd, path = tempfile.mkstemp(suffix='.jsonl', dir=directory)
+    with open(fd, 'w', encoding='utf-8') as f:
+        for item in stream:
+            f.write(_json_encode(item))
+            f.write('\n')
+    return path
+
+
+def _read_spill(path):
+    """逐条读取 _spill 写出的 (时间, 标签, 消息)"""
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            yield tuple(json.loads(line))
+
+
+def iter_timeline(exporter, session_files, include_tools=False, include_media=False, max_open=TIMELINE_MAX_OPEN):
+    """按时间戳合并多个会话的消息流，逐条产出 (会话名, 消息)
+
+    每个会话本身按时间顺序，用 heapq k 路归并，每个会话只在内存中保留一条待合并的消息。
+    会话数超过 max_open 时先每 max_open 个一组归并到临时文件，再归并各组，同时打开的文件数有上限，
+    结果与一次归并完全一致。时间戳相同的消息按 session_files 中的顺序输出。
+    """
+    streams = [_timeline_stream(timeline_label(path), exporter.iter_messages(path, include_tools, include_media))
+               for path in session_files]
+    with tempfile.TemporaryDirectory(prefix='timeline-') as spill_dir:
+        while len(streams) > max_open:
+            streams = [_read_spill(_spill(_merge_keyed(streams[i:i + max_open]), spill_dir))
+                       for i in range(0, len(streams), max_open)]
+        for _, label, msg in _merge_keyed(streams):
+            yield label, msg
+
+
+def export_timeline(exporter, project_name, session_files, output_dir, include_tools=False, include_media=False,
+                    by_day=True):
+    """把一个项目的所有会话合并成按时间排列的Markdown时间线，返回 [(输出文件, 消息数)]
+
+    by_day 为 True 时每天一个文件（<项目>_<日期>_<项目摘要>.md），否则整个项目一个文件
+    （<项目>_时间线_<项目摘要>.md）。项目摘要由完整的项目名称算出，不同目录下的同名项目不会互相覆盖。
+    日期取消息时间戳的前 10 位；个别时间戳早于前一条的消息留在归并到的位置，不会重新打开已写完的文件。
+    每条消息的角色后面标注来源会话。
+    """
+    title = f'{exporter.get_chat_app_name()} 项目时间线'
+    extra_header = [f'- 项目：{project_name}', f'- 会话数：{len(session_files)}']
+
+    project = os.path.basename(project_name.rstrip('/\\')) or project_name
+    project_key = hashlib.sha1(project_name.encode('utf-8', 'surrogateescape')).hexdigest()[:8]
+    outputs = []
+    writer = None
+    day = None
+
+    def finish():
+        staged = writer.stage()
+        if staged is not None:
+            commit_staged(*staged)
+            outputs.append((staged[1], writer.count))
+
+    try:
+        for label, msg in iter_timeline(exporter, session_files, include_tools, include_media):
+            msg_day = msg['time'][:10] if isinstance(msg.get('time'), str) else ''
+            if writer is None or (by_day and msg_day > day):
+                if writer is not None:
+                    finish()
+                day = msg_day
+                name = f'{project}_{day or "未知日期"}' if by_day else f'{project}_时间线'
+                name = f'{name}_{project_key}'
+                writer = TimelineWriter(output_dir, title, name, extra_header, stats=exporter.stats,
+                                        compress=exporter.compress)
+            writer.write(dict(msg, role=f'{msg["role"]} · {label}'))
+        if writer is not None:
+            finish()
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    return outputs
+
+
+def run_timeline(exporter, args):
+    """按命令行参数导出项目时间线（--project 或 --all-projects 选中的项目）"""
+    if args.sessions:
+        projects = [{'name': 'sessions', 'path': '', 'sessions': list(args.sessions)}]
+    else:
+        sessions = exporter.list_sessions()
+        if args.all_projects:
+            projects = sessions
+        else:
+            project = select_project(sessions, args.project) if args.project else None
+            if project is None:
+                print(f"时间线导出需要 --project（编号或名称）、--all-projects 或 --sessions：{args.project or ''}")
+                return
+            projects = [project]
+
+    start = time.perf_counter()
+    total_files = total_messages = 0
+    for project in projects:
+        files = timeline_session_files(project)
+        if not files:
+            continue
+        outputs = export_timeline(exporter, project['name'], files, args.output_dir, args.tools, args.media,
+                                  by_day=args.timeline == 'day')
+        messages = sum(count for _, count in outputs)
+        print(f'OK {project["name"]}：{len(files)} 个会话，{messages} 条消息 -> {len(outputs)} 个文件')
+        total_files += len(outputs)
+        total_messages += messages
+    print(f'\n✅ 时间线导出完成！共 {total_files} 个文件，{total_messages} 条消息，'
+          f'耗时 {time.perf_counter() - start:.2f} 秒')
+
+
+def print_bulk_summary(summary):
+    """打印批量导出的汇总信息"""
+    print(f'\n✅ 导出完成！共导出 {summary["exported"]} 个会话')
+    print(f'   会话总数：{summary["total"]}，空会话：{summary["empty"]}，失败：{summary["failed"]}')
+    if summary['appended'] or summary['unchanged']:
+        print(f'   增量追加：{summary["appended"]}，未变化：{summary["unchanged"]}')
+    print(f'   消息数量：{summary["messages"]} 条，输出大小：{summary["bytes"] / 1024:.1f} KB')
+    print(f'   耗时：{summary["seconds"]:.2f} 秒')
+    if summary.get('output'):
+        print(f'   输出文件：{summary["output"]}')
+    for path, error in summary['errors']:
+        print(f'   ERROR {path}: {error}')
+
+
+def parse_size(text):
+    """解析 10K / 1.5M / 2G / 2048 这样的大小写法，返回字节数"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_tool_limit(text):
+    """解析 --tool-limit 的 工具=参数上限[,结果上限]，如 Bash=,5000 / Write=100 / *=300,2000"""
+    tool, sep, limits = text.partition('=')
+    if not sep or not tool:
+        raise ValueError(f'工具上限的格式应为 工具=参数上限[,结果上限]：{text}')
+    input_limit, _, result_limit = limits.partition(',')
+    return tool, (int(input_limit) if input_limit.strip() else None,
+                  int(result_limit) if result_limit.strip() else None)
+
+
+def print_session_rows(rows):
+    """打印索引中的会话列表"""
+    for i, row in enumerate(rows, 1):
+        print(f'{i}. {row["first_time"][:16]} ~ {row["last_time"][:16]}  {row["size"] / 1024:.1f}KB  '
+              f'用户 {row["user_count"]} / 助手 {row["assistant_count"]} 条')
+        print(f'   项目：{row["cwd"] or decode_project_dir(os.path.basename(row["project_dir"]))}')
+        print(f'   首条消息：{row["first_user_message"][:60].replace(chr(10), " ")}')
+        print(f'   文件：{row["path"]}')
+
+
+def select_project(projects, key):
+    """按编号（从1开始）或名称选择项目，"." 表示当前工作目录对应的项目；找不到时返回None"""
+    keys = {key}
+    if key == '.':
+        # 有索引时项目名称是记录中的 cwd；没有索引时只能比较目录名（Claude Code 把非字母数字字符替换成 "-"）
+        cwd = os.getcwd()
+        keys = {cwd, re.sub(r'[^A-Za-z0-9]', '-', cwd)}
+    elif key.isdigit():
+        index = int(key) - 1
+        return projects[index] if 0 <= index < len(projects) else None
+    for project in projects:
+        if project["name"] in keys or os.path.basename(project["path"]) in keys:
+            return project
+    return None
+
+
+def _is_live_session(name):
+    """是否是正在写入的 Claude Code 会话文件（压缩的归档不会再变化）"""
+    return name.endswith('.jsonl')
+
+
+class PollingWatcher:
+    """轮询方式的会话变化监视器（没有 inotify 时使用）：每次 wait 扫描一遍项目目录，比较大小和 mtime"""
+
+    def __init__(self, projects_dir):
+        self.projects_dir = projects_dir
+        self._state = {}
+        self.scan()
+
+    def scan(self):
+        """扫描全部会话，返回大小或 mtime 变化过的会话文件"""
+        changed = set()
+        state = {}
+        if os.path.isdir(self.projects_dir):
+            for project in os.scandir(self.projects_dir):
+                if not project.is_dir():
+                    continue
+                for entry in os.scandir(project.path):
+                    if not _is_live_session(entry.name):
+                        continue
+                    try:
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    state[entry.path] = (st.st_size, st.st_mtime_ns)
+                    if self._state.get(entry.path) != state[entry.path]:
+                        changed.add(entry.path)
+        self._state = state
+        return changed
+
+    def wait(self, timeout, idle=None):
+        """等待 timeout 秒后返回这段时间内变化过的会话文件（idle 只对 inotify 有意义）"""
+        time.sleep(timeout)
+        return self.scan()
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher:
+    """用 inotify（通过 ctypes 调用 libc，仅 Linux）监视项目目录
+
+    只监视目录（每个项目一个 watch），不逐个监视会话文件：空闲的会话不产生任何开销，
+    CPU 占用只与写入频率有关。新建的项目目录会自动加入监视；事件队列溢出时返回全部会话。
+    """
+
+    IN_MODIFY = 0x2
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_IGNORED = 0x8000
+    IN_Q_OVERFLOW = 0x4000
+    IN_ISDIR = 0x40000000
+
+    def __init__(self, projects_dir):
+        import ctypes
+        import struct
+
+        self.projects_dir = projects_dir
+        self._event = struct.Struct('iIII')
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        self._dirs = {}
+        self._add_watch(projects_dir, self.IN_CREATE | self.IN_MOVED_TO)
+        for project in os.scandir(projects_dir):
+            if project.is_dir():
+                self._watch_project(project.path)
+
+    def _add_watch(self, path, mask):
+        import ctypes
+
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch 失败：{path}')
+        self._dirs[wd] = path
+
+    def _watch_project(self, path):
+        self._add_watch(path, self.IN_MODIFY | self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE)
+
+    def _all_sessions(self):
+        return {os.path.join(project, name) for wd, project in self._dirs.items() if project != self.projects_dir
+                for name in os.listdir(project) if _is_live_session(name)}
+
+    def _read_events(self):
+        """读出当前排队的全部事件，返回变化的会话文件"""
+        import errno
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 1 << 16)
+            except BlockingIOError:
+                return changed
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            pos = 0
+            while pos < len(data):
+                wd, mask, _, length = self._event.unpack_from(data, pos)
+                name = os.fsdecode(data[pos + self._event.size:pos + self._event.size + length].rstrip(b'\0'))
+                pos += self._event.size + length
+                if mask & self.IN_Q_OVERFLOW:
+                    changed |= self._all_sessions()
+                    continue
+                if mask & self.IN_IGNORED:
+                    # 目录已删除，watch 随之失效
+                    self._dirs.pop(wd, None)
+                    continue
+                directory = self._dirs.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, name)
+                if directory == self.projects_dir:
+                    if mask & self.IN_ISDIR:
+                        # 新项目：开始监视，并导出监视建立之前已经写入的会话
+                        self._watch_project(path)
+                        changed |= {os.path.join(path, n) for n in os.listdir(path) if _is_live_session(n)}
+                elif _is_live_session(name):
+                    changed.add(path)
+
+    def wait(self, timeout, idle=None):
+        """等待第一个事件（最多 idle 秒，None 表示一直等待），再收集 timeout 秒内的后续事件，返回变化的会话文件"""
+        import select
+
+        ready, _, _ = select.select([self.fd], [], [], idle)
+        if not ready:
+            return set()
+        deadline = time.monotonic() + timeout
+        changed = self._read_events()
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return changed
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            if ready:
+                changed |= self._read_events()
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(projects_dir, polling=False):
+    """优先使用 inotify，不可用（非 Linux、watch 数量超限等）时退回轮询"""
+    if not polling and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(projects_dir)
+        except (OSError, AttributeError) as e:
+            print(f'inotify 不可用（{e}），改为轮询。')
+    return PollingWatcher(projects_dir)
+
+
+def watch_sessions(exporter, output_dir, watcher, include_tools=False, latency=0.5, stop=None):
+    """持续把会话新增的消息追加到对应的导出文件，直到 stop() 返回 True
+
+    启动时先增量导出全部会话（与 --incremental 使用同一份清单），之后只处理 watcher 报告的变化。
+    追加沿用增量导出的语义：只解析上次偏移之后以换行结尾的完整行，正在写入的末行留到下次。
+    从写入到导出的延迟约为 latency 的两倍（等待第一个事件，再合并 latency 秒内的后续事件）。
+    """
+    manifest = ExportManifest.for_output_dir(output_dir)
+    initial = sorted(path for project in exporter.list_sessions() for path in project_session_files(project)
+                     if _is_live_session(path))
+    if initial:
+        bulk_export(exporter, initial, output_dir, include_tools, manifest=manifest, stats=exporter.stats)
+    # 没有停止条件时在事件到来之前一直阻塞，空闲时不占用CPU
+    idle = None if stop is None else latency
+    while stop is None or not stop():
+        changed = sorted(path for path in watcher.wait(latency, idle) if os.path.isfile(path))
+        if changed:
+            bulk_export(exporter, changed, output_dir, include_tools, manifest=manifest, stats=exporter.stats)
+    return manifest
+
+
+def watch_command(argv):
+    """watch 子命令：监视 Claude Code 会话，持续把新消息追加到导出文件"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='universal_export.py watch',
+                                     description='监视 Claude Code 会话，实时把新消息追加到导出文件')
+    parser.add_argument('output_dir', help='输出目录')
+    parser.add_argument('--tools', action='store_true', help='包含工具调用记录')
+    parser.add_argument('--latency', type=float, default=0.5, metavar='SECONDS',
+                        help='合并事件的时间窗口（秒，默认 0.5），也是轮询间隔')
+    parser.add_argument('--polling', action='store_true', help='不使用 inotify，定期扫描项目目录')
+    args = parser.parse_args(argv)
+
+    exporter = ChatExporter('claude')
+    projects_dir = os.path.join(exporter.parser.base_dir, 'projects')
+    if not os.path.isdir(projects_dir):
+        print(f'未找到 Claude Code 项目目录：{projects_dir}')
+        return
+    watcher = make_watcher(projects_dir, args.polling)
+    print(f'正在监视 {projects_dir}（{"inotify" if isinstance(watcher, InotifyWatcher) else "轮询"}），按 Ctrl+C 结束')
+    try:
+        watch_sessions(exporter, args.output_dir, watcher, args.tools, args.latency)
+    except KeyboardInterrupt:
+        print('\n已停止监视。')
+    finally:
+        watcher.close()
+
+
+# 用量统计中的 token 字段（Claude API usage 中的键）
+USAGE_FIELDS = ('input_tokens', 'output_tokens', 'cache_creation_input_tokens', 'cache_read_input_tokens')
+
+
+def _usage_task(task):
+    """进程池任务：从字节偏移 task['offset'] 开始统计一个会话的消息、API 请求用量和工具调用
+
+    同一个 API 响应按内容块拆成多条记录，它们的 message.id 和 usage 相同，按 message.id 只计一次，
+    用最后一条记录的 usage。没有 message.id 或 tool_use id 的记录按 "会话路径@记录末尾的字节偏移" 编号，
+    续接统计时编号不变，也不会与其他会话冲突。返回会话元数据、请求行和工具调用行，由主进程写入统计缓存；
+    出错时返回错误信息，不影响其他会话。
+    """
+    exporter = _WORKER_EXPORTERS.get('claude')
+    if exporter is None:
+        exporter = _WORKER_EXPORTERS['claude'] = ChatExporter('claude')
+    parser = exporter.parser
+    meta = dict(task['row'] or {'offset': 0, 'user_messages': 0, 'tool_calls': 0, 'first_time': '', 'last_time': ''})
+    requests = {}
+    tool_calls = []
+    position = {}
+    try:
+        for obj in parser._iter_records(task['path'], meta['offset'], position):
+            msg = obj.get('message')
+            if not isinstance(msg, dict):
+                continue
+            timestamp = obj.get('timestamp')
+            if isinstance(timestamp, str) and timestamp:
+                meta['first_time'] = meta['first_time'] or timestamp
+                meta['last_time'] = timestamp
+            else:
+                timestamp = meta['last_time']
+            content = msg.get('content')
+            if obj.get('type') == 'user':
+                # 只有工具返回结果的用户记录不算用户消息
+                if isinstance(content, str) or (isinstance(content, list) and any(
+                        isinstance(item, dict) and item.get('type') != 'tool_result' for item in content)):
+                    meta['user_messages'] += 1
+                continue
+
+            record_id = f'{task["path"]}@{position["offset"]}'
+            message_id = msg.get('id') or record_id
+            usage = msg.get('usage')
+            if isinstance(usage, dict) or message_id not in requests:
+                usage = usage if isinstance(usage, dict) else {}
+                requests[message_id] = (task['path'], message_id, timestamp, timestamp[:10], msg.get('model') or '',
+                                        *(usage.get(field) or 0 for field in USAGE_FIELDS))
+            if isinstance(content, list):
+                for index, item in enumerate(content):
+                    if isinstance(item, dict) and item.get('type') == 'tool_use':
+                        meta['tool_calls'] += 1
+                        tool_calls.append((task['path'], item.get('id') or f'{record_id}:{index}',
+                                           message_id, timestamp[:10], item.get('name') or '未知工具'))
+    except Exception as e:
+        return {'path': task['path'], 'error': f'{type(e).__name__}: {e}'}
+    meta.update(path=task['path'], project=task['project'], session=task['session'], size=task['size'],
+                mtime_ns=task['mtime_ns'], inode=task['inode'], offset=position.get('offset', meta['offset']))
+    return {'path': task['path'], 'meta': meta, 'resumed': task['row'] is not None,
+            'requests': list(requests.values()), 'tool_calls': tool_calls}
+
+
+def _duration_seconds(first_time, last_time):
+    """两个ISO时间戳之间的秒数，无法解析时返回0"""
+    try:
+        first = datetime.fromisoformat(first_time.replace('Z', '+00:00'))
+        last = datetime.fromisoformat(last_time.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return 0
+    return max(0, round((last - first).total_seconds()))
+
+
+class UsageIndex:
+    """Claude Code 用量统计缓存（SQLite）
+
+    usage_sessions 保存每个会话的文件状态、已统计到的字节偏移和用户消息数，usage_requests 每个
+    API 响应（即助手消息，按 message.id）一行，记录模型和 token 用量，usage_tool_calls 每次工具调用一行。
+    refresh() 与 SessionIndex 一样按 mtime 增量刷新，只有变化的会话交给进程池重新统计，
+    只追加过的会话从上次的偏移继续。续接的会话沿用原会话的记录，汇总时按 message.id 和
+    tool_use id 去重，用量不会重复计算。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS usage_sessions (
+            path TEXT PRIMARY KEY,
+            project TEXT NOT NULL,
+            session TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            user_messages INTEGER NOT NULL,
+            tool_calls INTEGER NOT NULL,
+            first_time TEXT NOT NULL DEFAULT '',
+            last_time TEXT NOT NULL DEFAULT ''
+        );
+        CREATE TABLE IF NOT EXISTS usage_requests (
+            path TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            time TEXT NOT NULL,
+            day TEXT NOT NULL,
+            model TEXT NOT NULL,
+            input_tokens INTEGER NOT NULL,
+            output_tokens INTEGER NOT NULL,
+            cache_creation_input_tokens INTEGER NOT NULL,
+            cache_read_input_tokens INTEGER NOT NULL,
+            PRIMARY KEY (path, message_id)
+        );
+        CREATE TABLE IF NOT EXISTS usage_tool_calls (
+            path TEXT NOT NULL,
+            tool_use_id TEXT NOT NULL,
+            message_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            tool TEXT NOT NULL,
+            PRIMARY KEY (path, tool_use_id)
+        );
+        CREATE INDEX IF NOT EXISTS usage_requests_message ON usage_requests (message_id);
+    """
+
+    SESSION_COLUMNS = ('path', 'project', 'session', 'size', 'mtime_ns', 'inode', 'offset', 'user_messages',
+                       'tool_calls', 'first_time', 'last_time')
+
+    def __init__(self, path):
+        import sqlite3
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(self.SCHEMA)
+
+    def close(self):
+        """关闭数据库连接"""
+        self.conn.close()
+
+    def refresh(self, exporter, jobs=None):
+        """统计新增或变化过的会话（含子代理会话），返回 (更新的会话数, 出错的会话列表)
+
+        jobs 为 None 或大于 1 时用进程池并行统计，大会话优先调度。
+        """
+        existing = {row['path']: row for row in self.conn.execute('SELECT * FROM usage_sessions')}
+        tasks = []
+        seen = set()
+        for project in exporter.list_sessions():
+            for path in timeline_session_files(project):
+                seen.add(path)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                row = existing.get(path)
+                if row is not None and row['size'] == st.st_size and row['mtime_ns'] == st.st_mtime_ns:
+                    continue
+                # 压缩的会话或被改写过的会话从头统计
+                if row is not None and (row['inode'] != st.st_ino or st.st_size < row['offset']
+                                        or compression_of(path)):
+                    row = None
+                tasks.append({'path': path, 'project': project['name'], 'session': exporter.parser.session_key(path),
+                              'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'inode': st.st_ino,
+                              'row': dict(row) if row is not None else None})
+        tasks.sort(key=lambda task: task['size'] - (task['row'] or {}).get('offset', 0), reverse=True)
+
+        errors = []
+        removed = [path for path in existing if path not in seen]
+        with self.conn:
+            for path in removed:
+                self._delete(path)
+            if jobs is not None and jobs <= 1:
+                for task in tasks:
+                    self._store(_usage_task(task), errors)
+            else:
+                from concurrent.futures import ProcessPoolExecutor, as_completed
+
+                with ProcessPoolExecutor(max_workers=jobs) as pool:
+                    for future in as_completed([pool.submit(_usage_task, task) for task in tasks]):
+                        self._store(future.result(), errors)
+        return len(tasks) - len(errors), errors
+
+    def _store(self, result, errors):
+        """写入一个会话的统计结果；从头统计的会话先删除旧数据"""
+        if 'error' in result:
+            errors.append((result['path'], result['error']))
+            return
+        meta = result['meta']
+        if not result['resumed']:
+            self._delete(meta['path'])
+        self.conn.execute(
+            f'INSERT OR REPLACE INTO usage_sessions ({", ".join(self.SESSION_COLUMNS)}) '
+            f'VALUES ({", ".join("?" * len(self.SESSION_COLUMNS))})',
+            tuple(meta[c] for c in self.SESSION_COLUMNS))
+        self.conn.executemany(
+            'INSERT OR REPLACE INTO usage_requests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', result['requests'])
+        self.conn.executemany('INSERT OR REPLACE INTO usage_tool_calls VALUES (?, ?, ?, ?, ?)', result['tool_calls'])
+
+    def _delete(self, path):
+        """删除一个会话的统计数据"""
+        for table in ('usage_sessions', 'usage_requests', 'usage_tool_calls'):
+            self.conn.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+
+    def tables(self):
+        """返回汇总表 {表名: (列名, 行列表)}
+
+        tokens：按日期、项目、模型汇总的请求数和 token 用量；tools：工具调用次数和涉及的会话数；
+        sessions：每个会话的时间范围、时长、消息数、工具调用数和 token 总量，按文件大小从大到小排列。
+        """
+        token_sums = ', '.join(f'SUM({field}) AS {field}' for field in USAGE_FIELDS)
+        token_first = ', '.join(f'MAX({field}) AS {field}' for field in USAGE_FIELDS)
+        tokens = self.conn.execute(
+            f'SELECT day, project, model, COUNT(*) AS requests, {token_sums} FROM ('
+            f'  SELECT r.message_id, MIN(r.day) AS day, MIN(s.project) AS project, MIN(r.model) AS model, {token_first}'
+            f'  FROM usage_requests r JOIN usage_sessions s ON s.path = r.path GROUP BY r.message_id'
+            f') GROUP BY day, project, model ORDER BY day, project, model')
+        tools = self.conn.execute(
+            'SELECT tool, COUNT(DISTINCT tool_use_id) AS calls, COUNT(DISTINCT path) AS sessions, '
+            'MIN(day) AS first_day, MAX(day) AS last_day FROM usage_tool_calls GROUP BY tool ORDER BY calls DESC, tool')
+        total = ' + '.join(f'COALESCE(r.{field}, 0)' for field in USAGE_FIELDS)
+        sessions = self.conn.execute(
+            f'SELECT s.session, s.project, s.path, s.first_time, s.last_time, s.size, s.user_messages, '
+            f'COUNT(r.message_id) AS assistant_messages, s.tool_calls, COALESCE(SUM({total}), 0) AS tokens '
+            f'FROM usage_sessions s LEFT JOIN usage_requests r ON r.path = s.path '
+            f'GROUP BY s.path ORDER BY s.size DESC, s.path')
+
+        result = {}
+        for name, cursor in (('tokens', tokens), ('tools', tools)):
+            result[name] = ([column[0] for column in cursor.description], [tuple(row) for row in cursor])
+        columns = [column[0] for column in sessions.description]
+        rows = []
+        for row in sessions:
+            row = list(row)
+            row.insert(5, _duration_seconds(row[3], row[4]))
+            rows.append(tuple(row))
+        columns.insert(5, 'duration_seconds')
+        result['sessions'] = (columns, rows)
+        return result
+
+
+def write_tables(tables, output_dir, fmt='csv'):
+    """把汇总表写成 <output_dir>/usage_<表名>.csv 或 .json（对象数组），返回写入的文件列表"""
+    import csv
+
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = []
+    for name, (columns, rows) in tables.items():
+        output = os.path.join(output_dir, f'usage_{name}.{fmt}')
+        staged = f'{output}.{os.getpid()}.tmp'
+        with open(staged, 'w', encoding='utf-8', newline='') as f:
+            if fmt == 'csv':
+                writer = csv.writer(f)
+                writer.writerow(columns)
+                writer.writerows(rows)
+            else:
+                json.dump([dict(zip(columns, row)) for row in rows], f, ensure_ascii=False, indent=1)
+        os.replace(staged, output)
+        outputs.append(output)
+    return outputs
+
+
+def print_usage_summary(tables, top=10):
+    """打印各模型的 token 用量、最常用的工具和最大的会话"""
+    columns, rows = tables['tokens']
+    models = {}
+    for row in rows:
+        record = dict(zip(columns, row))
+        model = models.setdefault(record['model'] or '未知模型', [0] * (len(USAGE_FIELDS) + 1))
+        model[0] += record['requests']
+        for i, field in enumerate(USAGE_FIELDS, 1):
+            model[i] += record[field]
+    print(f'{"模型":<32}{"请求":>8}{"输入":>14}{"输出":>12}{"缓存写入":>14}{"缓存读取":>14}')
+    for name, sums in sorted(models.items(), key=lambda item: -sum(item[1][1:])):
+        print(f'{name:<32}' + ''.join(f'{value:>{width}}' for value, width in zip(sums, (8, 14, 12, 14, 14))))
+
+    columns, rows = tables['tools']
+    if rows:
+        print('\n工具调用：' + '，'.join(f'{row[0]} {row[1]}' for row in rows[:top]))
+
+    columns, rows = tables['sessions']
+    print(f'\n最大的 {min(top, len(rows))} 个会话：')
+    for row in rows[:top]:
+        record = dict(zip(columns, row))
+        print(f'  {record["size"] / 1024 / 1024:7.1f}MB  {record["session"]}  {record["project"]}  '
+              f'{record["user_messages"] + record["assistant_messages"]} 条消息，{record["tool_calls"]} 次工具调用，'
+              f'{record["tokens"]} tokens，时长 {record["duration_seconds"] // 60} 分钟')
+
+
+def stats_command(argv):
+    """stats 子命令：统计所有项目的 token 用量、消息数、工具调用和会话时长，输出 CSV / JSON 表"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog='universal_export.py stats',
+                                     description='统计 Claude Code 所有项目的用量，输出可直接导入看板的表格')
+    parser.add_argument('output_dir', help='输出目录（写入 usage_tokens / usage_tools / usage_sessions 三张表）')
+    parser.add_argument('--format', choices=['csv', 'json'], default='csv', help='输出格式（默认 csv）')
+    parser.add_argument('--jobs', '-j', type=int, default=0, help='并行进程数，0 表示按CPU核数（默认 0）')
+    parser.add_argument('--top', type=int, default=10, help='摘要中显示的工具和会话数量（默认 10）')
+    parser.add_argument('--cache', metavar='PATH', help='统计缓存位置（默认位于 ~/.cache/export-chat-history/）')
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    index = UsageIndex(args.cache or os.path.join(os.path.dirname(default_index_path()), 'usage.sqlite'))
+    try:
+        updated, errors = index.refresh(ChatExporter('claude'), args.jobs if args.jobs > 0 else None)
+        tables = index.tables()
+    finally:
+        index.close()
+
+    for path, error in errors:
+        print(f'ERROR {path}: {error}')
+    outputs = write_tables(tables, args.output_dir, args.format)
+    print_usage_summary(tables, args.top)
+    print(f'\n✅ 统计完成！重新统计 {updated} 个会话，共 {len(tables["sessions"][1])} 个，'
+          f'耗时 {time.perf_counter() - start:.2f} 秒')
+    for output in outputs:
+        print(f'   {output}')
+    return tables
+
+
+# 子命令：第一个参数是子命令名时交给对应的函数处理
+COMMANDS = {
+    'search': search_command,
+    'watch': watch_command,
+    'stats': stats_command,
+}
+
+
+def print_profile(profiler, path=''):
+    """打印 cProfile 结果中累计耗时最多的函数，path 不为空时保存为 pstats 文件"""
+    import pstats
+
+    if path:
+        profiler.dump_stats(path)
+        print(f'\n性能分析结果已保存到 {path}（python -m pstats {path}）')
+        return
+    print('\n🔍 性能分析（按累计耗时，前 25 个函数）')
+    pstats.Stats(profiler, stream=sys.stdout).sort_stats('cumulative').print_stats(25)
+
+
+def run_export(args, stats=None):
+    """按命令行参数执行导出"""
+    jobs = args.jobs if args.jobs > 0 else None
+
+    # 创建导出器
+    exporter = ChatExporter(args.chat_app, stats, args.chunk_jobs if args.chunk_jobs > 0 else None)
+
+    # 时间范围同时裁剪每个会话中的消息；Claude Code 还会用会话元数据索引跳过整个不相关的会话
+    exporter.set_time_range(args.since, args.until)
+    exporter.compress = f'.{args.compress}' if args.compress else ''
+    if args.dedup_tools:
+        exporter.set_blob_store(BlobStore(args.output_dir))
+    exporter.set_tool_limits(dict(args.tool_limit or ()))
+    exporter.set_part_limits(args.part_size, args.part_messages)
+    if args.dedup_messages:
+        exporter.set_message_dedup(make_message_set(args.dedup_memory))
+    is_claude = isinstance(exporter.parser, ClaudeCodeParser)
+    filters = args.recent or args.min_size or (is_claude and (args.since or args.until))
+    if args.index is not None or filters or args.list:
+        if not is_claude:
+            print("会话索引目前只支持 Claude Code。")
+            return
+        index = exporter.parser.use_index(args.index or None)
+
+    # 增量模式的清单保存在输出目录中
+    manifest = ExportManifest.for_output_dir(args.output_dir) if args.incremental else None
+
+    # 机器可读格式把所有会话写入一个文件，总是完整导出
+    records = args.format != 'markdown'
+    if records and manifest is not None:
+        print("机器可读格式不支持增量导出，将完整导出。")
+        manifest = None
+    if args.dedup_messages and manifest is not None:
+        print("跨会话消息去重需要按顺序处理所有会话，不支持增量导出，将完整导出。")
+        manifest = None
+
+    # 项目时间线：所有会话按时间合并
+    if args.timeline:
+        run_timeline(exporter, args)
+        return
+
+    # 如果指定了特定会话文件
+    if args.session and records:
+        session_files = [args.session]
+    elif args.session and manifest is not None:
+        print_bulk_summary(bulk_export(exporter, [args.session], args.output_dir, args.tools, args.media,
+                                       manifest=manifest, stats=stats))
+        return
+    elif args.session and hasattr(exporter.parser, 'iter_conversations'):
+        exporter.export_conversations(args.session, args.output_dir, args.tools, args.media)
+        return
+    elif args.session:
+        exporter.export_session(args.session, args.output_dir, args.tools, args.media)
+        return
+    elif args.sessions:
+        session_files = args.sessions
+    else:
+        # 列出所有会话
+        sessions = exporter.list_sessions()
+
+        if not sessions:
+            print("未找到任何会话。")
+            return
+
+        if args.all_projects or ((filters or args.list) and not args.project):
+            session_files = [f for project in sessions for f in project_session_files(project)]
+        elif args.project:
+            selected_project = select_project(sessions, args.project)
+            if selected_project is None:
+                print(f"未找到项目：{args.project}")
+                return
+            session_files = project_session_files(selected_project)
+        else:
+            # 显示会话列表
+            print(f'您的 {exporter.get_chat_app_name()} 会话列表：')
+            for i, project in enumerate(sessions):
+                print(f'{i+1}. {project["name"]}')
+                print(f'   会话数：{len(project["sessions"])}')
+                print()
+
+            # 让用户选择会话
+            try:
+                choice = int(input("请输入要导出的项目编号（如 1）：")) - 1
+                if choice < 0 or choice >= len(sessions):
+                    print("无效的选择。")
+                    return
+            except ValueError:
+                print("请输入有效的数字。")
+                return
+            except KeyboardInterrupt:
+                print("\n导出已取消。")
+                return
+
+            session_files = project_session_files(sessions[choice])
+
+    if filters or args.list:
+        rows = index.query(min_size=args.min_size, since=args.since, until=args.until,
+                           limit=args.recent, paths=session_files)
+        session_files = [row['path'] for row in rows]
+        if args.list:
+            print_session_rows(rows)
+            return
+
+    # 导出选中的所有会话
+    if args.pipeline and manifest is not None:
+        print("流水线模式不支持增量导出，改用普通批量导出。")
+    elif args.pipeline and exporter.seen_messages is not None:
+        print("跨会话消息去重需要按顺序处理会话，改用普通批量导出。")
+    elif args.pipeline and exporter.part_limits is not None:
+        print("流水线模式在内存中渲染整个会话，不支持分卷导出，改用普通批量导出。")
+    try:
+        if records:
+            summary = bulk_export_records(exporter, session_files, args.output_dir, args.format, args.tools,
+                                          args.media, stats)
+        elif (args.pipeline and manifest is None and exporter.seen_messages is None
+              and exporter.part_limits is None):
+            summary = pipeline_export(exporter, session_files, args.output_dir, args.tools, args.media,
+                                      args.io_threads, args.max_inflight, stats)
+        else:
+            summary = bulk_export(exporter, session_files, args.output_dir, args.tools, args.media, jobs, manifest,
+                                  stats)
+    except KeyboardInterrupt:
+        print("\n导出已取消。")
+        return
+    print_bulk_summary(summary)
+
+
+def main():
+    """主函数"""
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='通用型聊天记录导出工具',
+                                     epilog='子命令：search（全文搜索）、watch（实时追加新消息）、stats（用量统计），'
+                                            '详见 <子命令> --help')
+    parser.add_argument('chat_app', help=f'聊天应用名称（{"/".join(PARSERS)}，或已安装插件提供的名称）')
+    parser.add_argument('output_dir', help='输出目录')
+    parser.add_argument('--tools', action='store_true', help='包含工具调用记录')
+    parser.add_argument('--media', action='store_true', help='包含媒体文件')
+    parser.add_argument('--session', help='特定会话文件路径')
+    parser.add_argument('--sessions', nargs='+', metavar='PATH', help='批量导出多个会话文件')
+    parser.add_argument('--project', help='按编号或名称导出某个项目的全部会话（不再交互选择）')
+    parser.add_argument('--all-projects', action='store_true', help='导出所有项目的全部会话')
+    parser.add_argument('--timeline', nargs='?', const='day', choices=['day', 'project'],
+                        help='项目时间线：把项目中的所有会话（含子代理）按时间合并，每天一个文件（day，默认）'
+                             '或整个项目一个文件（project）；与 --project / --all-projects / --sessions 一起使用')
+    parser.add_argument('--index', nargs='?', const='', metavar='PATH',
+                        help='使用会话元数据索引（SQLite，默认位于 ~/.cache/export-chat-history/）')
+    parser.add_argument('--recent', type=int, metavar='N', help='只导出最近修改的 N 个会话（使用索引）')
+    parser.add_argument('--min-size', type=parse_size, metavar='SIZE', help='只导出不小于 SIZE 的会话，如 10K（使用索引）')
+    parser.add_argument('--since', metavar='DATE',
+                        help='只导出不早于该时间的消息，如 2026-01-01 或 2026-01-01T08（按时间戳前缀比较）')
+    parser.add_argument('--until', metavar='DATE', help='只导出不晚于该时间的消息，如 2026-01-31（包含当天）')
+    parser.add_argument('--list', action='store_true', help='只列出符合条件的会话，不导出（使用索引）')
+    parser.add_argument('--incremental', action='store_true', help='增量导出：跳过未变化的会话，只追加新消息')
+    parser.add_argument('--jobs', '-j', type=int, default=1, help='批量导出的并行进程数，0 表示按CPU核数（默认 1）')
+    parser.add_argument('--chunk-jobs', type=int, default=1, metavar='N',
+                        help='超过 64MB 的单个会话文件按块并行解析的进程数，0 表示按CPU核数（默认 1，不拆分）')
+    parser.add_argument('--format', default='markdown', choices=['markdown', *WRITERS],
+                        help='导出格式：markdown（每个会话一个文件，默认），或把所有消息写入一个 jsonl / sqlite / '
+                             'parquet 文件供分析使用（parquet 需要 pyarrow）')
+    parser.add_argument('--dedup-tools', action='store_true',
+                        help='与 --tools 一起使用：较长的工具参数和返回结果按内容只保存一次（<输出目录>/_blobs/），'
+                             'Markdown 中链接到完整内容')
+    parser.add_argument('--dedup-messages', action='store_true',
+                        help='跨会话消息去重（Claude Code）：续接的会话沿用的历史消息只在最早的会话中导出，'
+                             '并且只导出每个会话当前分支上的消息（回退或编辑前的旧分支不导出）')
+    parser.add_argument('--dedup-memory', type=parse_size, metavar='SIZE',
+                        help='与 --dedup-messages 一起使用：已导出消息的集合最多占用 SIZE 内存（布隆过滤器，'
+                             '极少数消息可能被误判为重复），如 16M；默认精确去重')
+    parser.add_argument('--tool-limit', type=parse_tool_limit, action='append', metavar='工具=参数上限[,结果上限]',
+                        help='与 --tools 一起使用：按工具设置参数和返回结果的截断字符数（默认 200 和 500），'
+                             '可重复，如 --tool-limit Bash=,5000 --tool-limit Write=100；工具名 * 对所有工具生效')
+    parser.add_argument('--part-size', type=parse_size, metavar='SIZE',
+                        help='分卷导出：单个导出文件的正文超过 SIZE（如 5M）时拆成多个部分，另生成目录文件，'
+                             '各部分之间有上一部分 / 下一部分链接')
+    parser.add_argument('--part-messages', type=int, metavar='N', help='分卷导出：每个部分最多 N 条消息')
+    parser.add_argument('--compress', choices=['gz', 'zst'],
+                        help='压缩导出文件（.md.gz / .jsonl.gz 等，zst 需要 Python 3.14 或 zstandard）')
+    parser.add_argument('--pipeline', action='store_true',
+                        help='流水线导出：读写交给线程池，与解析重叠进行，适合 NFS 等高延迟存储（不支持 --incremental）')
+    parser.add_argument('--io-threads', type=int, default=8, metavar='N', help='流水线模式的读写线程数（默认 8）')
+    parser.add_argument('--max-inflight', type=parse_size, default='64M', metavar='SIZE',
+                        help='流水线模式中已读入但尚未写出的会话总大小上限（默认 64M）')
+    parser.add_argument('--stats', nargs='?', const='', metavar='PATH',
+                        help='导出后打印各阶段耗时、跳过的行和解码错误等统计；指定 PATH 时同时写入JSON文件')
+    parser.add_argument('--profile', nargs='?', const='', metavar='PATH',
+                        help='用 cProfile 分析主进程并打印最耗时的函数；指定 PATH 时保存 pstats 文件')
+
+    args = parser.parse_args()
+    stats = ExportStats() if args.stats is not None else None
+    profiler = None
+    if args.profile is not None:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    try:
+        run_export(args, stats)
     except Exception as e:
         print(f"导出过程中出错：{str(e)}")
         sys.exit(1)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            print_profile(profiler, args.profile)
+        if stats is not None:
+            stats.stop().print_summary()
+            if args.stats:
+                stats.save(args.stats)
+                print(f'   统计已写入 {args.stats}')
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
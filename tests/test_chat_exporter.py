@@ -1,12 +1,61 @@
 import os
 import sys
 import json
+import re
+import hashlib
 import tempfile
+import threading
 from datetime import datetime
 from pathlib import Path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from scripts.universal_export import ChatExporter, ClaudeCodeParser, GPTParser, GeminiParser, DoubaoParser
+from scripts.universal_export import (ChatExporter, ClaudeCodeParser, GPTParser, GeminiParser, DoubaoParser,
+                                     bulk_export, ExportManifest, is_message_line,
+                                     SearchIndex, export_search_hits, JSONStreamReader,
+                                     ExportStats, split_chunks, WeChatParser, PARSERS,
+                                     register_parser, load_parser_class, pipeline_export,
+                                     bulk_export_records, RECORD_COLUMNS, load_writer_class, open_compressed,
+                                     BlobStore, PollingWatcher, make_watcher, watch_sessions, MessageSet, BloomFilter,
+                                     iter_timeline, export_timeline, timeline_session_files,
+                                     UsageIndex, write_tables, select_project)
+from benchmarks.corpus import MIXES, generate_claude_corpus, generate_claude_session, generate_json_export
+from benchmarks.run_benchmarks import compare
+
+
+def _write_claude_session(path, records):
+    """写入一个合成的 Claude Code 会话文件"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    return path
+
+
+def _sample_records():
+    """生成一组包含用户、助手、工具调用和无关记录的会话行"""
+    return [
+        {"type": "summary", "summary": "示例会话"},
+        {"type": "user", "timestamp": "2026-01-02T08:00:00.000Z",
+         "message": {"role": "user", "content": "你好，帮我看看这个报错"}},
+        {"type": "assistant", "timestamp": "2026-01-02T08:00:05.000Z",
+         "message": {"role": "assistant", "content": [
+             {"type": "tool_use", "name": "Read", "input": {"file_path": "/tmp/a.py"}}]}},
+        {"type": "user", "timestamp": "2026-01-02T08:00:06.000Z",
+         "message": {"role": "user", "content": [
+             {"type": "tool_result", "content": "x" * 800}]}},
+        {"type": "assistant", "timestamp": "2026-01-03T09:30:00.000Z",
+         "message": {"role": "assistant", "content": [{"type": "text", "text": "问题已修复。"}]}},
+    ]
+
+
+def _read_exports(output_dir):
+    """读取导出目录中的所有文件内容（忽略随时间变化的导出时间行和子目录）"""
+    contents = {}
+    for name in sorted(os.listdir(output_dir)):
+        if os.path.isdir(os.path.join(output_dir, name)):
+            continue
+        with open(os.path.join(output_dir, name), encoding='utf-8') as f:
+            contents[name] = [line for line in f if not line.startswith('- 导出时间：')]
+    return contents
 
 
 def test_claude_code_parser_find_dir():
@@ -156,6 +205,1397 @@ def test_markdown_export():
         print("WARN 未找到任何项目")
 
 
+def test_streaming_export():
+    """测试流式解析与流式写入的结果与列表方式一致"""
+    parser = ClaudeCodeParser()
+    exporter = ChatExporter("claude")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_file = _write_claude_session(os.path.join(temp_dir, 's.jsonl'), _sample_records())
+
+        stream = parser.iter_messages(session_file)
+        assert not isinstance(stream, list), "iter_messages 应返回生成器"
+        messages = list(stream)
+        assert messages == parser.parse_session(session_file)
+        assert [m['role'] for m in messages] == ['🧑 用户', '🧑 用户', '🤖 Claude']
+
+        list_dir = os.path.join(temp_dir, 'list')
+        stream_dir = os.path.join(temp_dir, 'stream')
+        list_file = exporter.export_to_markdown(messages, list_dir, session_key='s')
+        stream_file = exporter.export_session(session_file, stream_dir)
+
+        assert os.path.basename(list_file) == os.path.basename(stream_file)
+        with open(list_file, encoding='utf-8') as a, open(stream_file, encoding='utf-8') as b:
+            content = b.read()
+            assert a.read() == content
+        assert '- 对话时间：2026-01-02 ~ 2026-01-03' in content
+        assert '- 消息数量：3 条' in content
+        assert os.listdir(stream_dir) == [os.path.basename(stream_file)], "正文临时文件未清理"
+
+    print("OK 流式导出与列表导出结果一致")
+
+
+def test_parallel_bulk_export():
+    """测试并行批量导出与串行导出结果一致"""
+    exporter = ChatExporter("claude")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_files = []
+        for i in range(6):
+            records = _sample_records()
+            records[1]['message']['content'] = f'第 {i} 个会话'
+            records[4]['message']['content'][0]['text'] = '回复' * (i * 200 + 1)
+            session_files.append(_write_claude_session(os.path.join(temp_dir, f'{i}.jsonl'), records))
+        # 与第一个会话同一天、同样开头的会话：文件名带会话ID，不会互相覆盖
+        duplicate = _sample_records()[:2]
+        duplicate[1]['message']['content'] = '第 0 个会话'
+        session_files.append(_write_claude_session(os.path.join(temp_dir, 'dup.jsonl'), duplicate))
+        session_files.append(_write_claude_session(os.path.join(temp_dir, 'empty.jsonl'), _sample_records()[:1]))
+
+        serial_dir = os.path.join(temp_dir, 'serial')
+        parallel_dir = os.path.join(temp_dir, 'parallel')
+        serial = bulk_export(exporter, session_files, serial_dir, jobs=1)
+        parallel = bulk_export(exporter, session_files, parallel_dir, jobs=3)
+
+        serial_files = _read_exports(serial_dir)
+        assert serial_files == _read_exports(parallel_dir)
+        assert len(serial_files) == 7
+        for summary in (serial, parallel):
+            assert summary['total'] == 8
+            assert summary['exported'] == 7
+            assert summary['empty'] == 1
+            assert summary['failed'] == 0
+
+    print("OK 并行批量导出与串行导出结果一致")
+
+
+def test_incremental_export():
+    """测试增量导出：未变化时跳过，追加时只解析新增部分，结果与完整导出一致"""
+    exporter = ChatExporter("claude")
+
+    def turn(i):
+        return {"type": "user", "timestamp": f"2026-01-05T10:{i:02d}:00.000Z",
+                "message": {"role": "user", "content": f"追加的第 {i} 条消息"}}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_file = _write_claude_session(os.path.join(temp_dir, 's.jsonl'), _sample_records())
+        inc_dir = os.path.join(temp_dir, 'inc')
+
+        def run():
+            manifest = ExportManifest.for_output_dir(inc_dir)
+            return bulk_export(exporter, [session_file], inc_dir, manifest=manifest)
+
+        assert run()['exported'] == 1
+        assert run()['unchanged'] == 1
+
+        # 追加完整的行和一行尚未写完的记录
+        with open(session_file, 'a', encoding='utf-8') as f:
+            for i in range(3):
+                f.write(json.dumps(turn(i), ensure_ascii=False) + '\n')
+            partial = json.dumps(turn(3), ensure_ascii=False)
+            f.write(partial[:20])
+        output = next(os.path.join(inc_dir, name) for name in os.listdir(inc_dir) if name.endswith('.md'))
+        inode = os.stat(output).st_ino
+        summary = run()
+        assert summary['appended'] == 1 and summary['messages'] == 3
+        # 文件头长度不变时也写入新文件后整体替换，不在原文件上改写
+        assert os.stat(output).st_ino != inode
+
+        # 补完末尾的行，并让消息数进位（文件头长度变化）
+        with open(session_file, 'a', encoding='utf-8') as f:
+            f.write(partial[20:] + '\n')
+            for i in range(4, 12):
+                f.write(json.dumps(turn(i), ensure_ascii=False) + '\n')
+        summary = run()
+        assert summary['appended'] == 1 and summary['messages'] == 9
+
+        full_dir = os.path.join(temp_dir, 'full')
+        exporter.export_session(session_file, full_dir)
+        incremental = _read_exports(inc_dir)
+        incremental.pop(ExportManifest.FILENAME)
+        assert incremental == _read_exports(full_dir)
+        assert any('- 消息数量：15 条\n' in lines for lines in incremental.values())
+
+    print("OK 增量导出结果与完整导出一致")
+
+
+def test_message_line_prefilter():
+    """测试字节预过滤：紧凑和带空格的写法都能识别，无关记录被跳过"""
+    records = _sample_records()
+    for record in records:
+        compact = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        spaced = json.dumps(record, ensure_ascii=False).encode('utf-8')
+        expected = record['type'] in ('user', 'assistant')
+        assert is_message_line(compact) == expected
+        assert is_message_line(spaced) == expected
+
+    # 文本内容中的标记是转义过的，不会误判
+    quoted = json.dumps({"type": "system", "content": '"type":"user"'}).encode('utf-8')
+    assert not is_message_line(quoted)
+
+    parser = ClaudeCodeParser()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_file = os.path.join(temp_dir, 's.jsonl')
+        with open(session_file, 'w', encoding='utf-8') as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+            f.write('{"type":"user", 损坏的行\n')
+        messages = parser.parse_session(session_file, include_tools=True)
+        assert len(messages) == 4
+
+    print("OK 字节预过滤识别正确")
+
+
+def test_session_index():
+    """测试会话元数据索引：真实项目路径、增量刷新与筛选排序"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, 'projects', '-work-my-app')
+        os.makedirs(project_dir)
+        records = _sample_records()
+        for record in records[1:]:
+            record['cwd'] = '/work/my-app'
+        small = _write_claude_session(os.path.join(project_dir, 'small.jsonl'), records[:2])
+        big = _write_claude_session(os.path.join(project_dir, 'big.jsonl'), records)
+        os.utime(small, (1_000_000_000, 1_000_000_000))
+
+        parser = ClaudeCodeParser(index_path=os.path.join(temp_dir, 'index.sqlite'))
+        parser.base_dir = temp_dir
+
+        projects = parser.list_sessions()
+        assert len(projects) == 1
+        assert projects[0]['name'] == '/work/my-app', "项目名称应取自记录中的 cwd"
+        assert sorted(projects[0]['sessions']) == sorted([small, big])
+
+        rows = parser.query_sessions()
+        assert [row['path'] for row in rows] == [big, small], "默认按修改时间倒序"
+        big_row = rows[0]
+        assert big_row['user_count'] == 2 and big_row['assistant_count'] == 1
+        assert big_row['first_user_message'] == '你好，帮我看看这个报错'
+        assert big_row['first_time'].startswith('2026-01-02') and big_row['last_time'].startswith('2026-01-03')
+
+        assert [r['path'] for r in parser.query_sessions(min_size=os.path.getsize(big))] == [big]
+        assert [r['path'] for r in parser.query_sessions(since='2026-01-03')] == [big]
+        assert len(parser.query_sessions(until='2026-01-02')) == 2
+        assert parser.query_sessions(until='2026-01-01') == []
+        assert len(parser.query_sessions(limit=1)) == 1
+
+        # 未变化时不重新统计，追加后从偏移继续累计，删除的会话从索引移除
+        assert parser.index.refresh(os.path.join(temp_dir, 'projects')) == 0
+        with open(big, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(records[1], ensure_ascii=False) + '\n')
+        assert parser.index.refresh(os.path.join(temp_dir, 'projects')) == 1
+        assert parser.query_sessions(order_by='size')[0]['user_count'] == 3
+        os.remove(small)
+        assert [r['path'] for r in parser.query_sessions()] == [big]
+        parser.index.close()
+
+    print("OK 会话元数据索引工作正常")
+
+
+def test_select_current_project():
+    """测试 --project . 在不使用索引时按编码后的目录名匹配当前工作目录"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = os.path.realpath(os.path.join(temp_dir, 'my.app'))
+        os.makedirs(work_dir)
+        parser = ClaudeCodeParser()
+        parser.base_dir = temp_dir
+        for name in ('-other', re.sub(r'[^A-Za-z0-9]', '-', work_dir)):
+            os.makedirs(os.path.join(temp_dir, 'projects', name))
+            _write_claude_session(os.path.join(temp_dir, 'projects', name, 's.jsonl'), _sample_records())
+
+        projects = parser.list_sessions()
+        previous = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            project = select_project(projects, '.')
+        finally:
+            os.chdir(previous)
+        assert project is not None and os.path.basename(project['path']) == re.sub(r'[^A-Za-z0-9]', '-', work_dir)
+        assert select_project(projects, '-other')['path'].endswith('-other')
+
+    print("OK 不使用索引时 --project . 能匹配当前目录的项目")
+
+
+def test_search_index():
+    """测试全文搜索索引：子串与中文搜索、增量追加、导出命中前后的消息"""
+    exporter = ChatExporter("claude")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        exporter.parser.base_dir = temp_dir
+        project_dir = os.path.join(temp_dir, 'projects', '-work-app')
+        os.makedirs(project_dir)
+        session_file = _write_claude_session(os.path.join(project_dir, 's.jsonl'), _sample_records())
+
+        index = SearchIndex(os.path.join(temp_dir, 'search.sqlite'))
+        assert index.refresh(exporter) == 4
+        assert index.refresh(exporter) == 0, "未变化的会话不应重新索引"
+
+        hits = index.search('file_path', ['claude'])
+        assert len(hits) == 1 and hits[0]['role'] == '🤖 Claude' and hits[0]['seq'] == 1
+        assert hits[0]['path'] == session_file
+        assert 'file_path' in hits[0]['snippet']
+
+        assert len(index.search('报错', ['claude'])) == 1, "两个字的中文应能搜到"
+        assert index.search('不存在的内容', ['claude']) == []
+
+        with open(session_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"type": "user", "timestamp": "2026-01-04T00:00:00.000Z",
+                                "message": {"role": "user", "content": "ImportError: no module named foo"}}) + '\n')
+        assert index.refresh(exporter) == 1
+        hits = index.search('ImportError', ['claude'])
+        assert [hit['seq'] for hit in hits] == [4]
+
+        output_dir = os.path.join(temp_dir, 'out')
+        export_search_hits({'claude': exporter}, hits, output_dir, context=1)
+        exported = _read_exports(output_dir)
+        assert len(exported) == 1
+        content = ''.join(next(iter(exported.values())))
+        assert '- 消息数量：2 条' in content and 'ImportError' in content and '问题已修复' in content
+        index.close()
+
+    print("OK 全文搜索索引工作正常")
+
+
+def test_streaming_json_parsers():
+    """测试 GPT / Gemini / 豆包 的流式JSON解析：多种结构、逐个读取数组元素"""
+    messages = [{"role": "user", "content": f" 问题 {i} ", "created": 1700000000 + i} for i in range(50)]
+    messages += [{"role": "assistant", "content": "回答", "timestamp": "2026-01-01T00:00:00"},
+                 {"role": "model", "content": "模型回答", "created": 1.5e9},
+                 {"role": "system", "content": "系统提示"},
+                 {"role": "tool", "content": "忽略"}]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        layouts = {
+            'messages.json': {"title": {"nested": [1, 2.5e3, {"a": None}]}, "messages": messages},
+            'conversations.json': {"count": -1.25e-3, "conversations": messages},
+            'list.json': messages,
+        }
+        for name, data in layouts.items():
+            path = os.path.join(temp_dir, name)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, indent=1)
+
+            gpt = GPTParser().parse_session(path)
+            assert len(gpt) == 52 and gpt[0]['text'] == '问题 0' and gpt[-1]['role'] == '🤖 GPT'
+            gemini = GeminiParser().parse_session(path)
+            assert [m['text'] for m in gemini[-2:]] == ['回答', '模型回答']
+            doubao = DoubaoParser().parse_session(path)
+            assert doubao[-1]['role'] == '🤖 豆包' and len(doubao) == 52
+
+        # 损坏的文件返回提示信息
+        broken = os.path.join(temp_dir, 'broken.json')
+        with open(broken, 'w', encoding='utf-8') as f:
+            f.write('{"messages": [')
+        assert GPTParser().parse_session(broken)[0]['text'] == 'GPT聊天记录解析功能正在开发中...'
+
+        # 读取缓冲区只保留当前元素附近的内容
+        with open(os.path.join(temp_dir, 'list.json'), encoding='utf-8') as f:
+            reader = JSONStreamReader(f, chunk_size=256)
+            max_buffer = 0
+            count = 0
+            for item in reader.iter_array():
+                count += 1
+                max_buffer = max(max_buffer, len(reader.buf))
+        assert count == len(messages)
+        assert max_buffer < 1024, "缓冲区不应随文件大小增长"
+
+    print("OK 流式JSON解析正常")
+
+
+def test_benchmark_corpus():
+    """测试合成语料可复现、能被解析器正确读取，以及基线比较逻辑"""
+    parser = ClaudeCodeParser()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for mix in MIXES:
+            os.makedirs(os.path.join(temp_dir, 'a'), exist_ok=True)
+            os.makedirs(os.path.join(temp_dir, 'b'), exist_ok=True)
+            a = os.path.join(temp_dir, 'a', f'{mix}.jsonl')
+            b = os.path.join(temp_dir, 'b', f'{mix}.jsonl')
+            size = generate_claude_session(a, 50_000, mix, seed=7)
+            generate_claude_session(b, 50_000, mix, seed=7)
+            assert size >= 50_000
+            with open(a, 'rb') as fa, open(b, 'rb') as fb:
+                assert fa.read() == fb.read(), "同一种子生成的语料应完全相同"
+            assert len(parser.parse_session(a, include_tools=True)) > 0
+
+        parser.base_dir = os.path.join(temp_dir, 'corpus')
+        files = generate_claude_corpus(parser.base_dir, projects=2, sessions_per_project=3, session_size=4096)
+        projects = parser.list_sessions()
+        assert sorted(f for p in projects for f in p['sessions']) == sorted(files)
+
+        gpt_file = os.path.join(temp_dir, 'gpt.json')
+        generate_json_export(gpt_file, 10, 'gpt', 'conversations')
+        assert len(GPTParser().parse_session(gpt_file)) == 10
+
+    baseline = {'scale': 1.0, 'results': {'case': {'relative': 1.0, 'peak_kb': 1000}}}
+    assert compare({'scale': 1.0, 'results': {'case': {'relative': 1.2, 'peak_kb': 1100}}}, baseline) == []
+    assert len(compare({'scale': 1.0, 'results': {'case': {'relative': 2.0, 'peak_kb': 1100}}}, baseline)) == 1
+    assert len(compare({'scale': 1.0, 'results': {'case': {'relative': 1.0, 'peak_kb': 5000}}}, baseline)) == 1
+
+    print("OK 合成语料与基线比较正常")
+
+
+def test_export_stats():
+    """测试导出统计：阶段耗时、跳过原因、带位置的解码错误，且不影响导出结果"""
+    exporter = ChatExporter('claude')
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_file = os.path.join(temp_dir, 'session.jsonl')
+        _write_claude_session(session_file, _sample_records())
+        with open(session_file, 'a', encoding='utf-8') as f:
+            f.write('{"type": "user", "message": {broken\n')
+            f.write('{"type": "user", "message": "not an object"}\n')
+
+        plain_dir = os.path.join(temp_dir, 'plain')
+        stats_dir = os.path.join(temp_dir, 'stats')
+        bulk_export(exporter, [session_file], plain_dir, include_tools=True)
+        stats = ExportStats()
+        summary = bulk_export(exporter, [session_file], stats_dir, include_tools=True, stats=stats)
+        assert _read_exports(plain_dir) == _read_exports(stats_dir), "统计不应改变导出结果"
+
+        data = stats.stop().to_dict()
+        lines = len(_sample_records()) + 2
+        assert data['counters']['files'] == 1
+        assert data['counters']['lines'] == lines
+        assert data['counters']['bytes_read'] == os.path.getsize(session_file)
+        assert data['counters']['messages'] == summary['messages']
+        assert data['counters']['output_bytes'] == summary['bytes']
+        assert data['skipped']['no_marker'] == 1
+        assert data['skipped']['decode_error'] == 1
+        assert data['skipped']['record_error'] == 1
+        assert {'read', 'decode', 'extract', 'render', 'write'} <= set(data['phases'])
+        assert [(e['file'], e['line']) for e in data['errors']] == [(session_file, lines - 1), (session_file, lines)]
+
+        stats_file = os.path.join(temp_dir, 'stats.json')
+        stats.save(stats_file)
+        with open(stats_file, encoding='utf-8') as f:
+            assert json.load(f)['error_count'] == 2
+
+        # JSON 解析器：格式异常的消息计入错误
+        gpt_file = os.path.join(temp_dir, 'gpt.json')
+        with open(gpt_file, 'w', encoding='utf-8') as f:
+            json.dump({'messages': [{'role': 'user', 'content': '你好', 'created': 1767225600},
+                                    {'role': 'user', 'content': 42},
+                                    {'role': 'tool', 'content': '忽略'}]}, f)
+        parser = GPTParser()
+        parser.stats = ExportStats()
+        assert len(parser.parse_session(gpt_file)) == 1
+        assert parser.stats.skipped == {'record_error': 1, 'no_message': 1}
+        assert parser.stats.errors[0]['file'] == gpt_file
+
+    print("OK 导出统计正常")
+
+
+def test_chunk_parallel_parse():
+    """测试单个大会话文件分块并行解析：块在换行边界上，结果与串行解析完全一致"""
+    parser = ClaudeCodeParser()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_file = os.path.join(temp_dir, 'session.jsonl')
+        records = _sample_records() * 20
+        _write_claude_session(session_file, records)
+        # 末尾追加一行坏数据和一行没有换行符的记录
+        with open(session_file, 'a', encoding='utf-8') as f:
+            f.write('{"type": "user", "message": {broken\n')
+            f.write(json.dumps({'type': 'user', 'timestamp': '2026-01-04T00:00:00Z',
+                                'message': {'role': 'user', 'content': '最后一行'}}, ensure_ascii=False))
+
+        with open(session_file, 'rb') as f:
+            data = f.read()
+        chunks = split_chunks(session_file, 1000)
+        assert chunks[0][0] == 0 and chunks[-1][1] == len(data)
+        assert all(prev[1] == cur[0] for prev, cur in zip(chunks, chunks[1:]))
+        assert all(data[end - 1:end] == b'\n' for _, end in chunks[:-1]), "块必须在换行处结束"
+
+        expected = parser.parse_session(session_file, include_tools=True)
+        assert expected[-1]['text'] == '最后一行'
+        for chunk_size in (1, 1000, len(data)):
+            messages = list(parser.iter_messages_parallel(session_file, True, jobs=2, chunk_size=chunk_size))
+            assert messages == expected, f"块大小 {chunk_size} 的并行解析结果与串行不一致"
+
+        # 统计信息（包括错误行号）与串行解析一致
+        parser.stats = ExportStats()
+        parser.parse_session(session_file, include_tools=True)
+        serial = parser.stats.to_dict()
+        parser.stats = ExportStats()
+        list(parser.iter_messages_parallel(session_file, True, jobs=2, chunk_size=1000))
+        parallel = parser.stats.to_dict()
+        assert parallel['counters'] == serial['counters']
+        assert parallel['errors'] == serial['errors'] and serial['errors'][0]['line'] == len(records) + 1
+
+    print("OK 分块并行解析正常")
+
+
+def _chatgpt_node(node_id, parent, role, text, create_time, children=(), **extra):
+    """构造 ChatGPT 数据导出中的一个对话树节点"""
+    message = {'id': node_id, 'author': {'role': role}, 'create_time': create_time,
+               'content': {'content_type': 'text', 'parts': [text]}}
+    message.update(extra)
+    return {'id': node_id, 'parent': parent, 'children': list(children), 'message': message}
+
+
+def test_chatgpt_conversations_export():
+    """测试 ChatGPT conversations.json：只导出当前分支，每个对话一个文件"""
+    base = 1767225600
+    mapping = {
+        'root': {'id': 'root', 'parent': None, 'children': ['sys'], 'message': None},
+        'sys': _chatgpt_node('sys', 'root', 'system', '系统提示', base, ['u1'],
+                             metadata={'is_visually_hidden_from_conversation': True}),
+        'u1': _chatgpt_node('u1', 'sys', 'user', '第一个问题', base + 1, ['a1', 'a1b']),
+        'a1': _chatgpt_node('a1', 'u1', 'assistant', '被重新生成的旧回答', base + 2, ['u2old']),
+        'u2old': _chatgpt_node('u2old', 'a1', 'user', '旧分支上的追问', base + 3),
+        'a1b': _chatgpt_node('a1b', 'u1', 'assistant', 'print(1)', base + 4, ['t1'], recipient='python'),
+        't1': _chatgpt_node('t1', 'a1b', 'tool', '1', base + 5, ['a2']),
+        'a2': _chatgpt_node('a2', 't1', 'assistant', '新的回答', base + 6),
+    }
+    # 很长的一条链，检查没有递归深度限制
+    long_mapping = {'n0': _chatgpt_node('n0', None, 'user', '长对话 0', base, ['n1'])}
+    for i in range(1, 5000):
+        role = 'assistant' if i % 2 else 'user'
+        long_mapping[f'n{i}'] = _chatgpt_node(f'n{i}', f'n{i - 1}', role, f'长对话 {i}', base + i, [f'n{i + 1}'])
+    conversations = [
+        {'title': '分支对话', 'current_node': 'a2', 'mapping': mapping},
+        {'title': '长对话', 'current_node': 'n4999', 'mapping': long_mapping},
+    ]
+
+    parser = GPTParser()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        export_file = os.path.join(temp_dir, 'conversations.json')
+        with open(export_file, 'w', encoding='utf-8') as f:
+            json.dump(conversations, f, ensure_ascii=False)
+
+        assert parser.is_conversation_export(export_file)
+        titles = [(title, [m['text'] for m in messages])
+                  for title, messages in parser.iter_conversations(export_file)]
+        assert titles[0] == ('分支对话', ['第一个问题', '新的回答'])
+        assert len(titles[1][1]) == 5000 and titles[1][1][-1] == '长对话 4999'
+
+        with_tools = [m['text'] for m in parser.parse_session(export_file, include_tools=True)][:4]
+        assert with_tools == ['第一个问题', '[调用工具：python]\n参数：print(1)', '[工具返回结果]\n1', '新的回答']
+
+        output_dir = os.path.join(temp_dir, 'out')
+        summary = bulk_export(ChatExporter('gpt'), [export_file], output_dir)
+        assert summary['exported'] == 1 and summary['messages'] == 5002
+        exports = _read_exports(output_dir)
+        assert len(exports) == 2, "每个对话应导出为一个文件"
+        contents = [''.join(lines) for lines in exports.values()]
+        assert any('- 对话标题：分支对话' in content and '旧分支' not in content for content in contents)
+
+    print("OK ChatGPT 对话树解析正常")
+
+
+def _write_wechat_db(db_path, rows):
+    """生成与微信 PC 版 MSG*.db 相同结构的数据库，rows 为 (CreateTime, StrTalker, IsSender, Type, StrContent)"""
+    import sqlite3
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('CREATE TABLE MSG (localId INTEGER PRIMARY KEY AUTOINCREMENT, TalkerId INT DEFAULT 0, '
+                 'MsgSvrID INT, Type INT, SubType INT DEFAULT 0, IsSender INT, CreateTime INT, '
+                 'Sequence INT DEFAULT 0, StrTalker TEXT, StrContent TEXT, DisplayContent TEXT, '
+                 'CompressContent BLOB, BytesExtra BLOB)')
+    conn.execute('CREATE INDEX MSG_CREATETIME ON MSG (CreateTime)')
+    conn.execute('CREATE INDEX MSG_STRTALKER ON MSG (StrTalker, CreateTime)')
+    conn.executemany('INSERT INTO MSG (MsgSvrID, CreateTime, StrTalker, IsSender, Type, StrContent) '
+                     'VALUES (?, ?, ?, ?, ?, ?)', [(i,) + row for i, row in enumerate(rows)])
+    conn.commit()
+    conn.close()
+
+
+def test_wechat_sqlite_parser():
+    """测试微信数据库解析：只读、键集分页、多个分片按时间归并"""
+    base = 1767225600
+    with tempfile.TemporaryDirectory() as temp_dir:
+        multi_dir = os.path.join(temp_dir, 'wxid_me', 'Msg', 'Multi')
+        os.makedirs(multi_dir)
+        # 两个分片的时间交错，且有大量相同的 CreateTime 跨越分页边界
+        shard0 = [(base + i // 3, 'wxid_friend', i % 2, 1, f'分片0-{i}') for i in range(20)]
+        shard1 = [(base + i, 'wxid_friend', 1, 1, f'分片1-{i}') for i in range(0, 10, 2)]
+        shard1 += [(base + 1, 'group@chatroom', 0, 1, 'wxid_other:\n群消息'),
+                   (base + 2, 'wxid_friend', 0, 3, '<img/>'),
+                   (base + 3, 'wxid_friend', 0, 10000, '对方撤回了一条消息'),
+                   (base + 4, None, 0, 3, '<img/>')]
+        _write_wechat_db(os.path.join(multi_dir, 'MSG0.db'), shard0)
+        _write_wechat_db(os.path.join(multi_dir, 'MSG1.db'), shard1)
+        mtimes = {name: os.stat(os.path.join(multi_dir, name)).st_mtime_ns for name in os.listdir(multi_dir)}
+
+        parser = WeChatParser()
+        parser.base_dir = temp_dir
+        parser.page_size = 4
+        projects = parser.list_sessions()
+        assert [p['name'] for p in projects] == ['wxid_me']
+        session = f'{multi_dir}::wxid_friend'
+        assert projects[0]['sessions'] == [f'{multi_dir}::group@chatroom', session]
+
+        # 按 (CreateTime, 分片, localId) 排序的期望结果
+        expected = sorted([(row[0], 0, i, row) for i, row in enumerate(shard0)] +
+                          [(row[0], 1, i, row) for i, row in enumerate(shard1)])
+        friend = [item[3] for item in expected if item[3][1] == 'wxid_friend' and item[3][3] in (1, 10000)]
+        messages = parser.parse_session(session)
+        assert [m['text'] for m in messages] == [
+            f'[系统消息] {row[4]}' if row[3] == 10000 else row[4] for row in friend]
+        assert messages[0]['role'] == '💬 wxid_friend' and messages[1]['role'] == '🧑 我'
+
+        with_media = parser.parse_session(session, include_media=True)
+        assert '[图片]' in [m['text'] for m in with_media]
+
+        group = parser.parse_session(f'{multi_dir}::group@chatroom')
+        assert [(m['role'], m['text']) for m in group] == [('💬 wxid_other', '群消息')]
+        assert len(parser.parse_session(multi_dir)) == len(friend) + 1
+        # 接受 Path，StrTalker 为 NULL 的消息不会导致出错
+        assert len(parser.parse_session(Path(multi_dir), include_media=True)) == len(friend) + 3
+
+        # 提前关闭读取：后台线程在队列已满时也能退出，不会卡住
+        small_dir = os.path.join(temp_dir, 'small')
+        os.makedirs(small_dir)
+        _write_wechat_db(os.path.join(small_dir, 'MSG0.db'), shard0[:3])
+        parser.page_size = 1
+        rows = parser._iter_shard_rows(os.path.join(small_dir, 'MSG0.db'), 0)
+        next(rows)
+        closer = threading.Thread(target=rows.close, daemon=True)
+        closer.start()
+        closer.join(5)
+        assert not closer.is_alive(), "关闭分片读取时卡住"
+
+        # 只读打开：数据库文件没有被修改，也没有产生日志文件
+        assert {name: os.stat(os.path.join(multi_dir, name)).st_mtime_ns
+                for name in os.listdir(multi_dir)} == mtimes
+
+    print("OK 微信数据库解析正常")
+
+
+def test_time_range_pushdown():
+    """测试时间范围下推：二分定位起点、超过 until 后停止读取，乱序时结果仍然正确"""
+    records = [{"type": "summary", "summary": "示例会话"}]
+    for day in range(1, 31):
+        for hour in range(0, 24, 6):
+            records.append({"type": "user", "timestamp": f"2026-01-{day:02d}T{hour:02d}:00:00.000Z",
+                            "message": {"role": "user", "content": f"1月{day}日 {hour}点"}})
+            records.append({"type": "file-history-snapshot", "snapshot": {"timestamp": "2020-01-01T00:00:00Z"}})
+
+    def expected(messages, since, until):
+        return [m for m in messages if (not since or m['time'][:len(since)] >= since)
+                and (not until or m['time'][:len(until)] <= until)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, 'projects', '-work')
+        os.makedirs(project_dir)
+        parser = ClaudeCodeParser(index_path=os.path.join(temp_dir, 'index.sqlite'))
+        parser.base_dir = temp_dir
+        ordered_file = _write_claude_session(os.path.join(project_dir, 'ordered.jsonl'), records)
+        shuffled = records[:1] + records[1:][::-1]
+        shuffled_file = _write_claude_session(os.path.join(project_dir, 'shuffled.jsonl'), shuffled)
+        # 只有开头附近的一条记录乱序：抽样看不出来，二分定位会漏掉它
+        early = {"type": "user", "timestamp": "2026-01-15T00:30:00.000Z",
+                 "message": {"role": "user", "content": "提前写入的记录"}}
+        early_file = _write_claude_session(os.path.join(project_dir, 'early.jsonl'), records[:3] + [early] + records[3:])
+
+        # 第一轮没有索引信息，全部线性扫描；第二轮索引确认了有序的会话，只有它二分定位
+        for indexed in (False, True):
+            if indexed:
+                parser.list_sessions()
+                assert set(parser.ordered_sessions) == {ordered_file}
+            for session_file in (ordered_file, shuffled_file, early_file):
+                messages = parser.parse_session(session_file)
+                for since, until in [('2026-01-10', '2026-01-12'), ('2026-01-10T06', '2026-01-10T12'),
+                                     ('2026-01-15', '2026-01-15'), (None, '2026-01-02'), ('2026-01-30', None),
+                                     ('2027', None), (None, '2025')]:
+                    assert list(parser.iter_messages_between(session_file, since, until)) == \
+                        expected(messages, since, until), (session_file, since, until)
+        assert len(list(parser.iter_messages_between(early_file, '2026-01-15', '2026-01-15'))) == 5
+
+        # 有序文件只读取范围附近的行
+        parser.stats = ExportStats()
+        assert len(list(parser.iter_messages_between(ordered_file, '2026-01-29', '2026-01-29'))) == 4
+        assert parser.stats.counters['lines'] <= 10
+        parser.stats = None
+
+        # 追加了更早的记录后，索引不再认为它有序
+        with open(ordered_file, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(early, ensure_ascii=False) + '\n')
+        assert not parser._known_ordered(ordered_file), "文件变化后不能沿用之前的结论"
+        parser.list_sessions()
+        assert parser.ordered_sessions == {}
+        assert len(list(parser.iter_messages_between(ordered_file, '2026-01-15', '2026-01-15'))) == 5
+        parser.index.close()
+
+        # 导出器：Claude Code 使用下推，其他应用逐条过滤
+        exporter = ChatExporter('claude')
+        exporter.set_time_range('2026-01-05', '2026-01-05')
+        output_file = exporter.export_session(ordered_file, os.path.join(temp_dir, 'out'))
+        with open(output_file, encoding='utf-8') as f:
+            assert '- 消息数量：4 条' in f.read()
+
+        gpt_file = os.path.join(temp_dir, 'gpt.json')
+        with open(gpt_file, 'w', encoding='utf-8') as f:
+            json.dump({'messages': [{'role': 'user', 'content': day, 'timestamp': f'2026-01-{day}T00:00:00'}
+                                    for day in ('01', '02', '03')]}, f)
+        gpt = ChatExporter('gpt')
+        gpt.set_time_range('2026-01-02', None)
+        assert [m['text'] for m in gpt.iter_messages(gpt_file)] == ['02', '03']
+
+    print("OK 时间范围下推正常")
+
+
+def test_lazy_parser_registry():
+    """测试解析器注册表：按名称延迟解析、"模块:类名" 插件、未知应用报错，以及 export_chat.py 复用核心实现"""
+    import subprocess
+    from scripts import export_chat
+
+    assert PARSERS['claude'][0] == 'ClaudeCodeParser' or PARSERS['claude'][0] is ClaudeCodeParser
+    assert load_parser_class('Claude') is ClaudeCodeParser
+    assert PARSERS['claude'] == (ClaudeCodeParser, 'Claude Code')
+
+    register_parser('gpt-copy', 'scripts.universal_export:GPTParser', 'GPT 副本')
+    try:
+        exporter = ChatExporter('gpt-copy')
+        assert isinstance(exporter.parser, GPTParser)
+        assert exporter.get_chat_app_name() == 'GPT 副本'
+    finally:
+        del PARSERS['gpt-copy']
+
+    try:
+        ChatExporter('no-such-app')
+        assert False, '未知应用应当报错'
+    except ValueError:
+        pass
+
+    # export_chat.py 与 universal_export.py 的 Claude Code 解析结果一致
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_file = _write_claude_session(os.path.join(temp_dir, 'session.jsonl'), _sample_records())
+        assert export_chat.parse_session(session_file, include_tools=True) == \
+            ClaudeCodeParser().parse_session(session_file, include_tools=True)
+
+        script = os.path.join(os.path.dirname(__file__), '..', 'scripts', 'export_chat.py')
+        output_dir = os.path.join(temp_dir, 'out')
+        subprocess.run([sys.executable, script, session_file, output_dir], check=True, capture_output=True)
+        (output_file,) = os.listdir(output_dir)
+        with open(os.path.join(output_dir, output_file), encoding='utf-8') as f:
+            assert '问题已修复。' in f.read()
+
+    print("OK 解析器注册表正常")
+
+
+def test_pipeline_export():
+    """测试流水线导出：在途字节数很小时也能完成，结果、落盘顺序和统计与批量导出一致"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_files = []
+        for i in range(6):
+            records = _sample_records()
+            records[1]['message']['content'] = f'第 {i} 个会话'
+            records[4]['message']['content'][0]['text'] = '回复' * (i * 200 + 1)
+            session_files.append(_write_claude_session(os.path.join(temp_dir, f'{i}.jsonl'), records))
+        duplicate = _sample_records()[:2]
+        duplicate[1]['message']['content'] = '第 0 个会话'
+        session_files.append(_write_claude_session(os.path.join(temp_dir, 'dup.jsonl'), duplicate))
+        session_files.append(_write_claude_session(os.path.join(temp_dir, 'empty.jsonl'), _sample_records()[:1]))
+        session_files.append(os.path.join(temp_dir, 'missing.jsonl'))
+
+        exporter = ChatExporter("claude")
+        bulk_stats, pipeline_stats = ExportStats(), ExportStats()
+        bulk = bulk_export(exporter, session_files, os.path.join(temp_dir, 'bulk'), include_tools=True,
+                           stats=bulk_stats)
+        pipeline = pipeline_export(exporter, session_files, os.path.join(temp_dir, 'pipeline'), include_tools=True,
+                                   io_threads=3, max_inflight=1024, stats=pipeline_stats)
+        assert _read_exports(os.path.join(temp_dir, 'bulk')) == _read_exports(os.path.join(temp_dir, 'pipeline'))
+        for key in ('total', 'exported', 'empty', 'failed', 'messages', 'bytes'):
+            assert bulk[key] == pipeline[key], key
+        assert pipeline['failed'] == 1 and pipeline['errors'][0][0].endswith('missing.jsonl')
+        assert bulk_stats.counters == pipeline_stats.counters
+        assert bulk_stats.skipped == pipeline_stats.skipped
+        assert exporter.stats is None
+
+        # 多对话文件（ChatGPT 数据导出）每个对话一个文件
+        conversations = [{'title': f'对话{i}', 'current_node': 'b', 'mapping': {
+            'a': {'parent': None, 'message': {'author': {'role': 'user'}, 'create_time': 1767225600 + i,
+                                              'content': {'parts': [f'问题 {i}']}}},
+            'b': {'parent': 'a', 'message': {'author': {'role': 'assistant'}, 'create_time': 1767225601 + i,
+                                             'content': {'parts': [f'回答 {i}']}}}}} for i in range(3)]
+        gpt_file = os.path.join(temp_dir, 'conversations.json')
+        with open(gpt_file, 'w', encoding='utf-8') as f:
+            json.dump(conversations, f, ensure_ascii=False)
+        gpt = ChatExporter('gpt')
+        bulk_export(gpt, [gpt_file], os.path.join(temp_dir, 'gpt-bulk'))
+        summary = pipeline_export(gpt, [gpt_file], os.path.join(temp_dir, 'gpt-pipeline'))
+        assert summary['messages'] == 6
+        assert _read_exports(os.path.join(temp_dir, 'gpt-bulk')) == _read_exports(os.path.join(temp_dir, 'gpt-pipeline'))
+        assert not [name for name in os.listdir(os.path.join(temp_dir, 'gpt-pipeline')) if name.startswith('.')]
+
+    print("OK 流水线导出与批量导出结果一致")
+
+
+def test_record_writers():
+    """测试机器可读导出：JSONL / SQLite 的列、行数和工具名，与逐会话解析的结果一致"""
+    import sqlite3
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, 'projects', '-work-demo')
+        os.makedirs(project_dir)
+        session_files = []
+        for i in range(3):
+            records = _sample_records()
+            records[1]['message']['content'] = f'第 {i} 个会话'
+            session_files.append(_write_claude_session(os.path.join(project_dir, f'session-{i}.jsonl'), records))
+        session_files.append(_write_claude_session(os.path.join(project_dir, 'empty.jsonl'), _sample_records()[:1]))
+
+        exporter = ChatExporter('claude')
+        expected = [m for path in session_files for m in exporter.parse_session(path, include_tools=True)]
+
+        output_dir = os.path.join(temp_dir, 'out')
+        summary = bulk_export_records(exporter, session_files, output_dir, 'jsonl', include_tools=True)
+        assert (summary['exported'], summary['empty'], summary['messages']) == (3, 1, len(expected))
+        with open(summary['output'], encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+        assert [row['text'] for row in rows] == [m['text'] for m in expected]
+        assert all(list(row) == list(RECORD_COLUMNS) for row in rows)
+        assert rows[0]['session'] == 'session-0' and rows[0]['project'] == 'work/demo'
+        assert rows[1]['tool'] == 'Read' and rows[0]['tool'] == ''
+        assert rows[0]['text_bytes'] == len(rows[0]['text'].encode('utf-8'))
+        assert rows[0]['source_bytes'] == os.path.getsize(session_files[0])
+        assert rows[0]['conversation'] == '' and rows[0]['title'] == ''
+
+        # 多对话文件：conversation 列是对话ID，title 列是对话标题
+        gpt_file = os.path.join(temp_dir, 'conversations.json')
+        with open(gpt_file, 'w', encoding='utf-8') as f:
+            json.dump([{'id': f'conv-{i}', 'title': f'对话{i}', 'current_node': 'a', 'mapping': {'a': {'parent': None, 'message': {
+                'author': {'role': 'user'}, 'content': {'parts': [f'问题 {i}']}}}}} for i in range(2)], f,
+                ensure_ascii=False)
+        summary = bulk_export_records(ChatExporter('gpt'), [gpt_file], os.path.join(temp_dir, 'gpt'), 'jsonl')
+        with open(summary['output'], encoding='utf-8') as f:
+            assert [(row['conversation'], row['title']) for row in map(json.loads, f)] == \
+                [('conv-0', '对话0'), ('conv-1', '对话1')]
+
+        stats = ExportStats()
+        summary = bulk_export_records(exporter, session_files, output_dir, 'sqlite', include_tools=True, stats=stats)
+        assert stats.counters['messages'] == len(expected)
+        conn = sqlite3.connect(summary['output'])
+        try:
+            assert conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0] == len(expected)
+            assert conn.execute('SELECT tool, COUNT(*) FROM messages WHERE tool != "" GROUP BY tool').fetchall() == \
+                [('Read', 3)]
+            assert [row[1] for row in conn.execute('PRAGMA table_info(messages)')] == list(RECORD_COLUMNS)
+        finally:
+            conn.close()
+
+        # 没有 pyarrow 时 Parquet 报错且不留下临时文件
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            before = sorted(os.listdir(output_dir))
+            try:
+                bulk_export_records(exporter, session_files, output_dir, 'parquet')
+                assert False, '缺少 pyarrow 时应当报错'
+            except ImportError:
+                pass
+            assert sorted(os.listdir(output_dir)) == before
+        else:
+            summary = bulk_export_records(exporter, session_files, output_dir, 'parquet', include_tools=True)
+            import pyarrow.parquet
+            assert pyarrow.parquet.read_table(summary['output']).column('text').to_pylist() == \
+                [m['text'] for m in expected]
+
+        try:
+            load_writer_class('xml')
+            assert False, '未知格式应当报错'
+        except ValueError:
+            pass
+
+    print("OK 机器可读导出正常")
+
+
+def test_compressed_sessions():
+    """测试压缩的会话：发现、流式解析、增量导出与未压缩一致，导出文件可以压缩"""
+    import gzip
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, 'projects', '-work-demo')
+        os.makedirs(project_dir)
+        plain = _write_claude_session(os.path.join(project_dir, 'plain.jsonl'), _sample_records())
+        with open(plain, 'rb') as src, gzip.open(os.path.join(project_dir, 'archived.jsonl.gz'), 'wb') as dst:
+            dst.write(src.read())
+        archived = os.path.join(project_dir, 'archived.jsonl.gz')
+
+        parser = ClaudeCodeParser()
+        parser.base_dir = temp_dir
+        (project,) = parser.list_sessions()
+        assert sorted(os.path.basename(f) for f in project['sessions']) == ['archived.jsonl.gz', 'plain.jsonl']
+        expected = parser.parse_session(plain, include_tools=True)
+        assert parser.parse_session(archived, include_tools=True) == expected
+        assert list(parser.iter_messages_between(archived, '2026-01-03')) == expected[-1:]
+        assert parser.describe_session(archived)['session'] == 'archived'
+
+        # 压缩输出：Markdown 与未压缩导出的内容一致
+        exporter = ChatExporter('claude')
+        exporter.compress = '.gz'
+        output = exporter.export_session(archived, os.path.join(temp_dir, 'gz'), include_tools=True)
+        assert output.endswith('.md.gz')
+        exporter.compress = ''
+        plain_output = exporter.export_session(plain, os.path.join(temp_dir, 'md'), include_tools=True)
+        with gzip.open(output, 'rt', encoding='utf-8') as f, open(plain_output, encoding='utf-8') as g:
+            assert [l for l in f if '导出时间' not in l] == [l for l in g if '导出时间' not in l]
+
+        # 增量导出：压缩的会话变化后整体重新导出
+        exporter.compress = '.gz'
+        manifest = ExportManifest.for_output_dir(os.path.join(temp_dir, 'inc'))
+        first = bulk_export(exporter, [archived], os.path.join(temp_dir, 'inc'), manifest=manifest)
+        with gzip.open(archived, 'ab') as f:
+            f.write((json.dumps({"type": "user", "timestamp": "2026-01-04T00:00:00.000Z",
+                                 "message": {"role": "user", "content": "新的一条"}}, ensure_ascii=False) + '\n').encode())
+        second = bulk_export(exporter, [archived], os.path.join(temp_dir, 'inc'), manifest=manifest)
+        assert (first['exported'], second['exported'], second['messages']) == (1, 1, first['messages'] + 1)
+
+        summary = bulk_export_records(exporter, [archived], os.path.join(temp_dir, 'records'), 'jsonl')
+        assert summary['output'].endswith('_messages.jsonl.gz')
+        with gzip.open(summary['output'], 'rt', encoding='utf-8') as f:
+            assert len(f.readlines()) == summary['messages']
+
+        summary = pipeline_export(exporter, [archived, plain], os.path.join(temp_dir, 'pipeline'), max_inflight=64)
+        assert summary['exported'] == 2 and summary['failed'] == 0
+
+        # zstd：可用时与 gzip 一致，不可用时给出安装提示
+        zst = archived[:-3] + '.zst'
+        try:
+            with open(plain, 'rb') as src, open_compressed(zst, '.zst', 'wb') as dst:
+                dst.write(src.read())
+        except ImportError as e:
+            assert 'zstandard' in str(e)
+        else:
+            assert parser.parse_session(zst, include_tools=True) == expected
+
+    print("OK 压缩会话解析与压缩导出正常")
+
+
+def test_tool_blob_dedup():
+    """测试工具内容去重：相同的大段工具内容只保存一次，Markdown 链接到完整内容，并行导出结果一致"""
+    big_result = '\n'.join(f'{n:5d}\tdef function_{n}(): return {n}' for n in range(400))
+    big_input = {'file_path': '/src/a.py', 'content': 'x = 1\n' * 200}
+
+    def session(i):
+        records = _sample_records()
+        records[1]['message']['content'] = f'第 {i} 个会话'
+        records[2]['message']['content'][0]['input'] = big_input
+        records[3]['message']['content'][0]['content'] = big_result
+        return records
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session_files = [_write_claude_session(os.path.join(temp_dir, f'{i}.jsonl'), session(i)) for i in range(4)]
+
+        plain = ChatExporter('claude')
+        bulk_export(plain, session_files, os.path.join(temp_dir, 'plain'), include_tools=True)
+
+        output_dir = os.path.join(temp_dir, 'dedup')
+        exporter = ChatExporter('claude')
+        exporter.set_blob_store(BlobStore(output_dir))
+        stats = ExportStats()
+        summary = bulk_export(exporter, session_files, output_dir, include_tools=True, stats=stats)
+        assert summary['exported'] == 4
+
+        blobs = sorted(os.path.join(root, name) for root, _, names in os.walk(os.path.join(output_dir, '_blobs'))
+                       for name in names)
+        assert sorted(os.path.splitext(path)[1] for path in blobs) == ['.json', '.txt']
+        contents = set()
+        for path in blobs:
+            with open(path, encoding='utf-8') as f:
+                contents.add(f.read())
+        assert big_result.strip() in contents and json.dumps(big_input, ensure_ascii=False) in contents
+        assert (stats.counters['blobs_written'], stats.counters['blobs_reused']) == (2, 6)
+
+        exported = _read_exports(output_dir)
+        for lines in exported.values():
+            text = ''.join(lines)
+            links = [line for line in lines if '](_blobs/' in line]
+            assert len(links) == 2 and '已截断' not in text
+            for line in links:
+                assert os.path.exists(os.path.join(output_dir, line.split('](')[1].rstrip(')\n')))
+        dedup_size = sum(len(''.join(lines)) for lines in exported.values())
+        plain_size = sum(len(''.join(lines)) for lines in _read_exports(os.path.join(temp_dir, 'plain')).values())
+        assert dedup_size < plain_size
+
+        # 并行导出（多个进程写同一个内容）结果一致
+        parallel_dir = os.path.join(temp_dir, 'parallel')
+        exporter.set_blob_store(BlobStore(parallel_dir))
+        bulk_export(exporter, session_files, parallel_dir, include_tools=True, jobs=2)
+        assert _read_exports(parallel_dir) == exported
+
+        # 大会话分块并行解析时，工作进程同样把大段工具内容链接到 _blobs/
+        chunked_dir = os.path.join(temp_dir, 'chunked')
+        parser = ClaudeCodeParser()
+        parser.blob_store = BlobStore(chunked_dir)
+        serial = parser.parse_session(session_files[0], include_tools=True)
+        assert list(parser.iter_messages_parallel(session_files[0], True, jobs=2, chunk_size=1)) == serial
+        assert sum('](_blobs/' in msg['text'] for msg in serial) == 2
+
+    print("OK 工具内容去重正常")
+
+
+def test_watch_sessions():
+    """测试 watch 模式：追加的完整行实时导出，未写完的末行等到写完再导出，新项目自动加入监视"""
+    def line(text, minute):
+        return json.dumps({"type": "user", "timestamp": f"2026-01-06T10:{minute:02d}:00.000Z",
+                           "message": {"role": "user", "content": text}}, ensure_ascii=False) + '\n'
+
+    for polling in (False, True):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            project_dir = os.path.join(temp_dir, 'projects', '-work-demo')
+            os.makedirs(project_dir)
+            session_file = _write_claude_session(os.path.join(project_dir, 'live.jsonl'), _sample_records())
+            output_dir = os.path.join(temp_dir, 'out')
+
+            exporter = ChatExporter('claude')
+            exporter.parser.base_dir = temp_dir
+            watcher = make_watcher(os.path.join(temp_dir, 'projects'), polling)
+            assert isinstance(watcher, PollingWatcher) == (polling or not sys.platform.startswith('linux'))
+
+            def exported():
+                return ''.join(''.join(lines) for lines in _read_exports(output_dir).values())
+
+            partial = line('写了一半的消息', 2)
+
+            def step_append():
+                assert '你好，帮我看看这个报错' in exported()
+                with open(session_file, 'a', encoding='utf-8') as f:
+                    f.write(line('新的问题', 1) + partial[:20])
+
+            def step_finish_line():
+                assert '新的问题' in exported() and '写了一半' not in exported()
+                with open(session_file, 'a', encoding='utf-8') as f:
+                    f.write(partial[20:])
+
+            def step_new_project():
+                assert '写了一半的消息' in exported()
+                new_dir = os.path.join(temp_dir, 'projects', '-work-other')
+                os.makedirs(new_dir)
+                with open(os.path.join(new_dir, 'new.jsonl'), 'w', encoding='utf-8') as f:
+                    f.write(line('另一个项目', 3))
+
+            def step_done():
+                assert '另一个项目' in exported()
+
+            steps = [step_append, step_finish_line, step_new_project, step_done]
+
+            def stop():
+                steps.pop(0)()
+                return not steps
+
+            try:
+                manifest = watch_sessions(exporter, output_dir, watcher, latency=0.05, stop=stop)
+            finally:
+                watcher.close()
+            assert len(manifest.sessions) == 2
+            assert exported().count('写了一半的消息') == 1
+
+    print("OK watch 模式正常")
+
+
+def test_skip_unchanged_exports():
+    """测试导出文件名按会话区分，重新导出未变化的会话不产生任何写入，变化的会话与完整导出一致"""
+    from scripts.universal_export import MarkdownWriter
+
+    exporter = ChatExporter("claude")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # 两个会话同一天、以同样的提问开头
+        first = _write_claude_session(os.path.join(temp_dir, 'aaaa.jsonl'), _sample_records())
+        second = _write_claude_session(os.path.join(temp_dir, 'bbbb.jsonl'), _sample_records()[:2])
+        output_dir = os.path.join(temp_dir, 'out')
+        summary = bulk_export(exporter, [first, second], output_dir, include_tools=True)
+        names = sorted(os.listdir(output_dir))
+        assert names == ['2026-01-02_你好，帮我看看这个报错_aaaa.md', '2026-01-02_你好，帮我看看这个报错_bbbb.md']
+        assert summary['exported'] == 2
+        before = {name: os.stat(os.path.join(output_dir, name)) for name in names}
+
+        opened = []
+        open_body = MarkdownWriter._open_body
+        MarkdownWriter._open_body = lambda self: opened.append(self) or open_body(self)
+        try:
+            # 未变化：串行、并行、流水线导出都不写正文临时文件，也不替换已有文件
+            for run in (lambda: bulk_export(exporter, [first, second], output_dir, include_tools=True),
+                        lambda: bulk_export(exporter, [first, second], output_dir, include_tools=True, jobs=2),
+                        lambda: pipeline_export(exporter, [first, second], output_dir, include_tools=True)):
+                summary = run()
+                assert summary['unchanged'] == 2 and summary['exported'] == 0 and summary['bytes'] == 0
+            assert exporter.export_session(first, output_dir, include_tools=True).endswith('_aaaa.md')
+            assert not opened
+            for name in names:
+                st = os.stat(os.path.join(output_dir, name))
+                assert (st.st_ino, st.st_mtime_ns) == (before[name].st_ino, before[name].st_mtime_ns)
+            assert sorted(os.listdir(output_dir)) == names
+
+            # 中间的消息变化、末尾追加消息：只重写变化的会话，内容与全新导出一致
+            records = _sample_records()
+            records[4]['message']['content'][0]['text'] = '修改后的回复'
+            _write_claude_session(first, records)
+            _write_claude_session(second, _sample_records()[:2] + _sample_records()[4:5])
+            stats = ExportStats()
+            summary = bulk_export(exporter, [first, second], output_dir, include_tools=True, stats=stats)
+            assert summary['exported'] == 2 and len(opened) == 2
+        finally:
+            MarkdownWriter._open_body = open_body
+        fresh_dir = os.path.join(temp_dir, 'fresh')
+        bulk_export(exporter, [first, second], fresh_dir, include_tools=True)
+        assert _read_exports(output_dir) == _read_exports(fresh_dir)
+
+        # 目标文件比新内容长（会话被截短）时也要重写
+        _write_claude_session(second, _sample_records()[:2])
+        exporter.set_stats(stats)
+        exporter.export_session(second, output_dir, include_tools=True)
+        exporter.set_stats(None)
+        exporter.export_session(second, fresh_dir, include_tools=True)
+        assert _read_exports(output_dir) == _read_exports(fresh_dir)
+        assert stats.counters.get('unchanged_outputs', 0) == 0
+
+    print("OK 文件名按会话区分，未变化的会话不重写")
+
+
+def test_bounded_tool_rendering():
+    """测试工具参数和返回结果只渲染到截断位置，结果与完整序列化后截断一致，并支持按工具设置上限"""
+    from scripts.universal_export import bounded_json, parse_tool_limit
+
+    value = {'file_path': '/tmp/a.py', 'content': '第一行\n"引号"\\' * 1000, 'n': [1, 2.5, None, True], 3: {}}
+    for size in (0, 1, 10, 201, 100000):
+        assert bounded_json(value, size) == json.dumps(value, ensure_ascii=False)[:size]
+
+    parser = ClaudeCodeParser()
+    write = {'type': 'tool_use', 'id': 'w', 'name': 'Write', 'input': value}
+    bash = {'type': 'tool_use', 'id': 'b', 'name': 'Bash', 'input': {'command': 'ls'}}
+    output = {'type': 'tool_result', 'tool_use_id': 'b', 'content': [{'type': 'text', 'text': '  输出\n' * 50000}]}
+    full_input = json.dumps(value, ensure_ascii=False)
+    assert parser._extract_text([write]) == f'[调用工具：Write]\n参数：{full_input[:200]}...'
+    full_output = ('  输出\n' * 50000).strip()
+    assert parser._extract_text([output]) == f'[工具返回结果]\n{full_output[:500]}\n...(已截断)'
+    assert parser._extract_text([{'type': 'tool_result', 'content': ' 短结果 '}]) == '[工具返回结果]\n短结果'
+
+    # 按工具设置上限：Bash 的返回结果按调用时的工具名截断，其余工具的参数上限由 * 覆盖
+    assert parse_tool_limit('Bash=,20') == ('Bash', (None, 20))
+    assert parse_tool_limit('*=50') == ('*', (50, None))
+    exporter = ChatExporter("claude")
+    exporter.set_tool_limits(dict([parse_tool_limit('Bash=,20'), parse_tool_limit('*=50')]))
+    assert exporter.parser._extract_text([write]) == f'[调用工具：Write]\n参数：{full_input[:50]}...'
+    assert exporter.parser._extract_text([bash, output]) == (f'[调用工具：Bash]\n参数：{{"command": "ls"}}\n\n'
+                                                             f'[工具返回结果]\n{full_output[:20]}\n...(已截断)')
+    assert exporter.parser._extract_text([output]) == f'[工具返回结果]\n{full_output[:500]}\n...(已截断)'
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        records = _sample_records()
+        records[2]['message']['content'] = [bash]
+        records[3]['message']['content'] = [output]
+        session_file = _write_claude_session(os.path.join(temp_dir, 's.jsonl'), records)
+        # 并行批量导出的工作进程使用同样的上限
+        bulk_export(exporter, [session_file], os.path.join(temp_dir, 'out'), include_tools=True, jobs=2)
+        content = ''.join(next(iter(_read_exports(os.path.join(temp_dir, 'out')).values())))
+        assert f'[工具返回结果]\n{full_output[:20]}\n...(已截断)' in content
+        # 工具调用和返回结果落在不同的块中时，分块并行解析与串行一致
+        serial = exporter.parser.parse_session(session_file, include_tools=True)
+        assert list(exporter.parser.iter_messages_parallel(session_file, True, jobs=2, chunk_size=1)) == serial
+        # 每个文件重新记录工具调用，没有返回结果的调用不会累积
+        exporter.parser._pending_tools = {'stale': 'Bash'}
+        exporter.parser.parse_session(session_file, include_tools=True)
+        assert not exporter.parser._pending_tools
+        exporter.set_tool_limits(None)
+        assert exporter.parser.tool_limits is None
+
+    print("OK 工具内容按上限渲染，与完整序列化后截断一致")
+
+
+def test_message_dedup_and_active_branch():
+    """测试跨会话消息去重与当前分支选择：回退后的旧分支不导出，续接会话沿用的历史只导出一次"""
+    def record(uuid, parent, role, text, minute, **extra):
+        content = text if role == 'user' else [{"type": "text", "text": text}]
+        return dict({"type": role, "uuid": uuid, "parentUuid": parent, "isSidechain": False,
+                     "timestamp": f"2026-01-02T08:{minute:02d}:00.000Z",
+                     "message": {"role": role, "content": content}}, **extra)
+
+    original = [
+        {"type": "summary", "summary": "示例会话", "leafUuid": "u4"},
+        record('u1', None, 'user', '第一个问题', 0),
+        record('u2', 'u1', 'assistant', '第一个回答', 1),
+        record('u3', 'u2', 'user', '被回退的问题', 2),
+        record('u4', 'u3', 'assistant', '被回退的回答', 3),
+        # 回退到 u2 之后重新提问
+        record('v3', 'u2', 'user', '重新提问', 4),
+        record('side', 'v3', 'user', '子代理的消息', 5, isSidechain=True),
+        # 压缩边界：parentUuid 为 null，由 logicalParentUuid 接上
+        {"type": "system", "subtype": "compact_boundary", "uuid": "c1", "parentUuid": None,
+         "logicalParentUuid": "v3", "isSidechain": False},
+        # 嵌套对象中也有 uuid 键：退回完整解码
+        record('v4', 'c1', 'assistant', '压缩后的回答', 6,
+               toolUseResult={"uuid": "nested", "parentUuid": "u3"}),
+    ]
+    resumed = original[1:3] + original[5:6] + original[7:] + [
+        record('w1', 'v4', 'user', '续接后的问题', 7),
+        record('w2', 'w1', 'assistant', '续接后的回答', 8),
+    ]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        first = _write_claude_session(os.path.join(temp_dir, 'first.jsonl'), original)
+        second = _write_claude_session(os.path.join(temp_dir, 'second.jsonl'), resumed)
+        os.utime(first, (1000, 1000))
+        parser = ClaudeCodeParser()
+        assert parser.active_branch(first) == {'u1', 'u2', 'v3', 'c1', 'v4'}
+        assert parser.active_branch(second) is None
+
+        exporter = ChatExporter("claude")
+        texts = [m['text'] for m in exporter.iter_messages(first)]
+        assert '被回退的问题' in texts, "未启用时导出全部消息"
+
+        for seen in (MessageSet(), BloomFilter(1024)):
+            exporter.set_message_dedup(seen)
+            stats = ExportStats()
+            output_dir = os.path.join(temp_dir, type(seen).__name__)
+            # 续接的会话排在前面也按修改时间从旧到新处理
+            summary = bulk_export(exporter, [second, first], output_dir, jobs=4, stats=stats)
+            assert summary['exported'] == 2 and summary['messages'] == 7
+            exports = _read_exports(output_dir)
+            first_out = ''.join(exports[next(name for name in exports if name.endswith('_first.md'))])
+            second_out = ''.join(exports[next(name for name in exports if name.endswith('_second.md'))])
+            for text in ('第一个问题', '第一个回答', '重新提问', '子代理的消息', '压缩后的回答'):
+                assert text in first_out and text not in second_out, text
+            assert '被回退' not in first_out
+            assert '续接后的问题' in second_out and '续接后的回答' in second_out
+            assert stats.skipped['inactive_branch'] == 2
+            assert stats.skipped['duplicate_message'] == 4
+            assert len(seen) == 7
+        exporter.set_message_dedup(None)
+
+    # 只有部分位不同的 uuid 也不能互相冲突
+    for seen in (MessageSet(), BloomFilter(64 * 1024)):
+        ids = [f'{i:08d}-0000-4000-8000-000000000000' for i in range(2000)]
+        assert all(seen.add(uuid) for uuid in ids)
+        assert not any(seen.add(uuid) for uuid in ids)
+
+    print("OK 跨会话消息去重，只导出当前分支")
+
+
+def test_project_timeline():
+    """测试项目时间线：多个会话和子代理按时间归并，每个会话最多一条待合并消息，按天分文件"""
+    def turn(day, hour, text):
+        return {"type": "user", "timestamp": f"2026-01-{day:02d}T{hour:02d}:00:00.000Z",
+                "message": {"role": "user", "content": text}}
+
+    session_a = '11111111-aaaa-4aaa-8aaa-aaaaaaaaaaaa'
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, '-work-demo')
+        os.makedirs(os.path.join(project_dir, session_a, 'subagents'))
+        _write_claude_session(os.path.join(project_dir, f'{session_a}.jsonl'),
+                              [turn(1, 8, 'A1'), turn(1, 12, 'A2'), turn(2, 9, 'A3')])
+        _write_claude_session(os.path.join(project_dir, 'second.jsonl'),
+                              [turn(1, 9, 'B1'), turn(1, 12, 'B2'), turn(2, 10, 'B3')])
+        _write_claude_session(os.path.join(project_dir, session_a, 'subagents', 'agent-1.jsonl'),
+                              [turn(1, 10, 'S1'), turn(2, 8, 'S2')])
+        project = {'name': '/work/demo', 'path': project_dir,
+                   'sessions': sorted(os.path.join(project_dir, name) for name in os.listdir(project_dir)
+                                      if name.endswith('.jsonl'))}
+        files = timeline_session_files(project)
+        assert len(files) == 3 and files[-1].endswith('agent-1.jsonl')
+
+        exporter = ChatExporter("claude")
+        merged = [(label, msg['text']) for label, msg in iter_timeline(exporter, files)]
+        assert merged == [('11111111', 'A1'), ('second', 'B1'), ('agent-1', 'S1'), ('11111111', 'A2'),
+                          ('second', 'B2'), ('agent-1', 'S2'), ('11111111', 'A3'), ('second', 'B3')]
+        # 会话数超过同时打开的上限时分组归并，结果相同
+        assert [(label, msg['text']) for label, msg in iter_timeline(exporter, files, max_open=2)] == merged
+
+        output_dir = os.path.join(temp_dir, 'out')
+        outputs = export_timeline(exporter, project['name'], files, output_dir)
+        key = hashlib.sha1(b'/work/demo').hexdigest()[:8]
+        assert [(os.path.basename(path), count) for path, count in outputs] == [(f'demo_2026-01-01_{key}.md', 5),
+                                                                                 (f'demo_2026-01-02_{key}.md', 3)]
+        with open(outputs[0][0], encoding='utf-8') as f:
+            content = f.read()
+        assert '- 项目：/work/demo' in content and '## 🧑 用户 · agent-1 10:00' in content
+        assert content.index('A1') < content.index('B1') < content.index('S1') < content.index('A2')
+
+        outputs = export_timeline(exporter, project['name'], files, output_dir, by_day=False)
+        assert [(os.path.basename(path), count) for path, count in outputs] == [(f'demo_时间线_{key}.md', 8)]
+
+        # 不同目录下的同名项目不会互相覆盖
+        other = export_timeline(exporter, '/other/demo', files[:1], output_dir, by_day=False)
+        assert other[0][0] != outputs[0][0] and os.path.basename(other[0][0]).startswith('demo_时间线_')
+        with open(outputs[0][0], encoding='utf-8') as f:
+            assert '- 项目：/work/demo' in f.read()
+
+    print("OK 项目时间线按时间归并")
+
+
+def test_usage_stats():
+    """测试用量统计：按 message.id 去重 token，增量刷新，续接会话不重复计算，输出 CSV / JSON 表"""
+    def user(time, content):
+        return {"type": "user", "timestamp": time, "message": {"role": "user", "content": content}}
+
+    def reply(time, message_id, content, model="claude-sonnet-4", output=10):
+        return {"type": "assistant", "timestamp": time,
+                "message": {"id": message_id, "role": "assistant", "model": model, "content": content,
+                            "usage": {"input_tokens": 100, "output_tokens": output,
+                                      "cache_creation_input_tokens": 5, "cache_read_input_tokens": 1000}}}
+
+    history = [
+        user("2026-01-01T10:00:00Z", "帮我修一下测试"),
+        # 同一个 API 响应拆成两条记录，用量只计一次
+        reply("2026-01-01T10:00:05Z", "msg_1", [{"type": "text", "text": "我先看看"}]),
+        reply("2026-01-01T10:00:06Z", "msg_1", [{"type": "tool_use", "id": "tu_1", "name": "Bash", "input": {}}]),
+        user("2026-01-01T10:00:07Z", [{"type": "tool_result", "tool_use_id": "tu_1", "content": "ok"}]),
+        reply("2026-01-01T10:30:00Z", "msg_2", [{"type": "text", "text": "修好了"}], output=20),
+    ]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        project_dir = os.path.join(temp_dir, 'projects', '-work-demo')
+        first = os.path.join(project_dir, '11111111-aaaa-4aaa-8aaa-aaaaaaaaaaaa.jsonl')
+        os.makedirs(os.path.join(project_dir, '11111111-aaaa-4aaa-8aaa-aaaaaaaaaaaa', 'subagents'))
+        _write_claude_session(first, history)
+        # 续接的会话沿用原会话的记录
+        _write_claude_session(os.path.join(project_dir, 'resumed.jsonl'), history + [
+            user("2026-01-02T09:00:00Z", "再加个测试"),
+            reply("2026-01-02T09:00:10Z", "msg_3", [{"type": "tool_use", "id": "tu_2", "name": "Edit", "input": {}}],
+                  model="claude-opus-4")])
+        _write_claude_session(os.path.join(project_dir, '11111111-aaaa-4aaa-8aaa-aaaaaaaaaaaa', 'subagents',
+                                           'agent-1.jsonl'),
+                              [reply("2026-01-01T10:10:00Z", "msg_4", [{"type": "tool_use", "id": "tu_3",
+                                                                        "name": "Bash", "input": {}}])])
+        exporter = ChatExporter("claude")
+        exporter.parser.base_dir = temp_dir
+
+        index = UsageIndex(os.path.join(temp_dir, 'usage.sqlite'))
+        assert index.refresh(exporter, jobs=1) == (3, [])
+        tables = index.tables()
+        columns, rows = tables['tokens']
+        tokens = [dict(zip(columns, row)) for row in rows]
+        assert [(t['day'], t['model'], t['requests'], t['output_tokens']) for t in tokens] == [
+            ('2026-01-01', 'claude-sonnet-4', 3, 40), ('2026-01-02', 'claude-opus-4', 1, 10)]
+        assert tokens[0]['project'] == 'work/demo' and tokens[0]['cache_read_input_tokens'] == 3000
+        assert tables['tools'][1] == [('Bash', 2, 3, '2026-01-01', '2026-01-01'), ('Edit', 1, 1, '2026-01-02', '2026-01-02')]
+
+        columns, rows = tables['sessions']
+        sessions = {row[0]: dict(zip(columns, row)) for row in rows}
+        assert rows[0][0] == 'resumed'
+        assert (sessions['11111111-aaaa-4aaa-8aaa-aaaaaaaaaaaa']['user_messages'],
+                sessions['11111111-aaaa-4aaa-8aaa-aaaaaaaaaaaa']['assistant_messages'],
+                sessions['11111111-aaaa-4aaa-8aaa-aaaaaaaaaaaa']['duration_seconds'],
+                sessions['11111111-aaaa-4aaa-8aaa-aaaaaaaaaaaa']['tokens']) == (1, 2, 1800, 2240)
+        assert sessions['agent-1']['tool_calls'] == 1
+
+        # 未变化的会话不再统计；追加的会话从上次的偏移继续
+        assert index.refresh(exporter, jobs=1) == (0, [])
+        with open(first, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(reply("2026-01-01T11:00:00Z", "msg_5", []), ensure_ascii=False) + '\n')
+        assert index.refresh(exporter, jobs=1) == (1, [])
+        assert index.tables()['tokens'][1][0][3] == 4
+
+        # 没有 message.id 和 tool_use id 的记录按字节偏移编号，续接统计时不会与之前的记录合并
+        anonymous = {"type": "assistant", "timestamp": "2026-01-01T12:00:00Z",
+                     "message": {"role": "assistant", "model": "claude-sonnet-4",
+                                 "content": [{"type": "tool_use", "name": "Read", "input": {}}]}}
+        for _ in range(2):
+            with open(first, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(anonymous, ensure_ascii=False) + '\n')
+            assert index.refresh(exporter, jobs=1) == (1, [])
+        updated = index.tables()
+        assert updated['tokens'][1][0][3] == 6
+        assert ('Read', 2, 1, '2026-01-01', '2026-01-01') in updated['tools'][1]
+        index.close()
+
+        # 进程池并行统计的结果与串行一致
+        parallel = UsageIndex(os.path.join(temp_dir, 'parallel.sqlite'))
+        assert parallel.refresh(exporter, jobs=2) == (3, [])
+        assert parallel.tables() == updated
+        parallel.close()
+
+        output_dir = os.path.join(temp_dir, 'out')
+        csv_files = write_tables(updated, output_dir)
+        assert [os.path.basename(path) for path in csv_files] == ['usage_tokens.csv', 'usage_tools.csv',
+                                                                  'usage_sessions.csv']
+        with open(csv_files[0], encoding='utf-8') as f:
+            assert f.readline().strip() == ('day,project,model,requests,input_tokens,output_tokens,'
+                                            'cache_creation_input_tokens,cache_read_input_tokens')
+        with open(write_tables(updated, output_dir, 'json')[1], encoding='utf-8') as f:
+            assert json.load(f)[0] == {'tool': 'Bash', 'calls': 2, 'sessions': 3,
+                                       'first_day': '2026-01-01', 'last_day': '2026-01-01'}
+
+        # 格式异常的会话单独报告错误，不影响其他会话
+        broken = _write_claude_session(os.path.join(project_dir, 'broken.jsonl'), [
+            {"type": "assistant", "message": {"id": {"bad": 1}, "role": "assistant", "content": "?"}}])
+        index = UsageIndex(os.path.join(temp_dir, 'broken.sqlite'))
+        count, errors = index.refresh(exporter, jobs=1)
+        assert count == 3 and [path for path, _ in errors] == [broken] and errors[0][1].startswith('TypeError')
+        index.close()
+
+    print("OK 用量统计")
+
+
+def test_sharded_export():
+    """测试分卷导出：按消息数 / 大小拆分，目录列出各部分，部分之间互相链接，未拆分的会话与普通导出相同"""
+    def turn(i):
+        role = "user" if i % 2 == 0 else "assistant"
+        content = f"问题 {i}" if role == "user" else [{"type": "text", "text": f"回答 {i} " + "内容" * 100}]
+        return {"type": role, "timestamp": f"2026-01-02T{8 + i:02d}:00:00.000Z",
+                "message": {"role": role, "content": content}}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        session = _write_claude_session(os.path.join(temp_dir, 'aaaa.jsonl'), [turn(i) for i in range(10)])
+        small = _write_claude_session(os.path.join(temp_dir, 'bbbb.jsonl'), [turn(i) for i in range(3)])
+        plain_dir = os.path.join(temp_dir, 'plain')
+        plain = ChatExporter("claude").export_session(small, plain_dir)
+
+        exporter = ChatExporter("claude")
+        exporter.set_part_limits(max_messages=4)
+        output_dir = os.path.join(temp_dir, 'out')
+        summary = bulk_export(exporter, [session, small], output_dir)
+        assert summary['exported'] == 2 and summary['messages'] == 13
+        base = '2026-01-02_问题 0_aaaa'
+        assert sorted(os.listdir(output_dir)) == sorted([f'{base}.md', f'{base}_part002.md', f'{base}_part003.md',
+                                                         f'{base}_目录.md', os.path.basename(plain)])
+
+        # 只有一个部分的会话与不分卷的导出相同
+        with open(plain, encoding='utf-8') as f, open(os.path.join(output_dir, os.path.basename(plain)),
+                                                         encoding='utf-8') as g:
+            assert f.read().split('\n')[3:] == g.read().split('\n')[3:]
+
+        with open(os.path.join(output_dir, f'{base}_part002.md'), encoding='utf-8') as f:
+            content = f.read()
+        links = (f'[目录](<{base}_目录.md>) · [上一部分](<{base}.md>) · [下一部分](<{base}_part003.md>)')
+        assert content.startswith('# Claude Code 聊天记录（第 2 部分）') and '- 消息数量：4 条' in content
+        assert f'- 分卷：{links}' in content and content.endswith(f'\n{links}\n')
+        assert '问题 4' in content and '回答 7' in content and '问题 8' not in content
+        with open(os.path.join(output_dir, f'{base}_part003.md'), encoding='utf-8') as f:
+            assert '下一部分' not in f.read()
+        with open(os.path.join(output_dir, f'{base}.md'), encoding='utf-8') as f:
+            assert f.readline() == '# Claude Code 聊天记录（第 1 部分）\n'
+        with open(os.path.join(output_dir, f'{base}_目录.md'), encoding='utf-8') as f:
+            index = f.read()
+        assert '- 消息数量：10 条' in index and '- 分卷：共 3 个部分' in index
+        assert (f'| [第 2 部分](<{base}_part002.md>) | 2026-01-02 12:00 ~ 2026-01-02 15:00 | 4 | 问题 4 |'
+                in index)
+
+        # 重新导出未变化的会话不重写任何部分
+        before = {name: os.stat(os.path.join(output_dir, name)).st_mtime_ns for name in os.listdir(output_dir)}
+        assert bulk_export(exporter, [session, small], output_dir, jobs=2)['unchanged'] == 2
+        assert {name: os.stat(os.path.join(output_dir, name)).st_mtime_ns for name in os.listdir(output_dir)} == before
+
+        # 部分数变少时删除多余的旧部分，不再拆分时连同目录一起删除
+        names = lambda path: sorted(name for name in os.listdir(path) if name.startswith(base))
+        exporter.set_part_limits(max_messages=3)
+        bulk_export(exporter, [session], output_dir)
+        assert names(output_dir) == sorted([f'{base}.md', f'{base}_part002.md', f'{base}_part003.md',
+                                            f'{base}_part004.md', f'{base}_目录.md'])
+        exporter.set_part_limits(max_messages=6)
+        exporter.export_session(session, output_dir)
+        assert names(output_dir) == sorted([f'{base}.md', f'{base}_part002.md', f'{base}_目录.md'])
+        exporter.set_part_limits(max_messages=3)
+        bulk_export(exporter, [session], output_dir, jobs=2)
+        exporter.set_part_limits()
+        bulk_export(exporter, [session], output_dir)
+        assert names(output_dir) == [f'{base}.md']
+        with open(os.path.join(output_dir, f'{base}.md'), encoding='utf-8') as f:
+            assert '分卷' not in f.read()
+
+        # 按大小拆分：每个部分的正文不超过上限太多
+        exporter.set_part_limits(max_bytes=1000)
+        size_dir = os.path.join(temp_dir, 'size')
+        assert exporter.export_session(session, size_dir).endswith(f'{base}.md')
+        parts = [name for name in os.listdir(size_dir) if name != f'{base}_目录.md']
+        assert len(parts) == 3
+        assert all(os.path.getsize(os.path.join(size_dir, name)) < 3000 for name in parts)
+
+    print("OK 分卷导出")
+
+
 if __name__ == "__main__":
     print("=== 聊天记录导出工具测试 ===")
     print()
@@ -188,4 +1628,80 @@ if __name__ == "__main__":
     test_markdown_export()
     print()
 
+    test_streaming_export()
+    print()
+
+    test_parallel_bulk_export()
+    print()
+
+    test_incremental_export()
+    print()
+
+    test_message_line_prefilter()
+    print()
+
+    test_session_index()
+    test_select_current_project()
+    print()
+
+    test_search_index()
+    print()
+
+    test_streaming_json_parsers()
+    print()
+
+    test_benchmark_corpus()
+    print()
+
+    test_export_stats()
+    print()
+
+    test_chunk_parallel_parse()
+    print()
+
+    test_chatgpt_conversations_export()
+    print()
+
+    test_wechat_sqlite_parser()
+    print()
+
+    test_time_range_pushdown()
+    print()
+
+    test_lazy_parser_registry()
+    print()
+
+    test_pipeline_export()
+    print()
+
+    test_record_writers()
+    print()
+
+    test_compressed_sessions()
+    print()
+
+    test_tool_blob_dedup()
+    print()
+
+    test_watch_sessions()
+    print()
+
+    test_skip_unchanged_exports()
+    print()
+
+    test_bounded_tool_rendering()
+    print()
+
+    test_message_dedup_and_active_branch()
+    print()
+
+    test_project_timeline()
+    print()
+
+    test_usage_stats()
+    print()
+
+    test_sharded_export()
+    print()
+
     print("=== 所有测试完成 ===")
\ No newline at end of file